@@ -0,0 +1,267 @@
+import sys
+import json
+import time
+import argparse
+import logging
+import pyarrow as pa
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple, Any, Optional, Iterator
+import src.config as config
+from src.batching import MergeBatcher
+from src.etl import get_race_id, deduplicate_rows
+from src.ledger import open_ledger, ledger_entry, COMPLETED_STATUSES
+from src.rollups import sessions
+from src.upsert import upsert_to_fact_table
+from main import download_and_prepare, quarantine_rows, update_rollups, get_process_pool
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+def list_files(s3: object, bucket_name: str, prefix: str) -> List[Dict[str, Any]]:
+    """
+    Lists the telemetry files under a prefix page by page.
+    Returns the identity of each file (bucket, key, ETag and size, as file_identity builds it),
+    taken from the listing so no file needs a head_object call. Other objects are skipped.
+    """
+    files = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            try:
+                get_race_id(obj['Key'])
+            except ValueError:
+                logger.debug("Skipping %s, not a telemetry file", obj['Key'])
+                continue
+            files.append({"bucket": bucket_name, "key": obj['Key'], "etag": obj['ETag'].strip('"'), "size": obj['Size']})
+    return files
+
+
+def group_by_event(files: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Groups files by event_id partition, events and keys in order.
+    """
+    groups = {}
+    for file in sorted(files, key=lambda file: file["key"]):
+        groups.setdefault(get_race_id(file["key"])["event_id"], []).append(file)
+    return OrderedDict(sorted(groups.items()))
+
+
+def plan_batches(groups: Dict[str, List[Dict[str, Any]]], batch_files: int) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Splits the files of each event into batches of up to batch_files, a batch never spans two partitions.
+    """
+    for event_id, files in groups.items():
+        for start in range(0, len(files), batch_files):
+            yield event_id, files[start:start + batch_files]
+
+
+def session_rows(event_id: str, prepared: List[Tuple[Dict[str, Any], Dict[str, Any], pa.Table]]) -> List[Tuple[List[str], pa.Table]]:
+    """
+    Groups the rows of a batch by session and drops rows repeated across the files of each session
+    (see deduplicate_rows), so the fact table write sees one row per key.
+    Returns the file keys and the rows of each session.
+    """
+    by_session = {}
+    for file, _, data in prepared:
+        keys, tables = by_session.setdefault(get_race_id(file["key"])["session_id"], ([], []))
+        keys.append(file["key"])
+        tables.append(data)
+    sessions, dropped = [], 0
+    for keys, tables in by_session.values():
+        data, session_dropped = deduplicate_rows(pa.concat_tables(tables))
+        sessions.append((keys, data))
+        dropped += session_dropped
+    if dropped:
+        logger.info("Dropped %s rows repeated across the files of %s", dropped, event_id)
+    return sessions
+
+
+def commit_batch(event_id: str, prepared: List[Tuple[Dict[str, Any], Dict[str, Any], pa.Table]], write_mode: str) -> None:
+    """
+    Writes the valid files of one event_id batch to the fact table in a single transaction:
+    one upsert commit with direct writes, one staging table and MERGE with Athena.
+    Both are deduplicated across the files of each session first (see session_rows): the upsert expects
+    one row per key and the MERGE fails when several source rows match one.
+    Then refreshes the rollups of every session in the batch.
+    """
+    keys = [file["key"] for file, _, _ in prepared]
+    batch = session_rows(event_id, prepared)
+    if write_mode == 'direct':
+        upsert_to_fact_table(
+            pa.concat_tables([data for _, data in batch]), config.glue_catalog, config.database_name,
+            config.fact_table, config.table_location
+        )
+    else:
+        batcher = MergeBatcher(
+            config.glue_catalog, config.athena, config.database_name, config.table_location,
+            config.athena_catalog, config.fact_table,
+            max_files=len(batch) + 1, max_bytes=sys.maxsize, max_seconds=float('inf')
+        )
+        # One entry per session, the batcher would merge early on a second file of a session
+        for session_keys, data in batch:
+            batcher.add(", ".join(session_keys), data)
+        batcher.flush()
+    logger.info("Committed %s files of %s", len(keys), event_id)
+    for batch_event_id, session_id in sessions(keys):
+        update_rollups(
+            {'event_id': batch_event_id, 'session_id': session_id}, config.glue_catalog, config.database_name,
+            config.fact_table, config.table_location
+        )
+
+
+class Progress:
+    """
+    Counts processed files and rows and reports throughput since the run started.
+    """
+
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.started = time.monotonic()
+        self.counts = {"files": 0, "rows": 0, "succeeded": 0, "invalid": 0, "failed": 0}
+
+    def add(self, status: str, rows: int = 0) -> None:
+        self.counts["files"] += 1
+        self.counts[status] += 1
+        self.counts["rows"] += rows
+
+    def report(self) -> Dict[str, Any]:
+        seconds = max(time.monotonic() - self.started, 1e-9)
+        return {
+            **self.counts,
+            "total_files": self.total_files,
+            "seconds": round(seconds, 3),
+            "files_per_s": round(self.counts["files"] / seconds, 2),
+            "rows_per_s": round(self.counts["rows"] / seconds, 1)
+        }
+
+
+def run_backfill(
+    bucket_name: str,
+    prefix: str,
+    checkpoint: str,
+    batch_files: int = config.batch_max_files,
+    write_mode: str = config.write_mode,
+    engine: str = config.engine,
+    row_validation: bool = config.row_validation,
+    events: Optional[List[str]] = None,
+    pool: Optional[Executor] = None
+) -> Dict[str, Any]:
+    """
+    Loads every telemetry file under a prefix, one event_id partition batch at a time.
+    Files are downloaded in io_workers threads and parsed, validated and transformed in the process pool,
+    the next batch being prepared while the current one commits. Each committed batch is recorded in the
+    checkpoint (a ledger, 'file:<path>' or 'iceberg') with one write, so a run that was stopped skips the
+    files already loaded. Rejected rows are quarantined only once their batch committed, a resumed run
+    loads a failed batch again without quarantining its rows twice.
+    Returns file and row counts with files/s and rows/s.
+    """
+    ledger = open_ledger(checkpoint)
+    files = list_files(config.s3, bucket_name, prefix)
+    todo = [
+        file for file, entry in zip(files, ledger.lookup_many(files))
+        if entry is None or entry["status"] not in COMPLETED_STATUSES
+    ]
+    groups = group_by_event(todo)
+    if events:
+        groups = OrderedDict((event_id, group) for event_id, group in groups.items() if event_id in events)
+    total = sum(len(group) for group in groups.values())
+    logger.info(
+        "Backfilling %s of %s files under s3://%s/%s in %s partitions (%s already done)",
+        total, len(files), bucket_name, prefix, len(groups), len(files) - len(todo)
+    )
+    progress = Progress(total)
+
+    with ThreadPoolExecutor(max_workers=config.io_workers) as executor:
+
+        def submit(batch: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], float, Future]]:
+            return [
+                (file, time.time(), executor.submit(download_and_prepare, bucket_name, file["key"], engine, row_validation, pool))
+                for file in batch
+            ]
+
+        batches = plan_batches(groups, batch_files)
+        current = next(batches, None)
+        futures = submit(current[1]) if current else []
+        while current is not None:
+            event_id = current[0]
+            # Start preparing the next batch before this one commits
+            upcoming = next(batches, None)
+            upcoming_futures = submit(upcoming[1]) if upcoming else []
+            prepared, invalid, entries, rejected_rows = [], [], [], {}
+            start_times = {file["key"]: started for file, started, _ in futures}
+            for file, started, future in futures:
+                try:
+                    result, data, rejected = future.result()
+                except Exception as e:
+                    logger.error("Failed to prepare %s: %s", file["key"], e)
+                    entries.append(ledger_entry(file, 'failed', started, error=str(e)))
+                    progress.add('failed')
+                    continue
+                rejected_rows[file["key"]] = rejected
+                if result["is_valid"]:
+                    prepared.append((file, result, data))
+                else:
+                    logger.error("Data validation failed for %s: %s", file["key"], result["errors"])
+                    invalid.append((file, result, None))
+            committed = []
+            if prepared:
+                try:
+                    commit_batch(event_id, prepared, write_mode)
+                    committed = prepared
+                except Exception as e:
+                    logger.error("Failed to commit batch of %s: %s", event_id, e)
+                    for file, _, _ in prepared:
+                        entries.append(ledger_entry(file, 'failed', start_times[file["key"]], error=str(e)))
+                        progress.add('failed')
+            for file, result, data in committed + invalid:
+                status = 'invalid' if data is None else 'succeeded'
+                try:
+                    quarantine_rows(file["key"], rejected_rows[file["key"]])
+                except Exception as e:
+                    # Loaded again on resume, the upsert or MERGE makes the second load harmless
+                    logger.error("Failed to quarantine rows of %s: %s", file["key"], e)
+                    entries.append(ledger_entry(file, 'failed', start_times[file["key"]], error=str(e)))
+                    progress.add('failed')
+                    continue
+                entries.append(ledger_entry(file, status, start_times[file["key"]], result))
+                progress.add(status, 0 if data is None else data.num_rows)
+            ledger.record_many(entries)
+            report = progress.report()
+            logger.info(
+                "%s/%s files, %s rows, %s files/s, %s rows/s",
+                report["files"], total, report["rows"], report["files_per_s"], report["rows_per_s"]
+            )
+            current, futures = upcoming, upcoming_futures
+    return progress.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load every telemetry file under an S3 prefix, resuming from a checkpoint")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--checkpoint", default="file:backfill_checkpoint.jsonl", help="'file:<path>' or 'iceberg' for the ledger table")
+    parser.add_argument("--batch-files", type=int, default=config.batch_max_files, help="files committed together, per event_id")
+    parser.add_argument("--workers", type=int, default=config.cpu_workers, help="processes parsing and validating")
+    parser.add_argument("--io-workers", type=int, default=config.io_workers, help="threads downloading")
+    parser.add_argument("--write-mode", choices=["athena", "direct"], default=config.write_mode)
+    parser.add_argument("--engine", choices=["pandas", "arrow"], default=config.engine)
+    parser.add_argument("--row-validation", action="store_true", default=config.row_validation)
+    parser.add_argument("--event", action="append", dest="events", help="only this event_id, repeatable")
+    args = parser.parse_args()
+
+    config.cpu_workers = args.workers
+    config.io_workers = args.io_workers
+    summary = run_backfill(
+        args.bucket, args.prefix, args.checkpoint, args.batch_files, args.write_mode, args.engine,
+        args.row_validation, args.events, get_process_pool()
+    )
+    print(json.dumps(summary, indent=2))
+    sys.exit(1 if summary["failed"] else 0)
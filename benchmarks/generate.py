@@ -0,0 +1,114 @@
+import argparse
+import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+from typing import Optional
+
+
+# Value ranges of realistic samples, inside F1TelemetryValidator.validation_rules
+DRIVER_NUMBERS = [1, 4, 10, 11, 14, 16, 18, 20, 22, 23, 24, 27, 31, 44, 55, 63, 77, 81, 2, 3]
+START_TIME = datetime.datetime(2023, 3, 5, 15, 0, 0, tzinfo=datetime.UTC)
+
+
+def generate_batch(
+    rng: np.random.Generator,
+    first_sample: int,
+    samples: int,
+    drivers: int,
+    sample_rate_hz: float,
+    bad_fraction: float
+) -> pa.Table:
+    """
+    Generates telemetry for samples time steps of every driver, starting at time step first_sample.
+    Rows are ordered by time, then driver, like the car data exports.
+    """
+    rows = samples * drivers
+    step = np.repeat(np.arange(first_sample, first_sample + samples, dtype=np.int64), drivers)
+    step_us = int(1_000_000 / sample_rate_hz)
+    offsets_us = step * step_us
+    # Drivers are not sampled at exactly the same instant, samples have ms precision
+    offsets_us += rng.integers(0, max(step_us // 2000, 1), rows) * 1000
+    time_utc = pa.array(
+        np.datetime64(START_TIME.replace(tzinfo=None), 'us') + offsets_us.astype('timedelta64[us]')
+    )
+    throttle = rng.integers(0, 101, rows)
+    data = {
+        'timeUtc': pc.strftime(time_utc, format='%Y-%m-%dT%H:%M:%SZ'),
+        'driverNumber': np.tile(np.array(DRIVER_NUMBERS[:drivers] if drivers <= len(DRIVER_NUMBERS) else np.arange(1, drivers + 1)), samples),
+        'rpm': rng.integers(9000, 12500, rows),
+        'speed': rng.integers(60, 340, rows),
+        'gear': rng.integers(1, 9, rows),
+        'throttle': throttle,
+        'brake': (throttle < 10).astype(np.int64),
+        'drs': rng.choice([0, 1, 8, 10, 12, 14], rows),
+    }
+    table = pa.table(data)
+    if bad_fraction:
+        table = corrupt(rng, table, bad_fraction)
+    return table
+
+
+def corrupt(rng: np.random.Generator, table: pa.Table, bad_fraction: float) -> pa.Table:
+    """
+    Replaces values of about bad_fraction of the rows with out of range or unparsable values.
+    Columns with bad rows are written as text.
+    """
+    bad = rng.random(table.num_rows) < bad_fraction
+    if not bad.any():
+        return table
+    column = rng.choice(['rpm', 'speed', 'gear', 'timeUtc'], bad.sum())
+    for name in ['rpm', 'speed', 'gear', 'timeUtc']:
+        rows = np.flatnonzero(bad)[column == name]
+        if not len(rows):
+            continue
+        values = table.column(name).cast(pa.string()).to_numpy(zero_copy_only=False).astype(object)
+        values[rows] = 'n/a' if name == 'timeUtc' else rng.choice(['-1', '99999', 'err'], len(rows))
+        table = table.set_column(table.schema.get_field_index(name), name, pa.array(values, pa.string()))
+    return table
+
+
+def generate_csv(
+    path: str,
+    rows: int,
+    drivers: int = 20,
+    sample_rate_hz: float = 4.0,
+    bad_fraction: float = 0.0,
+    seed: int = 0,
+    batch_rows: int = 1_000_000
+) -> int:
+    """
+    Writes a deterministic telemetry CSV with about rows rows (rounded to whole time steps of all drivers).
+    The same arguments always produce the same file. Large files are written in batches of batch_rows.
+    Returns number of rows written.
+    """
+    rng = np.random.default_rng(seed)
+    samples = max(rows // drivers, 1)
+    batch_samples = max(batch_rows // drivers, 1)
+    written = 0
+    writer: Optional[pacsv.CSVWriter] = None
+    with open(path, 'wb') as file:
+        for first_sample in range(0, samples, batch_samples):
+            table = generate_batch(rng, first_sample, min(batch_samples, samples - first_sample), drivers, sample_rate_hz, bad_fraction)
+            # Every batch is written as text so the columns keep one type across batches
+            table = table.cast(pa.schema([pa.field(name, pa.string()) for name in table.column_names]))
+            if writer is None:
+                writer = pacsv.CSVWriter(file, table.schema, write_options=pacsv.WriteOptions(quoting_style='none'))
+            writer.write_table(table)
+            written += table.num_rows
+        if writer is not None:
+            writer.close()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic F1 telemetry CSV")
+    parser.add_argument("path", help="output file, e.g. 23001A_R.csv")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--sample-rate", type=float, default=4.0, help="samples per second per driver")
+    parser.add_argument("--bad-fraction", type=float, default=0.0, help="fraction of rows with invalid values")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(generate_csv(args.path, args.rows, args.drivers, args.sample_rate, args.bad_fraction, args.seed))
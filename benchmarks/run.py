@@ -0,0 +1,248 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import resource
+import subprocess
+import tracemalloc
+import pyarrow as pa
+from typing import List, Dict, Any, Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generate import generate_csv
+from src import clients, etl, upsert
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# A stage this much slower than the previous run with the same parameters is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+class LocalS3:
+    """
+    Stand-in for the S3 client that serves objects from a local directory.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None) -> Dict[str, Any]:
+        path = os.path.join(self.root, Key)
+        if Range is None:
+            return {'Body': open(path, 'rb')}
+        size = os.path.getsize(path)
+        start, end = (int(value) for value in Range.removeprefix("bytes=").split("-"))
+        end = min(end, size - 1)
+        with open(path, 'rb') as file:
+            file.seek(start)
+            body = file.read(end - start + 1)
+        return {'Body': io.BytesIO(body), 'ContentRange': f"bytes {start}-{end}/{size}"}
+
+    def head_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        size = os.path.getsize(os.path.join(self.root, Key))
+        return {'ETag': f'"{size}"', 'ContentLength': size}
+
+
+def measure(stage: str, rows: int, func: Callable, *args, trace_allocations: bool = True) -> tuple:
+    """
+    Runs func once and records wall time, CPU time, throughput, allocations and peak RSS.
+    Python allocations (including numpy buffers) come from tracemalloc, arrow allocations from its memory pool.
+    Returns what func returned and the stage measurements.
+    """
+    if trace_allocations:
+        tracemalloc.start()
+    arrow_before = pa.total_allocated_bytes()
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    output = func(*args)
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    py_peak = tracemalloc.get_traced_memory()[1] if trace_allocations else None
+    if trace_allocations:
+        tracemalloc.stop()
+    stats = {
+        "stage": stage,
+        "rows": rows,
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "rows_per_s": round(rows / wall, 1) if wall else None,
+        "py_alloc_peak_bytes": py_peak,
+        "arrow_alloc_bytes": pa.total_allocated_bytes() - arrow_before,
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    }
+    print(
+        f"{stage:<24} {wall:>9.3f}s {stats['rows_per_s'] or 0:>14,.0f} rows/s"
+        f"  peak RSS {stats['peak_rss_bytes'] / 2**20:>8.1f} MiB"
+    )
+    return output, stats
+
+
+def run(
+    rows: int,
+    drivers: int,
+    sample_rate_hz: float,
+    bad_fraction: float,
+    seed: int,
+    engine: str,
+    data_dir: str,
+    trace_allocations: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Generates (or reuses) a telemetry file and times every ETL stage on it against a local
+    SQLite iceberg catalog. Returns the measurements of each stage. When the pandas validation raises,
+    the run ends with a validate_data entry holding the error and counts as failed (see failed_stages).
+    """
+    key = "23001A_R.csv"
+    file_dir = os.path.join(data_dir, f"rows{rows}_drivers{drivers}_hz{sample_rate_hz}_bad{bad_fraction}_seed{seed}")
+    if not os.path.exists(os.path.join(file_dir, key)):
+        os.makedirs(file_dir, exist_ok=True)
+        print(f"Generating {rows:,} rows in {file_dir}")
+        generate_csv(os.path.join(file_dir, key), rows, drivers, sample_rate_hz, bad_fraction, seed)
+    warehouse = os.path.join(data_dir, "warehouse")
+    shutil.rmtree(warehouse, ignore_errors=True)
+    catalog = clients.use_local_catalog(warehouse, namespace="bench")
+    s3 = LocalS3(file_dir)
+    option = dict(trace_allocations=trace_allocations)
+
+    results = []
+    calls = 10_000
+    _, stats = measure("get_race_id", calls, lambda: [etl.get_race_id(f"prefix/{key}") for _ in range(calls)], **option)
+    results.append(stats)
+    race_id = etl.get_race_id(key)
+
+    if engine == "arrow":
+        data, stats = measure("read_file_arrow", rows, etl.read_file_arrow, "bench", key, s3, **option)
+        results.append(stats)
+        (result, data), stats = measure("validate_arrow_data", data.num_rows, etl.validate_arrow_data, data, **option)
+        results.append(stats)
+        transform = etl.transform_arrow_data
+    else:
+        data, stats = measure("read_file", rows, etl.read_file, "bench", key, s3, **option)
+        results.append(stats)
+        try:
+            result, stats = measure("validate_data", len(data), etl.validate_data, data, **option)
+        except TypeError as error:
+            # The pandas checks compare raw strings against numbers when a column is not numeric
+            print(f"validate_data raised {error!r}, run failed")
+            results.append({"stage": "validate_data", "rows": len(data), "error": repr(error)})
+            return results
+        results.append(stats)
+        transform = etl.transform_data
+    if not result["is_valid"]:
+        # Invalid files stop at validation in the pipeline too
+        print("Validation failed, remaining stages skipped")
+        return results
+    data, stats = measure("transform_data", len(data), transform, data, race_id, **option)
+    results.append(stats)
+    _, stats = measure("primary_keys", len(data), upsert.primary_keys, etl.to_arrow_table(data), **option)
+    results.append(stats)
+    _, stats = measure(
+        "load_to_iceberg_table", len(data), etl.load_to_iceberg_table,
+        data, catalog, "bench", f"file://{warehouse}/stg", **option
+    )
+    results.append(stats)
+    return results
+
+
+def failed_stages(stages: List[Dict[str, Any]]) -> List[str]:
+    """
+    Returns the stages that raised instead of finishing.
+    """
+    return [stage["stage"] for stage in stages if "error" in stage]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(record: Dict[str, Any], results_dir: str = RESULTS_DIR) -> str:
+    """
+    Stores a benchmark run as JSON. Returns its path.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    name = f"{record['timestamp'].replace(':', '')}_{(record['commit'] or 'nocommit')[:10]}.json"
+    path = os.path.join(results_dir, name)
+    with open(path, "w") as file:
+        json.dump(record, file, indent=2)
+    return path
+
+
+def previous_run(record: Dict[str, Any], results_dir: str = RESULTS_DIR) -> Optional[Dict[str, Any]]:
+    """
+    Returns the latest stored run with the same parameters, if any.
+    """
+    if not os.path.isdir(results_dir):
+        return None
+    runs = []
+    for name in sorted(os.listdir(results_dir)):
+        with open(os.path.join(results_dir, name)) as file:
+            run = json.load(file)
+        if run["params"] == record["params"] and run["timestamp"] < record["timestamp"]:
+            runs.append(run)
+    return runs[-1] if runs else None
+
+
+def compare(record: Dict[str, Any], previous: Dict[str, Any]) -> List[str]:
+    """
+    Compares wall time per stage with a previous run. Returns the stages that regressed.
+    """
+    before = {stage["stage"]: stage for stage in previous["stages"]}
+    regressions = []
+    print(f"\nCompared with {(previous['commit'] or 'nocommit')[:10]} ({previous['timestamp']}):")
+    for stage in record["stages"]:
+        if "error" in stage or not before.get(stage["stage"], {}).get("wall_s"):
+            continue
+        change = stage["wall_s"] / before[stage["stage"]]["wall_s"] - 1
+        flag = "  REGRESSION" if change > REGRESSION_THRESHOLD else ""
+        print(f"{stage['stage']:<24} {change:>+8.1%}{flag}")
+        if flag:
+            regressions.append(stage["stage"])
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every ETL stage on synthetic telemetry")
+    parser.add_argument("--rows", type=int, default=100_000, help="10k to 50M rows")
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--sample-rate", type=float, default=4.0)
+    parser.add_argument("--bad-fraction", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=["pandas", "arrow"], default="pandas")
+    parser.add_argument("--data-dir", default=os.path.join("/tmp", "pipeline-bench"))
+    parser.add_argument("--no-alloc", action="store_true", help="skip tracemalloc, which slows python heavy stages")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    params = {
+        "rows": args.rows, "drivers": args.drivers, "sample_rate_hz": args.sample_rate,
+        "bad_fraction": args.bad_fraction, "seed": args.seed, "engine": args.engine,
+        "trace_allocations": not args.no_alloc
+    }
+    stages = run(
+        args.rows, args.drivers, args.sample_rate, args.bad_fraction, args.seed, args.engine,
+        args.data_dir, not args.no_alloc
+    )
+    record = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": sys.version.split()[0],
+        "pyarrow": pa.__version__,
+        "params": params,
+        "stages": stages,
+        "failed": failed_stages(stages)
+    }
+    previous = previous_run(record)
+    regressions = compare(record, previous) if previous else []
+    if not args.no_save:
+        print(f"\nSaved {save(record)}")
+    if record["failed"]:
+        print(f"Failed stages: {', '.join(record['failed'])}")
+    sys.exit(1 if regressions or record["failed"] else 0)
@@ -1,10 +1,25 @@
 import json
+import time
+import multiprocessing
 import urllib.parse
-import boto3
 import pandas as pd
+import pyarrow as pa
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Tuple, Any, Optional
 import src.config as config
+import src.metrics as metrics
+import src.clients as clients
 import src.data_definition
-from src.etl import get_race_id, read_file, validate_data, transform_data, load_to_iceberg_table, merge_to_fact_table
+from src.catalog_cache import call_counts, record_calls
+from src.batching import MergeBatcher, BatchMergeError
+from src.upsert import upsert_to_fact_table
+from src.rollups import refresh_rollups, sessions
+from src.ledger import get_ledger, file_identity, ledger_entry, record_entry, COMPLETED_STATUSES
+from src.etl import (
+    get_race_id, download_file, parse_file, parse_file_arrow, validate_data, transform_data, validate_arrow_data,
+    transform_arrow_data, validate_arrow_rows, to_arrow_table, deduplicate_rows, load_to_quarantine_table,
+    load_to_iceberg_table, stream_to_iceberg_table, merge_to_fact_table
+)
 import logging
 
 
@@ -20,7 +35,119 @@ if not logger.hasHandlers():
 
 print('Loading main function')
 
-def main(bucket, key):
+def prepare_file(body: bytes, key: str, engine: str, row_validation: bool) -> Tuple[Dict[str, Any], Optional[pa.Table], Optional[pa.Table]]:
+    """
+    Parses, validates and transforms one downloaded CSV (plain, gzip or zstd) or Parquet file,
+    then drops repeated samples (see deduplicate_rows).
+    This is the CPU bound part of the pipeline, so it can run in a process pool.
+    Returns the validation result, the rows to stage and the rows to quarantine.
+    """
+    race_id = get_race_id(key)
+    rejected = None
+    with metrics.stage('parse') as stage:
+        # CSV is parsed, validated and loaded as arrow without a pandas copy
+        data = parse_file_arrow(body, key) if engine == 'arrow' else parse_file(body, key)
+        stage["bytes_in"] = len(body)
+        stage["rows_out"] = len(data)
+    with metrics.stage('validate') as stage:
+        stage["rows_in"] = len(data)
+        if row_validation:
+            # Bad rows go to the quarantine table and the clean rows are loaded
+            result, data, rejected = validate_arrow_rows(data)
+            result["is_valid"] = data.num_rows > 0
+        elif engine == 'arrow':
+            result, data = validate_arrow_data(data)
+        else:
+            result = validate_data(data)
+        stage["rows_out"] = len(data) if result["is_valid"] else 0
+    if not result["is_valid"]:
+        return result, None, rejected
+    with metrics.stage('transform') as stage:
+        stage["rows_in"] = len(data)
+        if engine == 'arrow' or row_validation:
+            data = transform_arrow_data(data, race_id)
+        else:
+            data = transform_data(data, race_id)
+        data, result["rows_dropped"] = deduplicate_rows(to_arrow_table(data))
+        stage["rows_dropped"] = result["rows_dropped"]
+        stage["rows_out"] = data.num_rows
+    return result, data, rejected
+
+
+def download_and_prepare(
+    bucket: str, key: str, engine: str, row_validation: bool, pool: Optional[Executor] = None
+) -> Tuple[Dict[str, Any], Optional[pa.Table], Optional[pa.Table]]:
+    """
+    Downloads one file and prepares it (in the process pool when given).
+    Returns the validation result, the rows to stage and the rows to quarantine.
+    """
+    with metrics.stage('download') as stage:
+        body = download_file(bucket_name=bucket, key_value=key, s3=config.s3)
+        stage["bytes_read"] = len(body)
+    if pool is None:
+        result, data, rejected = prepare_file(body, key, engine, row_validation)
+    else:
+        # Stages measured in the worker process are added to this invocation
+        (result, data, rejected), stages = pool.submit(
+            metrics.call_with_metrics, prepare_file, body, key, engine, row_validation
+        ).result()
+        if metrics.current() is not None:
+            metrics.current().merge(stages)
+    del body
+    if result["is_valid"]:
+        result["rows_loaded"] = data.num_rows
+    return result, data, rejected
+
+
+def quarantine_rows(key: str, rejected: Optional[pa.Table]) -> None:
+    """
+    Appends the rejected rows of one file to the quarantine table.
+    """
+    if rejected is None:
+        return
+    with metrics.stage('quarantine') as stage:
+        stage["rows_in"] = rejected.num_rows
+        load_to_quarantine_table(rejected, get_race_id(key), key, config.glue_catalog, config.database_name, config.table_location)
+
+
+def prepare_record(bucket: str, key: str, engine: str, row_validation: bool, pool: Optional[Executor] = None) -> Tuple[Dict[str, Any], Optional[pa.Table]]:
+    """
+    Downloads one file, prepares it (in the process pool when given) and quarantines its rejected rows.
+    Returns the validation result and the rows to stage.
+    """
+    result, data, rejected = download_and_prepare(bucket, key, engine, row_validation, pool)
+    quarantine_rows(key, rejected)
+    return result, data
+
+
+def update_rollups(race_id: Dict[str, str], catalog_name: object, database_name: str, fact_table: str, table_location: str) -> None:
+    """
+    Refreshes the rollup tables for the event and session just loaded into the fact table, when enabled.
+    Errors are logged and not raised: the data is committed already, and failing the file would only
+    load it again. The next file of the session refreshes the rollups again.
+    """
+    if not config.rollups:
+        return
+    try:
+        with metrics.stage('rollups'):
+            refresh_rollups(catalog_name, database_name, fact_table, table_location, race_id['event_id'], race_id['session_id'])
+    except Exception as e:
+        logger.error("Failed to refresh rollups of %s %s: %s", race_id['event_id'], race_id['session_id'], e)
+
+
+def run_file(
+    bucket: str,
+    key: str,
+    streaming: bool,
+    engine: str,
+    row_validation: bool,
+    write_mode: str,
+    pool: Optional[Executor] = None
+) -> Dict[str, Any]:
+    """
+    Loads one file into the fact table.
+    Returns the validation result.
+    """
     s3=config.s3
     athena=config.athena
     catalog_name = config.glue_catalog
@@ -29,24 +156,296 @@ def main(bucket, key):
     dst_table_name= config.fact_table
     athena_catalog = config.athena_catalog
 
-    try:
-        logger.info('Starting ETL process for bucket: %s, key: %s', bucket, key)
-        race_id = get_race_id(key)
-        df = read_file(bucket_name=bucket, key_value=key, s3= s3)
-        result = validate_data(df)
+    race_id = get_race_id(key)
+    if write_mode == 'direct':
+        # Upsert straight into the fact table, no staging table or Athena MERGE
+        if streaming:
+            logger.warning("Streaming is not supported with direct writes, reading %s at once", key)
+        result, data = prepare_record(bucket, key, engine, row_validation, pool)
         if result["is_valid"]:
-            df = transform_data(df, race_id)
-            table = load_to_iceberg_table(df, catalog_name, database_name, table_location)
-            logger.info("Data loaded in staging table: %s", table)
-            merge_to_fact_table(athena, athena_catalog, database_name, table_location, table, dst_table_name)
-            logger.info("Data successfully merged in fact table: %s", dst_table_name)
+            with metrics.stage('upsert') as stage:
+                stage["rows_in"] = data.num_rows
+                upsert_to_fact_table(data, catalog_name, database_name, dst_table_name, table_location)
+            logger.info("Data successfully upserted in fact table: %s", dst_table_name)
+            update_rollups(race_id, catalog_name, database_name, dst_table_name, table_location)
         else:
             logger.error("Data validation failed")
             for error in result["errors"]:
                 logger.error(error)
+        return result
+    if streaming:
+        # Validate, transform and stage the file chunk by chunk
+        with metrics.stage('stream') as stage:
+            result, table, rejected = stream_to_iceberg_table(
+                bucket, key, s3, race_id, catalog_name, database_name, table_location, config.chunk_size, engine,
+                row_validation
+            )
+            stage["rows_out"] = result.get("rows_loaded", 0)
+    else:
+        rejected = None
+        result, data = prepare_record(bucket, key, engine, row_validation, pool)
+        if result["is_valid"]:
+            with metrics.stage('stage') as stage:
+                stage["rows_in"] = data.num_rows
+                table = load_to_iceberg_table(data, catalog_name, database_name, table_location)
+    if result["is_valid"]:
+        logger.info("Data loaded in staging table: %s", table)
+        with metrics.stage('merge'):
+            merge_to_fact_table(athena, athena_catalog, database_name, table_location, table, dst_table_name, catalog_name)
+        logger.info("Data successfully merged in fact table: %s", dst_table_name)
+        # Streamed rejects are quarantined once the clean rows are merged, a failed merge is retried without them
+        quarantine_rows(key, rejected)
+        update_rollups(race_id, catalog_name, database_name, dst_table_name, table_location)
+    else:
+        # Nothing is staged for an invalid file and it is not retried
+        quarantine_rows(key, rejected)
+        logger.error("Data validation failed")
+        for error in result["errors"]:
+            logger.error(error)
+    return result
+
+
+def main(
+    bucket,
+    key,
+    streaming=config.streaming,
+    engine=config.engine,
+    row_validation=config.row_validation,
+    write_mode=config.write_mode,
+    pool: Optional[Executor] = None
+):
+    # Runs outside of lambda_handler measure their own invocation
+    invocation = metrics.start(bucket=bucket, key=key) if metrics.current() is None else None
+    catalog_calls = call_counts(clients.peek('catalog')) if invocation is not None else {}
+    try:
+        logger.info('Starting ETL process for bucket: %s, key: %s', bucket, key)
+        get_race_id(key)
+        ledger = get_ledger()
+        if ledger is not None:
+            # Re-delivered events for an already loaded file stop here
+            identity = file_identity(config.s3, bucket, key)
+            entry = ledger.lookup(identity)
+            if entry is not None and entry["status"] in COMPLETED_STATUSES:
+                logger.info("Skipping %s, already processed with status %s", key, entry["status"])
+                return {"is_valid": entry["status"] == 'succeeded', "errors": [], "skipped": True}
+        started = time.time()
+        try:
+            result = run_file(bucket, key, streaming, engine, row_validation, write_mode, pool)
+        except Exception as e:
+            if ledger is not None:
+                record_entry(ledger, ledger_entry(identity, 'failed', started, error=str(e)))
+            raise
+        if ledger is not None:
+            # The file is in the fact table already, a ledger failure must not report it as failed
+            record_entry(ledger, ledger_entry(identity, 'succeeded' if result["is_valid"] else 'invalid', started, result))
+        return result
     except Exception as e:
         logger.exception("ETL process failed: %s", e)
         raise
+    finally:
+        if invocation is not None:
+            record_calls(clients.peek('catalog'), catalog_calls, 1)
+            metrics.finish()
+
+
+def get_event_records(event: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+    """
+    Flattens an S3 event, or an SQS batch of S3 events, into (item_id, bucket, key) tuples.
+    The item id is the SQS message id, or the object key for direct S3 events.
+    """
+    records = []
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            body = json.loads(record['body'])
+            s3_records = body.get('Records', [])
+            item_id = record['messageId']
+        else:
+            s3_records = [record]
+            item_id = None
+        for s3_record in s3_records:
+            if 's3' not in s3_record:
+                continue
+            bucket = s3_record['s3']['bucket']['name']
+            key = urllib.parse.unquote_plus(s3_record['s3']['object']['key'], encoding='utf-8')
+            records.append((item_id or key, bucket, key))
+    return records
+
+
+_process_pool = None
+_process_pool_unavailable = False
+
+
+def get_process_pool() -> Optional[Executor]:
+    """
+    Returns the process pool used for parsing and validation, kept for warm invocations.
+    Lambda has no /dev/shm, so when a process pool cannot be started the work stays in the calling threads
+    (None is returned) and later calls do not try again.
+    """
+    global _process_pool, _process_pool_unavailable
+    if _process_pool is None and not _process_pool_unavailable and config.cpu_workers > 1:
+        try:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=config.cpu_workers,
+                mp_context=multiprocessing.get_context('forkserver')
+            )
+        except (OSError, NotImplementedError) as e:
+            logger.warning("Process pool not available, parsing in threads: %s", e)
+            _process_pool_unavailable = True
+    return _process_pool
+
+
+def batch_record(
+    batcher: MergeBatcher,
+    bucket: str,
+    key: str,
+    pool: Optional[Executor] = None,
+    pending: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Prepares one file and adds its rows to the merge batch instead of merging it on its own.
+    With the ledger enabled, already processed files are skipped and the file's ledger details
+    are put in pending, to be recorded once its batch is merged.
+    """
+    logger.info('Starting batched ETL process for bucket: %s, key: %s', bucket, key)
+    ledger = get_ledger()
+    if ledger is not None:
+        identity = file_identity(config.s3, bucket, key)
+        entry = ledger.lookup(identity)
+        if entry is not None and entry["status"] in COMPLETED_STATUSES:
+            logger.info("Skipping %s, already processed with status %s", key, entry["status"])
+            return {"is_valid": entry["status"] == 'succeeded', "errors": [], "skipped": True}
+        pending[key] = {"identity": identity, "started": time.time(), "result": None}
+    result, data = prepare_record(bucket, key, config.engine, config.row_validation, pool)
+    if ledger is not None:
+        pending[key]["result"] = result
+    if result["is_valid"]:
+        batcher.add(key, data)
+    else:
+        logger.error("Data validation failed for %s", key)
+        for error in result["errors"]:
+            logger.error(error)
+    return result
+
+
+def session_groups(keys: List[str]) -> List[List[str]]:
+    """
+    Groups file keys by event and session, in order. Files of one session share a staging table
+    (see staging_table_name), so the files of a group must be loaded one after another.
+    Keys that are not telemetry file names are a group of their own and fail in main.
+    """
+    groups = {}
+    for key in keys:
+        try:
+            race_id = get_race_id(key)
+            group = (race_id['event_id'], race_id['session_id'])
+        except ValueError:
+            group = key
+        groups.setdefault(group, []).append(key)
+    return list(groups.values())
+
+
+def process_records(records: List[Tuple[str, str, str]], merge_batch: bool = config.merge_batch) -> List[str]:
+    """
+    Runs the ETL for every file of the records concurrently, once per key: a key delivered by several
+    records is loaded once and its outcome applies to all of them.
+    S3, Glue and Athena calls run in a thread pool and parsing and validation in the process pool.
+    Files of the same event and session run one after another (see session_groups).
+    With merge_batch the files are merged into the fact table in batches (see MergeBatcher).
+    Returns the item ids of the records that failed.
+    """
+    pool = get_process_pool()
+    failures = []
+    failed_keys = {}
+    item_ids = {}
+    buckets = {}
+    for item_id, bucket, key in records:
+        item_ids.setdefault(key, []).append(item_id)
+        buckets.setdefault(key, bucket)
+
+    def fail(keys: List[str], error: Exception) -> None:
+        for key in keys:
+            logger.error("Failed to process %s: %s", key, error)
+            failed_keys[key] = error
+            failures.extend(item_id for item_id in item_ids[key] if item_id not in failures)
+
+    def run_group(keys: List[str]) -> Dict[str, Any]:
+        outcomes = {}
+        for key in keys:
+            try:
+                if batcher is None:
+                    outcomes[key] = main(buckets[key], key, pool=pool)
+                else:
+                    outcomes[key] = batch_record(batcher, buckets[key], key, pool, pending)
+            except Exception as e:
+                outcomes[key] = e
+        return outcomes
+
+    batcher = None
+    pending = {}
+    loaded = []
+    # Direct writes have no staging table to coalesce
+    if merge_batch and config.write_mode != 'direct':
+        batcher = MergeBatcher(
+            config.glue_catalog, config.athena, config.database_name, config.table_location,
+            config.athena_catalog, config.fact_table
+        )
+    with ThreadPoolExecutor(max_workers=config.io_workers) as executor:
+        futures = [executor.submit(run_group, group) for group in session_groups(list(item_ids))]
+        for future in futures:
+            for key, outcome in future.result().items():
+                if isinstance(outcome, BatchMergeError):
+                    fail(outcome.keys, outcome)
+                elif isinstance(outcome, Exception):
+                    fail([key], outcome)
+                elif batcher is not None and outcome["is_valid"] and not outcome.get("skipped"):
+                    loaded.append(key)
+    if batcher is not None:
+        try:
+            batcher.flush()
+        except BatchMergeError as e:
+            fail(e.keys, e)
+        # Rollups of batched files are refreshed once per session, after every batch is merged
+        merged = [key for key in loaded if key not in failed_keys]
+        for event_id, session_id in sessions(merged):
+            update_rollups(
+                {'event_id': event_id, 'session_id': session_id}, config.glue_catalog, config.database_name,
+                config.fact_table, config.table_location
+            )
+    # Batched files are only recorded once their batch is merged
+    ledger = get_ledger()
+    for key, file in pending.items():
+        if key in failed_keys:
+            entry = ledger_entry(file["identity"], 'failed', file["started"], error=str(failed_keys[key]))
+        else:
+            status = 'succeeded' if file["result"]["is_valid"] else 'invalid'
+            entry = ledger_entry(file["identity"], status, file["started"], file["result"])
+        record_entry(ledger, entry)
+    return failures
+
+
+def lambda_handler(event, context):
+    """
+    Processes every S3 record of the event concurrently.
+    For SQS batches a partial batch response is returned, so only the failed messages are retried
+    (requires ReportBatchItemFailures on the event source mapping).
+    Direct S3 invocations raise when any record failed, so Lambda retries the event.
+    """
+    metrics.start(request_id=getattr(context, 'aws_request_id', None))
+    catalog_calls = call_counts(clients.peek('catalog'))
+    try:
+        records = get_event_records(event)
+        logger.info("Received %s records", len(records))
+        with metrics.stage('invocation') as stage:
+            failures = process_records(records)
+            stage["files"] = len(records)
+            stage["failed_items"] = len(failures)
+        record_calls(clients.peek('catalog'), catalog_calls, len(records))
+    finally:
+        metrics.finish()
+    if failures and not any(record.get('eventSource') == 'aws:sqs' for record in event.get('Records', [])):
+        raise RuntimeError(f"Failed to process keys: {failures}")
+    return {"batchItemFailures": [{"itemIdentifier": item_id} for item_id in failures]}
+
 
 if __name__ == "__main__":
     bucket = "telem-data"
@@ -55,35 +454,3 @@ if __name__ == "__main__":
         main(bucket, key)
     except Exception as e:
         logger.error("Main execution failed: %s", e)
-
-
-# def lambda_handler(event, context):
-#     #print("Received event: " + json.dumps(event, indent=2))
-
-#     # Get the object from the event and show its content type
-#     bucket = event['Records'][0]['s3']['bucket']['name']
-#     key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
-#     try:
-#         s3=config.s3
-#         catalog_name = config.glue_catalog
-#         database_name = config.database_name
-#         table_location= config.table_location
-
-#         race_id = get_race_id(key)
-
-#         df = read_file(bucket_name=bucket, key_value=key, s3= s3)
-#         result = validate_data(df)
-
-#         if result["is_valid"]:
-#             transform_data(df, race_id)
-#             load_to_iceberg_table(df, catalog_name, database_name, table_location)
-#             print("CSV schema and data is valid")
-#         else:
-#             print("data validation failed")
-#             for error in result["errors"]:
-#                 print(error)
-#     except Exception as e:
-#         print(e)
-#         print('Error getting object {} from bucket {}. Make sure they exist and your bucket is in the same region as this function.'.format(key, bucket))
-#         raise e
-              
@@ -0,0 +1,185 @@
+import time
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional
+import src.config as config
+import src.metrics as metrics
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+FINISHED_STATES = ['SUCCEEDED', 'FAILED', 'CANCELLED']
+
+
+class AthenaQueryError(Exception):
+    """
+    Raised when an Athena query fails, is cancelled or times out.
+    Carries the execution details collected for the query.
+    """
+
+    def __init__(self, message: str, execution: Dict[str, Any]):
+        super().__init__(message)
+        self.execution = execution
+
+
+def start_query(client: object, query: str, database: str, output_location: str) -> str:
+    """
+    Submits a query to Athena.
+    Returns the query execution id.
+    """
+    response = client.start_query_execution(
+        QueryString=query,
+        QueryExecutionContext={
+            'Database': database
+        },
+        ResultConfiguration={
+            'OutputLocation': output_location
+        }
+    )
+    logger.info("Started Athena query: %s", response['QueryExecutionId'])
+    return response['QueryExecutionId']
+
+
+def execution_details(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extracts state and statistics from a get_query_execution response.
+    """
+    execution = response['QueryExecution']
+    status = execution['Status']
+    statistics = execution.get('Statistics', {})
+    return {
+        "query_execution_id": execution['QueryExecutionId'],
+        "state": status['State'],
+        "state_reason": status.get('StateChangeReason'),
+        "queue_time_ms": statistics.get('QueryQueueTimeInMillis'),
+        "engine_time_ms": statistics.get('EngineExecutionTimeInMillis'),
+        "total_time_ms": statistics.get('TotalExecutionTimeInMillis'),
+        "data_scanned_bytes": statistics.get('DataScannedInBytes')
+    }
+
+
+def next_delay(delay: float, state: str) -> float:
+    """
+    Returns the next polling delay.
+    Queued queries back off faster than running ones, as they are not expected to finish soon.
+    """
+    factor = 3 if state == 'QUEUED' else 2
+    return min(delay * factor, config.athena_poll_max)
+
+
+def _finish(details: Dict[str, Any], started: float) -> Dict[str, Any]:
+    """
+    Logs the finished query and raises AthenaQueryError unless it succeeded.
+    """
+    details["wait_time_s"] = round(time.monotonic() - started, 3)
+    logger.info("Athena query finished: %s", details)
+    metrics.record(
+        'athena',
+        queue_time_ms=details["queue_time_ms"],
+        engine_time_ms=details["engine_time_ms"],
+        total_time_ms=details["total_time_ms"],
+        data_scanned_bytes=details["data_scanned_bytes"],
+        wait_ms=details["wait_time_s"] * 1000
+    )
+    if details["state"] != 'SUCCEEDED':
+        raise AthenaQueryError(
+            f"Athena query {details['query_execution_id']} failed with state: {details['state']}", details
+        )
+    return details
+
+
+def _timed_out(client: object, query_execution_id: str, timeout: float) -> None:
+    """
+    Cancels a query that ran past its timeout and raises AthenaQueryError.
+    """
+    logger.error("Athena query %s timed out after %ss, cancelling", query_execution_id, timeout)
+    try:
+        client.stop_query_execution(QueryExecutionId=query_execution_id)
+    except Exception as e:
+        logger.warning("Failed to cancel Athena query %s: %s", query_execution_id, e)
+    raise AthenaQueryError(
+        f"Athena query {query_execution_id} timed out after {timeout}s",
+        {"query_execution_id": query_execution_id, "state": 'TIMED_OUT'}
+    )
+
+
+def wait_for_query(client: object, query_execution_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Polls a query until it finishes, starting with a short delay and backing off exponentially.
+    The query is cancelled with stop_query_execution once timeout seconds have passed.
+    Returns state, queue time, engine time and bytes scanned of the query.
+    """
+    timeout = config.athena_timeout if timeout is None else timeout
+    started = time.monotonic()
+    delay = config.athena_poll_initial
+    while True:
+        details = execution_details(client.get_query_execution(QueryExecutionId=query_execution_id))
+        if details["state"] in FINISHED_STATES:
+            return _finish(details, started)
+        remaining = timeout - (time.monotonic() - started)
+        if remaining <= 0:
+            _timed_out(client, query_execution_id, timeout)
+        time.sleep(min(delay, remaining))
+        delay = next_delay(delay, details["state"])
+
+
+def run_query(client: object, query: str, database: str, output_location: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Runs a query in Athena and waits for it to finish.
+    Returns the execution details of the query.
+    """
+    query_execution_id = start_query(client, query, database, output_location)
+    return wait_for_query(client, query_execution_id, timeout)
+
+
+async def wait_for_query_async(client: object, query_execution_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Asyncio version of wait_for_query. Boto3 calls run in worker threads so many queries can be awaited together.
+    """
+    timeout = config.athena_timeout if timeout is None else timeout
+    started = time.monotonic()
+    delay = config.athena_poll_initial
+    while True:
+        response = await asyncio.to_thread(client.get_query_execution, QueryExecutionId=query_execution_id)
+        details = execution_details(response)
+        if details["state"] in FINISHED_STATES:
+            return _finish(details, started)
+        remaining = timeout - (time.monotonic() - started)
+        if remaining <= 0:
+            await asyncio.to_thread(_timed_out, client, query_execution_id, timeout)
+        await asyncio.sleep(min(delay, remaining))
+        delay = next_delay(delay, details["state"])
+
+
+async def run_query_async(client: object, query: str, database: str, output_location: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Asyncio version of run_query.
+    """
+    query_execution_id = await asyncio.to_thread(start_query, client, query, database, output_location)
+    return await wait_for_query_async(client, query_execution_id, timeout)
+
+
+async def run_queries_async(
+    client: object,
+    queries: List[str],
+    database: str,
+    output_location: str,
+    timeout: Optional[float] = None
+) -> List[Dict[str, Any] | Exception]:
+    """
+    Submits all queries at once and waits for them together, e.g. independent SELECTs, DDL or maintenance statements.
+    Returns execution details for each query in order, or the exception it failed with.
+    Do not use it for several MERGEs into the same Iceberg table: they commit against the same snapshot and all but one fail
+    with a commit conflict. MergeBatcher coalesces such files into one MERGE instead.
+    """
+    return await asyncio.gather(
+        *(run_query_async(client, query, database, output_location, timeout) for query in queries),
+        return_exceptions=True
+    )
@@ -0,0 +1,169 @@
+import time
+import uuid
+import threading
+import logging
+import pyarrow as pa
+from typing import List, Dict, Tuple, Any, Optional
+import src.config as config
+import src.layout as layout
+import src.metrics as metrics
+from src.etl import merge_to_fact_table
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+class BatchMergeError(Exception):
+    """
+    Raised when a batch could not be committed or merged. Carries the keys of every file in the batch.
+    """
+
+    def __init__(self, message: str, keys: List[str]):
+        super().__init__(message)
+        self.keys = keys
+
+
+def file_sessions(data: pa.Table) -> set:
+    """
+    Returns the (event_id, session_id) pairs of staged rows, empty when the rows carry no metadata columns.
+    """
+    if 'event_id' not in data.column_names or 'session_id' not in data.column_names:
+        return set()
+    pairs = layout.write_types(data.select(['event_id', 'session_id'])).group_by(['event_id', 'session_id']).aggregate([])
+    return {(row['event_id'], row['session_id']) for row in pairs.to_pylist()}
+
+
+class MergeBatcher:
+    """
+    Collects the staged rows of many files into one staging table and merges them into the
+    fact table with a single MERGE, instead of one staging table and one MERGE per file.
+    A batch is flushed once it holds max_files files or max_bytes bytes, or when it is older
+    than max_seconds at the time a file is added. Call flush at the end to merge what is left.
+    """
+
+    def __init__(
+        self,
+        catalog_name: object,
+        athena_client: object,
+        database_name: str,
+        table_location: str,
+        athena_catalog: str,
+        dst_table: str,
+        max_files: int = config.batch_max_files,
+        max_bytes: int = config.batch_max_bytes,
+        max_seconds: float = config.batch_max_seconds
+    ):
+        self.catalog_name = catalog_name
+        self.athena_client = athena_client
+        self.database_name = database_name
+        self.table_location = table_location
+        self.athena_catalog = athena_catalog
+        self.dst_table = dst_table
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.table_name = None
+        self.txn = None
+        self.keys = []
+        self.sessions = set()
+        self.rows = 0
+        self.bytes = 0
+        self.started = None
+
+    def add(self, key: str, data: pa.Table) -> Optional[Dict[str, Any]]:
+        """
+        Appends the transformed rows of one file to the current batch.
+        Files already in the batch are skipped, so a re-delivered key does not create duplicate source rows.
+        A file of a session already in the batch (e.g. the .csv and .csv.gz of one session) would give the MERGE
+        several source rows per key, so the batch is merged first, under the lock so no later batch overtakes it.
+        Returns the flushed batch when this file filled it, otherwise None.
+        """
+        with self.lock:
+            if key in self.keys:
+                logger.info("Skipping %s, already in batch %s", key, self.table_name)
+                return None
+            sessions = file_sessions(data)
+            if self.sessions & sessions:
+                logger.info("Merging batch %s before %s, it holds the same session", self.table_name, key)
+                txn, batch = self._take()
+                try:
+                    self._merge(txn, batch)
+                except BatchMergeError as e:
+                    raise BatchMergeError(str(e), e.keys + [key]) from e
+            if self.txn is None:
+                self._start()
+            with metrics.stage('stage') as stage:
+                stage["rows_in"] = data.num_rows
+                self.txn.append(layout.sort_rows(data, config.staging_sort_order, config.schema))
+            self.keys.append(key)
+            self.sessions |= sessions
+            self.rows += data.num_rows
+            self.bytes += data.nbytes
+            if (len(self.keys) < self.max_files and self.bytes < self.max_bytes
+                    and time.monotonic() - self.started < self.max_seconds):
+                return None
+            txn, batch = self._take()
+        # The merge runs outside the lock so other files can start the next batch
+        return self._merge(txn, batch)
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """
+        Commits the staging table of the current batch and merges it into the fact table.
+        Returns the keys, row count, staging table and merge execution details of the batch.
+        """
+        with self.lock:
+            if self.txn is None:
+                return None
+            txn, batch = self._take()
+        return self._merge(txn, batch)
+
+    def _start(self) -> None:
+        self.table_name = f"stg_batch_{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        identifier = (self.database_name, self.table_name)
+        logger.info('Creating batch staging table: %s', identifier)
+        table = self.catalog_name.create_table(
+            identifier=identifier,
+            schema=config.staging_schema,
+            location=self.table_location,
+            sort_order=config.staging_sort_order,
+            properties=layout.write_properties()
+        )
+        self.txn = table.transaction()
+        self.started = time.monotonic()
+
+    def _take(self) -> Tuple[object, Dict[str, Any]]:
+        batch = {
+            "keys": self.keys,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "staging_table": self.table_name
+        }
+        txn = self.txn
+        self._reset()
+        return txn, batch
+
+    def _merge(self, txn: object, batch: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            txn.commit_transaction()
+            logger.info("Merging batch of %s files (%s rows) from %s", len(batch["keys"]), batch["rows"], batch["staging_table"])
+            with metrics.stage('merge') as stage:
+                stage["files"] = len(batch["keys"])
+                stage["rows_in"] = batch["rows"]
+                batch["execution"] = merge_to_fact_table(
+                    self.athena_client, self.athena_catalog, self.database_name, self.table_location,
+                    batch["staging_table"], self.dst_table, self.catalog_name
+                )
+            return batch
+        except Exception as e:
+            logger.error("Error merging batch %s: %s", batch["staging_table"], e)
+            raise BatchMergeError(f"Failed to merge batch {batch['staging_table']}: {e}", batch["keys"]) from e
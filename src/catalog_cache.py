@@ -0,0 +1,205 @@
+import time
+import threading
+import logging
+from collections import Counter
+from typing import Dict, Any, Optional, Tuple, Union
+from pyiceberg.catalog import Catalog, MetastoreCatalog, delete_data_files, delete_files
+from pyiceberg.exceptions import NoSuchTableError
+from pyiceberg.table import Table
+import src.config as config
+import src.metrics as metrics
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+Identifier = Tuple[str, ...]
+
+
+class CachedTable(Table):
+    """
+    Table handed out by CachedCatalog. refresh() is how callers ask to see other writers' commits,
+    so it always reloads from the catalog instead of returning cached metadata.
+    """
+
+    def refresh(self) -> Table:
+        self.catalog.invalidate(self._identifier)
+        return super().refresh()
+
+
+class CachedCatalog:
+    """
+    Wraps an iceberg catalog and keeps table metadata and existence checks for ttl seconds,
+    so the tables a file touches are looked up once per warm container instead of once per call.
+    Tables handed out commit through this wrapper: a successful commit stores the new metadata,
+    a failed one drops the entry so the retry reloads it. Their refresh() skips the cache. Writes made outside pyiceberg,
+    e.g. an Athena MERGE, must call invalidate.
+    Every call that reaches the catalog is counted in calls, cache hits in hits.
+    """
+
+    def __init__(self, catalog: Catalog, ttl: float = config.catalog_cache_ttl):
+        self.catalog = catalog
+        self.ttl = ttl
+        # identifier -> (expiry, metadata, metadata location, io), or None for a table known not to exist
+        self.entries: Dict[Identifier, Tuple[float, Optional[Tuple[Any, str, Any]]]] = {}
+        self.calls: Counter = Counter()
+        self.hits: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # Everything that is not cached goes straight to the catalog
+        return getattr(self.catalog, name)
+
+    def _call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        with self.lock:
+            self.calls[method] += 1
+        return getattr(self.catalog, method)(*args, **kwargs)
+
+    def _cached(self, identifier: Identifier, method: str) -> Tuple[bool, Optional[Tuple[Any, str, Any]]]:
+        with self.lock:
+            entry = self.entries.get(identifier)
+            if entry is None or entry[0] <= time.monotonic():
+                return False, None
+            self.hits[method] += 1
+            return True, entry[1]
+
+    def _store(self, identifier: Identifier, table: Optional[Table]) -> None:
+        with self.lock:
+            value = None if table is None else (table.metadata, table.metadata_location, table.io)
+            self.entries[identifier] = (time.monotonic() + self.ttl, value)
+
+    def _table(self, identifier: Identifier, value: Tuple[Any, str, Any]) -> Table:
+        # A new handle per caller, so threads never share a mutable Table
+        metadata, metadata_location, io = value
+        return CachedTable(identifier, metadata, metadata_location, io, self)
+
+    def invalidate(self, identifier: Union[str, Identifier, None] = None) -> None:
+        """
+        Forgets one table, or every table when identifier is None.
+        """
+        with self.lock:
+            if identifier is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(Catalog.identifier_to_tuple(identifier), None)
+
+    def load_table(self, identifier: Union[str, Identifier]) -> Table:
+        identifier = Catalog.identifier_to_tuple(identifier)
+        found, value = self._cached(identifier, 'load_table')
+        if found and value is None:
+            raise NoSuchTableError(f"Table does not exist: {identifier}")
+        if found:
+            return self._table(identifier, value)
+        try:
+            table = self._call('load_table', identifier)
+        except NoSuchTableError:
+            self._store(identifier, None)
+            raise
+        self._store(identifier, table)
+        return self._table(identifier, (table.metadata, table.metadata_location, table.io))
+
+    def table_exists(self, identifier: Union[str, Identifier]) -> bool:
+        identifier = Catalog.identifier_to_tuple(identifier)
+        found, value = self._cached(identifier, 'table_exists')
+        if found:
+            return value is not None
+        try:
+            self.load_table(identifier)
+            return True
+        except NoSuchTableError:
+            return False
+
+    def create_table(self, identifier: Union[str, Identifier], *args: Any, **kwargs: Any) -> Table:
+        identifier = Catalog.identifier_to_tuple(identifier)
+        try:
+            table = self._call('create_table', identifier, *args, **kwargs)
+        except Exception:
+            self.invalidate(identifier)
+            raise
+        self._store(identifier, table)
+        return self._table(identifier, (table.metadata, table.metadata_location, table.io))
+
+    def drop_table(self, identifier: Union[str, Identifier]) -> None:
+        identifier = Catalog.identifier_to_tuple(identifier)
+        try:
+            self._call('drop_table', identifier)
+        except NoSuchTableError:
+            self._store(identifier, None)
+            raise
+        except Exception:
+            self.invalidate(identifier)
+            raise
+        self._store(identifier, None)
+
+    def purge_table(self, identifier: Union[str, Identifier]) -> None:
+        """
+        Drops a table and deletes its files like MetastoreCatalog.purge_table,
+        reading the manifests from the cached metadata instead of loading the table again.
+        """
+        if not isinstance(self.catalog, MetastoreCatalog):
+            self.invalidate(identifier)
+            self._call('purge_table', identifier)
+            return
+        table = self.load_table(identifier)
+        self.drop_table(identifier)
+        manifests = [manifest for snapshot in table.metadata.snapshots for manifest in snapshot.manifests(table.io)]
+        delete_data_files(table.io, manifests)
+        delete_files(table.io, {manifest.manifest_path for manifest in manifests}, "manifest")
+        delete_files(table.io, {snapshot.manifest_list for snapshot in table.metadata.snapshots}, "manifest list")
+        delete_files(table.io, {log.metadata_file for log in table.metadata.metadata_log}, "previous metadata")
+        delete_files(table.io, {table.metadata_location}, "metadata")
+
+    def commit_table(self, table: Table, requirements: Tuple[Any, ...], updates: Tuple[Any, ...]) -> Any:
+        identifier = Catalog.identifier_to_tuple(table.name())
+        try:
+            response = self._call('commit_table', table, requirements, updates)
+        except Exception:
+            # Most likely another writer committed first, the retry has to reload the table
+            self.invalidate(identifier)
+            raise
+        with self.lock:
+            self.entries[identifier] = (
+                time.monotonic() + self.ttl, (response.metadata, response.metadata_location, table.io)
+            )
+        return response
+
+
+def invalidate(catalog_name: object, identifier: Union[str, Identifier]) -> None:
+    """
+    Forgets a table changed outside pyiceberg, when catalog_name caches tables.
+    """
+    if isinstance(catalog_name, CachedCatalog):
+        catalog_name.invalidate(identifier)
+
+
+def call_counts(catalog_name: object) -> Dict[str, int]:
+    """
+    Returns the calls that reached the catalog so far per method, with their total under 'calls'
+    and the cache hits under 'hits'. Empty for catalogs that do not cache.
+    """
+    if not isinstance(catalog_name, CachedCatalog):
+        return {}
+    with catalog_name.lock:
+        counts = dict(catalog_name.calls)
+        counts["calls"] = sum(catalog_name.calls.values())
+        counts["hits"] = sum(catalog_name.hits.values())
+    return counts
+
+
+def record_calls(catalog_name: object, before: Dict[str, int], files: int) -> Dict[str, int]:
+    """
+    Records the catalog calls made since before (see call_counts) as the 'catalog' measurements
+    of the invocation, along with the calls per file.
+    Returns the calls made.
+    """
+    after = call_counts(catalog_name)
+    made = {name: count - before.get(name, 0) for name, count in after.items()}
+    if made:
+        metrics.record('catalog', calls_per_file=made["calls"] / files if files else None, **made)
+    return made
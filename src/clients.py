@@ -0,0 +1,111 @@
+import os
+import threading
+import logging
+from typing import Dict, Any, Optional
+import src.config as config
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+# Process wide registry of AWS clients and the iceberg catalog. Module state survives
+# between warm Lambda invocations, so each one is only created once per container.
+_registry: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+
+def get_client(service: str) -> object:
+    """
+    Returns the boto3 client for a service, creating it on first use.
+    Clients share one connection pool size (max_pool_connections) and use adaptive retries.
+    An endpoint can be set per service with '<service>_endpoint_url', e.g. for moto or localstack.
+    """
+    with _lock:
+        if service not in _registry:
+            import boto3
+            from botocore.config import Config
+            logger.info("Creating %s client", service)
+            _registry[service] = boto3.client(
+                service,
+                aws_access_key_id=os.environ.get("aws_access_key"),
+                aws_secret_access_key=os.environ.get("aws_secret"),
+                region_name=os.environ.get("aws_region_name"),
+                endpoint_url=os.environ.get(f"{service}_endpoint_url"),
+                config=Config(max_pool_connections=config.max_pool_connections, retries={'mode': 'adaptive'})
+            )
+        return _registry[service]
+
+
+def get_catalog() -> object:
+    """
+    Returns the iceberg catalog, loading it on first use.
+    Uses the Glue catalog unless catalog_type is set to 'sql'. Table lookups are cached for
+    catalog_cache_ttl seconds, see src/catalog_cache.py.
+    """
+    with _lock:
+        if 'catalog' not in _registry:
+            from pyiceberg.catalog import load_catalog
+            logger.info("Loading %s catalog", config.catalog_type)
+            if config.catalog_type == 'sql':
+                properties = {'uri': config.catalog_uri, 'warehouse': config.catalog_warehouse}
+            else:
+                properties = {
+                    'client.access-key-id': os.environ.get("aws_access_key"),
+                    'client.secret-access-key': os.environ.get("aws_secret"),
+                    'client.region': os.environ.get("aws_region_name")
+                }
+            catalog = load_catalog('default', **properties, type=config.catalog_type)
+            if config.catalog_cache_ttl > 0:
+                from src.catalog_cache import CachedCatalog
+                catalog = CachedCatalog(catalog, config.catalog_cache_ttl)
+            _registry['catalog'] = catalog
+        return _registry['catalog']
+
+
+def peek(name: str) -> Optional[object]:
+    """
+    Returns a client or the catalog ('catalog') if it was already created, without creating it.
+    """
+    with _lock:
+        return _registry.get(name)
+
+
+def register(name: str, obj: object) -> None:
+    """
+    Injects a stand-in for a client ('s3', 'athena') or for the catalog ('catalog').
+    """
+    with _lock:
+        _registry[name] = obj
+
+
+def reset() -> None:
+    """
+    Forgets every client and the catalog, so the next use creates them again.
+    """
+    with _lock:
+        _registry.clear()
+
+
+def use_local_catalog(warehouse: str, namespace: Optional[str] = None) -> object:
+    """
+    Registers a SQLite backed iceberg catalog with its warehouse in a local directory.
+    Creates the namespace when given. Needs pyiceberg[sql-sqlite].
+    Returns the catalog.
+    """
+    from pyiceberg.catalog.sql import SqlCatalog
+    os.makedirs(warehouse, exist_ok=True)
+    catalog = SqlCatalog(
+        'local',
+        uri=f"sqlite:///{os.path.join(warehouse, 'catalog.db')}",
+        warehouse=f"file://{os.path.abspath(warehouse)}"
+    )
+    if namespace is not None:
+        catalog.create_namespace_if_not_exists(namespace)
+    register('catalog', catalog)
+    return catalog
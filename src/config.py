@@ -1,27 +1,27 @@
 import os
-import boto3
-from pyiceberg.catalog import load_catalog
 from pyiceberg.schema import Schema, NestedField
+from pyiceberg.partitioning import PartitionSpec, PartitionField
+from pyiceberg.table.sorting import SortOrder, SortField
+from pyiceberg.transforms import IdentityTransform, BucketTransform
 from pyiceberg.types import (
     StringType,
     LongType,
+    IntegerType,
+    BooleanType,
+    DoubleType,
     TimestampType
 )
 
-# Move this code to somewhere else
-s3 = boto3.client(
-    's3',
-    aws_access_key_id = os.environ.get("aws_access_key"),
-    aws_secret_access_key = os.environ.get("aws_secret"),
-    region_name = os.environ.get("aws_region_name")
-)
-
-athena = boto3.client(
-    'athena',
-    aws_access_key_id = os.environ.get("aws_access_key"),
-    aws_secret_access_key = os.environ.get("aws_secret"),
-    region_name = os.environ.get("aws_region_name")
-)
+# AWS clients and the iceberg catalog are created on first use by src.clients
+# and reused by warm invocations, see __getattr__ at the end of this module.
+# 'glue' in AWS, 'sql' for a local sqlite catalog (needs pyiceberg[sql-sqlite])
+catalog_type = os.environ.get("catalog_type", "glue")
+catalog_uri = os.environ.get("catalog_uri")
+catalog_warehouse = os.environ.get("catalog_warehouse")
+# seconds table metadata and existence checks are reused before asking the catalog again, 0 to disable
+catalog_cache_ttl = float(os.environ.get("catalog_cache_ttl", 30))
+# connections kept open per client, should cover io_workers
+max_pool_connections = int(os.environ.get("max_pool_connections", 50))
 
 glue_bucket= os.environ.get('destination_glue_bucket')
 table_location = f"s3://{glue_bucket}/iceberg_tbl" 
@@ -30,15 +30,87 @@ table_name= os.environ.get("destination_table")
 fact_table= os.environ.get("fact_tbl")
 athena_catalog= os.environ.get("athena_catalog")
 
-glue_catalog = load_catalog(
-    'default',
-    **{
-        'client.access-key-id': os.environ.get("aws_access_key"),
-        'client.secret-access-key': os.environ.get("aws_secret"),
-        'client.region': os.environ.get("aws_region_name")
-    },
-    type='glue'
-)
+# number of csv rows held in memory at once when streaming a file
+chunk_size = int(os.environ.get("chunk_size", 100000))
+streaming = os.environ.get("streaming", "false").lower() == "true"
+# bytes parsed per block when streaming with the arrow engine
+block_size = int(os.environ.get("block_size", 16 * 1024 * 1024))
+# 'pandas' or 'arrow'
+engine = os.environ.get("engine", "pandas")
+# narrow integer types from the validation ranges, brake as boolean and dictionary encoded metadata columns
+compact = os.environ.get("compact", "false").lower() == "true"
+# validate row by row and send bad rows to the quarantine table instead of rejecting the file
+row_validation = os.environ.get("row_validation", "false").lower() == "true"
+quarantine_table = os.environ.get("quarantine_tbl", "quarantine_telemetry")
+# rows of a file repeating a driverNumber and timeUtc are collapsed to the 'first' or 'last' one, 'none' keeps them all
+dedup_keep = os.environ.get("dedup_keep", "last")
+# workers for S3, Glue and Athena calls and for parsing and validation when handling a batch of records
+io_workers = int(os.environ.get("io_workers", 8))
+cpu_workers = int(os.environ.get("cpu_workers", os.cpu_count() or 1))
+
+# coalesce many files into one staging table and one MERGE, flushed by file count, size or age
+merge_batch = os.environ.get("merge_batch", "false").lower() == "true"
+batch_max_files = int(os.environ.get("batch_max_files", 50))
+batch_max_bytes = int(os.environ.get("batch_max_bytes", 512 * 1024 * 1024))
+batch_max_seconds = float(os.environ.get("batch_max_seconds", 60))
+
+# 'athena' stages each file and merges it with Athena, 'direct' upserts into the fact table with pyiceberg
+write_mode = os.environ.get("write_mode", "athena")
+# with key_index, rows whose keys cannot be in the fact table yet (manifest min/max stats) are appended with
+# pyiceberg instead of merged by Athena or read and overwritten by direct upserts
+key_index = os.environ.get("key_index", "true").lower() == "true"
+commit_retries = int(os.environ.get("commit_retries", 3))
+
+# ingestion ledger, '' to disable, 'iceberg' for the ledger table or 'file:<path>'
+ledger = os.environ.get("ledger", "")
+ledger_table = os.environ.get("ledger_tbl", "ingestion_ledger")
+
+# rollup tables refreshed for every loaded event and session, see src/rollups.py. Set to false to opt out,
+# each refresh re-reads and rewrites the whole session after every file
+rollups = os.environ.get("rollups", "true").lower() == "true"
+driver_session_table = os.environ.get("driver_session_tbl", "driver_session_stats")
+telemetry_1hz_table = os.environ.get("telemetry_1hz_tbl", "fact_telemetry_1hz")
+
+# layout of written data files
+target_file_size_bytes = int(os.environ.get("target_file_size_bytes", 128 * 1024 * 1024))
+row_group_limit = int(os.environ.get("row_group_limit", 1048576))
+# optional second partition of the fact table: 'session_id' or 'bucket_driver:<n>'
+fact_secondary_partition = os.environ.get("fact_secondary_partition", "")
+
+# objects larger than range_part_size are downloaded with up to range_concurrency ranged GETs at once
+range_reads = os.environ.get("range_reads", "true").lower() == "true"
+range_part_size = int(os.environ.get("range_part_size", 8 * 1024 * 1024))
+range_concurrency = int(os.environ.get("range_concurrency", 8))
+
+# table maintenance, see src/maintenance.py. Tables default to the fact, rollup, quarantine and ledger tables.
+maintenance_tables = [name for name in os.environ.get("maintenance_tables", "").split(",") if name]
+# data files under this size are compacted, Athena's optimize_rewrite_min_data_file_size_bytes default
+small_file_bytes = int(os.environ.get("small_file_bytes", target_file_size_bytes * 3 // 4))
+# a partition is compacted once it has this many small files or delete files
+compaction_min_files = int(os.environ.get("compaction_min_files", 5))
+delete_file_threshold = int(os.environ.get("delete_file_threshold", 10))
+# snapshots older than this are expired, keeping at least snapshots_retain_last
+snapshot_max_age_seconds = int(os.environ.get("snapshot_max_age_seconds", 5 * 24 * 3600))
+snapshots_retain_last = int(os.environ.get("snapshots_retain_last", 1))
+# unreferenced files younger than this may belong to a commit in progress
+orphan_min_age_seconds = int(os.environ.get("orphan_min_age_seconds", 3 * 24 * 3600))
+# staging tables not updated for this long were left behind by a failed merge
+staging_max_age_seconds = int(os.environ.get("staging_max_age_seconds", 6 * 3600))
+
+# in-process queries of the fact table, see src/query.py. Table metadata is reloaded after
+# query_metadata_ttl seconds, manifests are immutable and kept up to query_manifest_cache_bytes.
+query_metadata_ttl = float(os.environ.get("query_metadata_ttl", 30))
+query_manifest_cache_bytes = int(os.environ.get("query_manifest_cache_bytes", 64 * 1024 * 1024))
+
+# athena polling starts at athena_poll_initial seconds and backs off up to athena_poll_max
+athena_poll_initial = float(os.environ.get("athena_poll_initial", 0.25))
+athena_poll_max = float(os.environ.get("athena_poll_max", 5))
+athena_timeout = float(os.environ.get("athena_timeout", 600))
+
+# one CloudWatch embedded metric format record per invocation with per stage timings, rows and bytes
+metrics = os.environ.get("metrics", "true").lower() == "true"
+metrics_namespace = os.environ.get("metrics_namespace", "TelemetryETL")
+metrics_service = os.environ.get("metrics_service", "telemetry-etl")
 
 # expecetd columns in the final dataframe
 cols = ['event_id','event_year','event_code','event_num','session_id','timeUtc','driverNumber','rpm','speed','gear','throttle','brake','drs']
@@ -60,3 +132,159 @@ schema = Schema(
     NestedField(13, "drs", LongType(), required=False)
 )
 
+# iceberg staging table schema in compact mode. Iceberg has no 8 or 16 bit integers, so int is the narrowest type.
+compact_schema = Schema(
+    *schema.fields[:6],
+    NestedField(7, "driverNumber", IntegerType(), required=False),
+    NestedField(8, "rpm", IntegerType(), required=False),
+    NestedField(9, "speed", IntegerType(), required=False),
+    NestedField(10, "gear", IntegerType(), required=False),
+    NestedField(11, "throttle", IntegerType(), required=False),
+    NestedField(12, "brake", BooleanType(), required=False),
+    NestedField(13, "drs", IntegerType(), required=False)
+)
+
+# schema of new staging tables
+staging_schema = compact_schema if compact else schema
+
+# expected columns in the quarantine table
+quarantine_cols = cols + ['violation_mask', 'failed_rules', 'source_key']
+
+# iceberg quarantine table schema, rejected rows with the codes of the rules they failed
+quarantine_schema = Schema(
+    *schema.fields,
+    NestedField(14, "violation_mask", LongType(), required=False),
+    NestedField(15, "failed_rules", StringType(), required=False),
+    NestedField(16, "source_key", StringType(), required=False)
+)
+
+# expected columns in the fact table, see src/sql/fact_telemetry.sql
+fact_cols = ['pk_id','event_id','event_year','event_code','event_num','session_id','ts','drivernumber','rpm','speed','gear','throttle','breaks','drs']
+
+# iceberg fact table schema
+fact_schema = Schema(
+    NestedField(1, "pk_id", StringType(), required=False),
+    NestedField(2, "event_id", StringType(), required=False),
+    NestedField(3, "event_year", StringType(), required=False),
+    NestedField(4, "event_code", StringType(), required=False),
+    NestedField(5, "event_num", StringType(), required=False),
+    NestedField(6, "session_id", StringType(), required=False),
+    NestedField(7, "ts", TimestampType(), required=False),
+    NestedField(8, "drivernumber", IntegerType(), required=False),
+    NestedField(9, "rpm", IntegerType(), required=False),
+    NestedField(10, "speed", IntegerType(), required=False),
+    NestedField(11, "gear", IntegerType(), required=False),
+    NestedField(12, "throttle", IntegerType(), required=False),
+    NestedField(13, "breaks", BooleanType(), required=False),
+    NestedField(14, "drs", IntegerType(), required=False)
+)
+
+fact_partition_fields = [
+    PartitionField(source_id=2, field_id=1000, transform=IdentityTransform(), name="event_id")
+]
+if fact_secondary_partition == "session_id":
+    fact_partition_fields.append(
+        PartitionField(source_id=6, field_id=1001, transform=IdentityTransform(), name="session_id")
+    )
+elif fact_secondary_partition.startswith("bucket_driver:"):
+    fact_partition_fields.append(
+        PartitionField(
+            source_id=8, field_id=1001,
+            transform=BucketTransform(int(fact_secondary_partition.split(":")[1])),
+            name="drivernumber_bucket"
+        )
+    )
+fact_partition_spec = PartitionSpec(*fact_partition_fields)
+
+# rows are written sorted by driver and time so min/max stats prune driver and time range filters
+staging_sort_order = SortOrder(
+    SortField(source_id=7, transform=IdentityTransform()),
+    SortField(source_id=6, transform=IdentityTransform())
+)
+fact_sort_order = SortOrder(
+    SortField(source_id=8, transform=IdentityTransform()),
+    SortField(source_id=7, transform=IdentityTransform())
+)
+
+
+# per driver and session aggregates, see src/sql/driver_session_stats.sql
+driver_session_schema = Schema(
+    NestedField(1, "event_id", StringType(), required=False),
+    NestedField(2, "event_year", StringType(), required=False),
+    NestedField(3, "event_code", StringType(), required=False),
+    NestedField(4, "event_num", StringType(), required=False),
+    NestedField(5, "session_id", StringType(), required=False),
+    NestedField(6, "drivernumber", IntegerType(), required=False),
+    NestedField(7, "samples", LongType(), required=False),
+    NestedField(8, "first_ts", TimestampType(), required=False),
+    NestedField(9, "last_ts", TimestampType(), required=False),
+    NestedField(10, "max_speed", IntegerType(), required=False),
+    NestedField(11, "avg_speed", DoubleType(), required=False),
+    NestedField(12, "max_rpm", IntegerType(), required=False),
+    NestedField(13, "avg_rpm", DoubleType(), required=False),
+    NestedField(14, "avg_throttle", DoubleType(), required=False),
+    NestedField(15, "throttle_0_25_s", DoubleType(), required=False),
+    NestedField(16, "throttle_25_50_s", DoubleType(), required=False),
+    NestedField(17, "throttle_50_75_s", DoubleType(), required=False),
+    NestedField(18, "throttle_75_100_s", DoubleType(), required=False),
+    NestedField(19, "brake_s", DoubleType(), required=False),
+    NestedField(20, "drs_open_s", DoubleType(), required=False)
+)
+
+# fact table downsampled to one row per driver and second, see src/sql/fact_telemetry_1hz.sql
+telemetry_1hz_schema = Schema(
+    NestedField(1, "event_id", StringType(), required=False),
+    NestedField(2, "event_year", StringType(), required=False),
+    NestedField(3, "event_code", StringType(), required=False),
+    NestedField(4, "event_num", StringType(), required=False),
+    NestedField(5, "session_id", StringType(), required=False),
+    NestedField(6, "ts", TimestampType(), required=False),
+    NestedField(7, "drivernumber", IntegerType(), required=False),
+    NestedField(8, "samples", IntegerType(), required=False),
+    NestedField(9, "avg_rpm", DoubleType(), required=False),
+    NestedField(10, "avg_speed", DoubleType(), required=False),
+    NestedField(11, "max_speed", IntegerType(), required=False),
+    NestedField(12, "max_gear", IntegerType(), required=False),
+    NestedField(13, "avg_throttle", DoubleType(), required=False),
+    NestedField(14, "breaks", BooleanType(), required=False),
+    NestedField(15, "max_drs", IntegerType(), required=False)
+)
+
+# both rollups are partitioned by event_id like the fact table
+rollup_partition_spec = PartitionSpec(
+    PartitionField(source_id=1, field_id=1000, transform=IdentityTransform(), name="event_id")
+)
+driver_session_sort_order = SortOrder(SortField(source_id=6, transform=IdentityTransform()))
+telemetry_1hz_sort_order = SortOrder(
+    SortField(source_id=7, transform=IdentityTransform()),
+    SortField(source_id=6, transform=IdentityTransform())
+)
+
+
+# iceberg ledger table schema, one entry per processed file version
+ledger_schema = Schema(
+    NestedField(1, "bucket", StringType(), required=False),
+    NestedField(2, "key", StringType(), required=False),
+    NestedField(3, "etag", StringType(), required=False),
+    NestedField(4, "size", LongType(), required=False),
+    NestedField(5, "status", StringType(), required=False),
+    NestedField(6, "rows_loaded", LongType(), required=False),
+    NestedField(7, "rows_rejected", LongType(), required=False),
+    NestedField(8, "started_at", TimestampType(), required=False),
+    NestedField(9, "finished_at", TimestampType(), required=False),
+    NestedField(10, "duration_ms", LongType(), required=False),
+    NestedField(11, "error", StringType(), required=False)
+)
+
+
+def __getattr__(name: str):
+    """
+    Resolves the shared clients lazily, so importing this module does not build them.
+    """
+    if name in ('s3', 'athena'):
+        from src.clients import get_client
+        return get_client(name)
+    if name == 'glue_catalog':
+        from src.clients import get_catalog
+        return get_catalog()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
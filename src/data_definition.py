@@ -1,5 +1,28 @@
+import numpy as np
 import pandas as pd
-from typing import Dict, Any
+import pyarrow as pa
+import pyarrow.compute as pc
+from functools import lru_cache
+from typing import Dict, Any, Tuple
+
+
+# Value patterns used to null out unparsable values during row level validation
+TIMESTAMP_PATTERN = r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?$'
+ZONED_TIMESTAMP_PATTERN = r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})$'
+NUMBER_PATTERN = r'^\s*[+-]?\d+(\.\d*)?\s*$'
+
+
+def narrow_arrow_type(low: int, high: int) -> pa.DataType:
+    """
+    Returns the narrowest arrow type holding every value from low to high, boolean for 0/1 flags.
+    """
+    if (low, high) == (0, 1):
+        return pa.bool_()
+    for arrow_type in (pa.int8(), pa.int16(), pa.int32()):
+        limits = np.iinfo(arrow_type.to_pandas_dtype())
+        if limits.min <= low and high <= limits.max:
+            return arrow_type
+    return pa.int64()
 
 
 class F1TelemetryValidator:
@@ -23,6 +46,12 @@ class F1TelemetryValidator:
             'drs': 'int64'
         }
         
+        # Arrow equivalents of column_types used by the arrow engine
+        self.arrow_types = {
+            column: pa.timestamp('ns', tz='UTC') if dtype.startswith('datetime64') else pa.from_numpy_dtype(dtype)
+            for column, dtype in self.column_types.items()
+        }
+
         # Intitial observation. Noticed some data not in the range
         self.validation_rules = {
             'driverNumber': {'min': 1, 'max': 99},
@@ -34,6 +63,28 @@ class F1TelemetryValidator:
             'drs': {'min': 0, 'max': 20}
         }
 
+        # Narrowest types holding the validated ranges, used by compact mode
+        self.compact_arrow_types = {
+            column: narrow_arrow_type(rules['min'], rules['max']) for column, rules in self.validation_rules.items()
+        }
+
+        # Row level rules. Bit i of a row's violation mask is set when rule i fails.
+        # Each rule is (code, column, range) and a rule without a range fails on missing or unparsable values.
+        self.row_rules = [(f"{col}_invalid", col, None) for col in self.required_columns] + [
+            (f"{col}_out_of_range", col, rules) for col, rules in self.validation_rules.items()
+        ]
+
+        # Scalars of the row rules, built once instead of for every table
+        self.rule_bits = [pa.scalar(1 << bit, pa.int64()) for bit in range(len(self.row_rules))]
+        self.no_violation = pa.scalar(0, pa.int64())
+        self.rule_codes = [pa.scalar(code, pa.string()) for code, _, _ in self.row_rules]
+        # Row rules grouped per column as (column, invalid bit, range, out of range bit), see violation_mask
+        bits = {(column, rules is None): self.rule_bits[bit] for bit, (_, column, rules) in enumerate(self.row_rules)}
+        self.column_checks = [
+            (column, bits[(column, True)], self.validation_rules.get(column), bits.get((column, False)))
+            for column in self.required_columns
+        ]
+
     def validate_csv_data(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
         Validates DataFrame content against schema and rules.
@@ -96,3 +147,193 @@ class F1TelemetryValidator:
                     )
 
         return validation_result
+
+
+    def validate_arrow_data(self, table: pa.Table) -> Tuple[Dict[str, Any], pa.Table]:
+        """
+        Validates an arrow table against schema and rules using pyarrow compute kernels.
+        Returns the same result dictionary as validate_csv_data along with the table
+        restricted to the required columns and cast to arrow_types.
+        """
+        validation_result = {
+            "is_valid": True,
+            "errors": []
+        }
+
+        table = self._select_required_arrow_columns(table, validation_result)
+
+        # Fixing column types. Columns parsed with the declared types are left untouched.
+        for column, arrow_type in self.arrow_types.items():
+            values = table.column(column)
+            if values.type == arrow_type:
+                continue
+            try:
+                if pa.types.is_timestamp(values.type) and values.type.tz is None:
+                    values = pc.assume_timezone(values, 'UTC')
+                values = values.cast(arrow_type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                validation_result["is_valid"] = False
+                if column == 'timeUtc':
+                    validation_result["errors"].append("Some timeUtc values could not be changed to datetime.")
+                else:
+                    validation_result["errors"].append(f"Failed to cast '{column}' to {self.column_types[column]}: {e}")
+                values = pa.nulls(table.num_rows, arrow_type)
+            table = table.set_column(table.schema.get_field_index(column), column, values)
+
+        # Check for missing values
+        if any(table.column(col).null_count for col in self.required_columns):
+            validation_result["is_valid"] = False
+            validation_result["errors"].append("Missing or invalid values found in the data.")
+
+        # Check value ranges
+        for column, rules in self.validation_rules.items():
+            if table.column(column).null_count == table.num_rows:
+                continue
+            bounds = pc.min_max(table.column(column))
+            if bounds['min'].as_py() < rules['min'] or bounds['max'].as_py() > rules['max']:
+                validation_result["is_valid"] = False
+                validation_result["errors"].append(
+                    f"Values out of range in column '{column}'. Expected between {rules['min']} and {rules['max']}."
+                )
+
+        return validation_result, table
+
+    def validate_arrow_rows(self, table: pa.Table) -> Tuple[Dict[str, Any], pa.Table, pa.Table]:
+        """
+        Validates an arrow table row by row instead of accepting or rejecting it as a whole.
+        Every rule in row_rules is folded into one violation mask per row, so a bad value
+        only rejects its own row. Unparsable values become nulls and fail the column's invalid rule.
+        Returns the result dictionary, the clean rows and the rejected rows. Rejected rows carry
+        'violation_mask' and 'failed_rules' (comma separated rule codes) columns.
+        """
+        validation_result = {
+            "is_valid": True,
+            "errors": []
+        }
+
+        table = self._select_required_arrow_columns(table, validation_result)
+        for column, arrow_type in self.arrow_types.items():
+            table = table.set_column(
+                table.schema.get_field_index(column), column, self._coerce_arrow_values(table.column(column), arrow_type)
+            )
+
+        mask = self.violation_mask(table)
+        failed = pc.not_equal(mask, 0)
+        clean = table.filter(pc.invert(failed))
+        rejected = table.filter(failed)
+        rejected_mask = mask.filter(failed)
+
+        failed_rules = []
+        for bit, (code, column, rules) in enumerate(self.row_rules):
+            rule_failed = pc.not_equal(pc.bit_wise_and(rejected_mask, self.rule_bits[bit]), self.no_violation)
+            count = pc.sum(rule_failed).as_py() or 0
+            if count:
+                validation_result["errors"].append(f"{count} rows failed rule '{code}'.")
+            failed_rules.append(pc.if_else(rule_failed, self.rule_codes[bit], pa.scalar(None, pa.string())))
+
+        if rejected.num_rows:
+            validation_result["is_valid"] = False
+        rejected = rejected.append_column("violation_mask", rejected_mask)
+        rejected = rejected.append_column(
+            "failed_rules",
+            pc.binary_join_element_wise(*failed_rules, ",", null_handling="skip") if failed_rules else pa.nulls(rejected.num_rows, pa.string())
+        )
+        validation_result["rows_valid"] = clean.num_rows
+        validation_result["rows_rejected"] = rejected.num_rows
+        return validation_result, clean, rejected
+
+    def violation_mask(self, table: pa.Table) -> pa.Array:
+        """
+        Computes the violation mask of every row of a typed arrow table.
+        Rules are checked per column: the null count comes from the array metadata and the range takes one
+        min_max pass, so a clean column costs one scan whatever its rules. Row masks are only built for
+        columns with violations, a column's null and range bits together.
+        """
+        mask = None
+        for column, invalid_bit, rules, range_bit in self.column_checks:
+            values = table.column(column)
+            out_of_range = False
+            if rules is not None and values.null_count < len(values):
+                bounds = pc.min_max(values)
+                out_of_range = bounds['min'].as_py() < rules['min'] or bounds['max'].as_py() > rules['max']
+            if out_of_range:
+                # Comparisons of null values stay null and get the invalid bit
+                bits = pc.fill_null(pc.if_else(
+                    pc.or_(pc.less(values, rules['min']), pc.greater(values, rules['max'])), range_bit, self.no_violation
+                ), invalid_bit)
+            elif values.null_count:
+                bits = pc.if_else(pc.is_null(values), invalid_bit, self.no_violation)
+            else:
+                continue
+            mask = bits if mask is None else pc.bit_wise_or(mask, bits)
+        if mask is None:
+            return pa.repeat(self.no_violation, table.num_rows)
+        return mask.combine_chunks() if isinstance(mask, pa.ChunkedArray) else mask
+
+    def compact_arrow_table(self, table: pa.Table) -> pa.Table:
+        """
+        Casts validated columns to compact_arrow_types. Values must already be within validation_rules,
+        a value that does not fit raises ArrowInvalid.
+        """
+        for column, arrow_type in self.compact_arrow_types.items():
+            if column in table.column_names:
+                index = table.schema.get_field_index(column)
+                table = table.set_column(index, column, table.column(index).cast(arrow_type))
+        return table
+
+    def _select_required_arrow_columns(self, table: pa.Table, validation_result: Dict[str, Any]) -> pa.Table:
+        """
+        Drops extra columns, adds missing ones with nulls and reorders columns to the required schema.
+        """
+        # Drop extra columns
+        table = table.select([col for col in table.column_names if col in self.required_columns])
+
+        # Add missing columns with nulls
+        for col in self.required_columns:
+            if col not in table.column_names:
+                table = table.append_column(pa.field(col, self.arrow_types[col]), pa.nulls(table.num_rows, self.arrow_types[col]))
+                validation_result["errors"].append(f"Missing column '{col}' added with nulls.")
+                validation_result["is_valid"] = False
+
+        # Reorder columns to match required schema
+        return table.select(self.required_columns)
+
+    def _coerce_arrow_values(self, values: pa.ChunkedArray, arrow_type: pa.DataType) -> pa.ChunkedArray:
+        """
+        Casts values to arrow_type, turning each value that cannot be cast into a null.
+        """
+        if values.type == arrow_type:
+            return values
+        try:
+            if pa.types.is_timestamp(values.type) and values.type.tz is None:
+                values = pc.assume_timezone(values, 'UTC')
+            return values.cast(arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+        # Fall back to value by value checks
+        if pa.types.is_timestamp(arrow_type):
+            values = values.cast(pa.string())
+            missing = pa.scalar(None, pa.string())
+            zoned = pc.if_else(pc.match_substring_regex(values, ZONED_TIMESTAMP_PATTERN), values, missing)
+            naive = pc.if_else(pc.match_substring_regex(values, TIMESTAMP_PATTERN), values, missing)
+            return pc.coalesce(
+                zoned.cast(arrow_type),
+                pc.assume_timezone(naive.cast(pa.timestamp(arrow_type.unit)), 'UTC')
+            )
+        if pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+            values = pc.if_else(
+                pc.match_substring_regex(values, NUMBER_PATTERN), values, pa.scalar(None, values.type)
+            ).cast(pa.float64())
+        if pa.types.is_floating(values.type):
+            # Only whole numbers are kept for integer columns
+            values = pc.if_else(pc.equal(pc.floor(values), values), values, pa.scalar(None, values.type))
+        return values.cast(arrow_type)
+
+
+@lru_cache(maxsize=None)
+def get_validator() -> F1TelemetryValidator:
+    """
+    Returns the validator shared by every file of the process, warm invocations included.
+    Its rules and types never change after construction, so one instance is safe to share between threads.
+    """
+    return F1TelemetryValidator()
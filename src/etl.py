@@ -1,13 +1,25 @@
+import io
 import os
-import boto3
 import time
+import functools
+import numpy as np
 import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from botocore.exceptions import ClientError
+from pyiceberg.expressions import And, BooleanExpression, EqualTo, In, Or
 import logging
-from typing import List, Dict, Tuple, Any, Optional
-from src.data_definition import F1TelemetryValidator
+from typing import List, Dict, Tuple, Any, Optional, Iterator
+from src.data_definition import get_validator
 import src.config as config
+import src.athena as athena
+import src.layout as layout
+import src.catalog_cache as catalog_cache
+import src.metrics as metrics
+import src.ranged as ranged
+import src.upsert as upsert
 
 
 logger = logging.getLogger(__name__)
@@ -19,6 +31,15 @@ if not logger.hasHandlers():
     logger.addHandler(handler)
 
 
+# Accepted file extensions with their format and compression
+INPUT_FORMATS = {
+    "csv": ("csv", None),
+    "csv.gz": ("csv", "gzip"),
+    "csv.zst": ("csv", "zstd"),
+    "parquet": ("parquet", None)
+}
+
+
 def get_race_id(key_value: str) -> Dict[str, str]:
     """
     Extracts race and session metadata from the S3 key.
@@ -31,18 +52,18 @@ def get_race_id(key_value: str) -> Dict[str, str]:
         raise ValueError("Key does not contain a valid file path or prefix.") from e
 
     try:
-        extention = file_name_with_extention.split(".")[1]
-        if extention == "csv":
+        extention = file_name_with_extention.split(".", 1)[1]
+        if extention in INPUT_FORMATS:
             file_name = file_name_with_extention.split(".")[0]
             event_id = file_name.split("_")[0]
             session_id = file_name.split("_")[1]
             # table_name = "stg_" + str(file_name[0])
         else:
-            logger.error("Not a valid csv file provided in the key: %s", file_name_with_extention)
-            raise ValueError("Not a valid csv file provided in the key")
+            logger.error("Not a valid csv, csv.gz, csv.zst or parquet file provided in the key: %s", file_name_with_extention)
+            raise ValueError("Not a valid csv, csv.gz, csv.zst or parquet file provided in the key")
     except Exception as e:
-        logger.error("Filename must be in format '<event_id>_<session_id>.csv': %s", file_name_with_extention)
-        raise ValueError("filename must be in format '<event_id>_<session_id>.csv") from e
+        logger.error("Filename must be in format '<event_id>_<session_id>.<csv|csv.gz|csv.zst|parquet>': %s", file_name_with_extention)
+        raise ValueError("filename must be in format '<event_id>_<session_id>.<csv|csv.gz|csv.zst|parquet>'") from e
 
     return {
         "file_name_with_extention": file_name_with_extention,
@@ -56,16 +77,35 @@ def get_race_id(key_value: str) -> Dict[str, str]:
     }
 
 
+def input_format(key_value: str) -> Tuple[str, Optional[str]]:
+    """
+    Returns the format ('csv' or 'parquet') and compression ('gzip', 'zstd' or None) of a file from its key.
+    """
+    return INPUT_FORMATS[get_race_id(key_value)["extention"]]
+
+
+def input_stream(source: bytes | bytearray | object, compression: Optional[str] = None) -> pa.NativeFile:
+    """
+    Wraps downloaded bytes or a streaming S3 body so it is decompressed while it is read.
+    """
+    stream = pa.BufferReader(source) if isinstance(source, (bytes, bytearray, pa.Buffer)) else pa.PythonFile(source, mode='r')
+    return pa.CompressedInputStream(stream, compression) if compression else stream
+
+
 def read_file(bucket_name: str, key_value: str, s3: object) -> pd.DataFrame:
     """
-    Reads a CSV file from S3 into a DataFrame.
+    Reads a CSV (plain, gzip or zstd) or Parquet file from S3 into a DataFrame.
     Takes bucket and key along with s3 client object.
     Returns pandas dataframe. 
     """
     try:
+        file_format, compression = input_format(key_value)
         obj = s3.get_object(Bucket=bucket_name, Key=key_value)
+        metrics.record('s3_get', bytes_read=obj.get('ContentLength'))
         logger.info('Reading %s file from s3...', key_value)
-        df = pd.read_csv(obj['Body'])
+        if file_format == 'parquet':
+            return parse_parquet(obj['Body'].read()).to_pandas()
+        df = pd.read_csv(input_stream(obj['Body'], compression))
         return df
     except ClientError as ex:
         if ex.response['Error']['Code'] == 'NoSuchKey':
@@ -85,9 +125,10 @@ def validate_data(df: pd.DataFrame) -> Dict[str, Any]:
     Takes dataframe and validates agaisnt data definition.
     """
     try:
-        validator = F1TelemetryValidator()
+        validator = get_validator()
         result = validator.validate_csv_data(df)
-        logger.info("Validation result: %s", result)
+        logger.info("Validation %s with %s errors", "passed" if result["is_valid"] else "failed", len(result["errors"]))
+        logger.debug("Validation result: %s", result)
         return result
     except Exception as e:
         logger.error("Error during data validation: %s", e)
@@ -100,7 +141,12 @@ def transform_data(df: pd.DataFrame, file_metadata: Dict[str, str]) -> pd.DataFr
     Returns dataframe
     """
     try:
-        if len(file_metadata) == 8:
+        if len(file_metadata) == 8 and config.compact:
+            # One category per column instead of a string per row
+            codes = np.zeros(len(df), dtype=np.int8)
+            for column in ['session_id', 'event_num', 'event_code', 'event_year', 'event_id']:
+                df.insert(0, column, pd.Categorical.from_codes(codes, categories=[file_metadata[column]]))
+        elif len(file_metadata) == 8:
             df.insert(0, 'session_id', file_metadata['session_id'])
             df.insert(0, 'event_num', file_metadata['event_num'])
             df.insert(0, 'event_code', file_metadata['event_code'])
@@ -117,108 +163,690 @@ def transform_data(df: pd.DataFrame, file_metadata: Dict[str, str]) -> pd.DataFr
         raise
 
 
-def load_to_iceberg_table(df: pd.DataFrame, catalog_name: object, database_name: str, table_location: str) -> str:
+def validate_arrow_data(table: pa.Table) -> Tuple[Dict[str, Any], pa.Table]:
+    """
+    Validates the arrow table using F1TelemetryValidator.
+    Returns the same result dictionary as validate_data along with the typed table.
+    """
+    try:
+        validator = get_validator()
+        result, table = validator.validate_arrow_data(table)
+        logger.info("Validation %s with %s errors", "passed" if result["is_valid"] else "failed", len(result["errors"]))
+        logger.debug("Validation result: %s", result)
+        return result, table
+    except Exception as e:
+        logger.error("Error during data validation: %s", e)
+        raise
+
+
+def transform_arrow_data(table: pa.Table, file_metadata: Dict[str, str]) -> pa.Table:
+    """
+    Transforms the arrow table by adding metadata columns in front.
+    In compact mode each metadata column is a dictionary array of one value.
+    Returns arrow table
+    """
+    try:
+        if len(file_metadata) == 8:
+            for column in ['session_id', 'event_num', 'event_code', 'event_year', 'event_id']:
+                table = table.add_column(0, column, constant_column(file_metadata[column], table.num_rows))
+        else:
+            logger.error("Incorrect metadata provided: %s", file_metadata)
+            raise ValueError("Provide correct metadata")
+        logger.info("Data transformed and added metadata: %s", file_metadata)
+        return table
+    except Exception as e:
+        logger.error("Error during data transfornation: %s", e)
+        raise
+
+
+def constant_column(value: str, rows: int) -> pa.Array:
+    """
+    Returns a column with the same value in every row.
+    In compact mode the value is stored once and each row holds a one byte dictionary index.
+    """
+    if config.compact:
+        return pa.DictionaryArray.from_arrays(pa.repeat(pa.scalar(0, pa.int8()), rows), pa.array([value]))
+    return pa.repeat(value, rows)
+
+
+def validate_arrow_rows(data: pd.DataFrame | pa.Table) -> Tuple[Dict[str, Any], pa.Table, pa.Table]:
+    """
+    Validates each row using F1TelemetryValidator.
+    Dataframes from the pandas engine are converted to arrow first.
+    Returns the result dictionary, the clean rows and the rejected rows with their failed rules.
+    """
+    try:
+        if isinstance(data, pd.DataFrame):
+            data = pa.Table.from_pandas(data, preserve_index=False)
+        validator = get_validator()
+        result, clean, rejected = validator.validate_arrow_rows(data)
+        logger.info("Row validation: %s valid, %s rejected", result["rows_valid"], result["rows_rejected"])
+        return result, clean, rejected
+    except Exception as e:
+        logger.error("Error during data validation: %s", e)
+        raise
+
+
+def load_to_quarantine_table(
+    rejected: pa.Table,
+    file_metadata: Dict[str, str],
+    source_key: str,
+    catalog_name: object,
+    database_name: str,
+    table_location: str
+) -> int:
+    """
+    Appends rejected rows along with their failed rule codes to the quarantine table.
+    Creates the quarantine table on first use.
+    Returns number of rows quarantined.
+    """
+    if not rejected.num_rows:
+        return 0
+    try:
+        data = transform_arrow_data(rejected, file_metadata)
+        data = data.append_column('source_key', pa.repeat(source_key, data.num_rows))
+        # Rejected values are often out of range, they are kept at the declared types
+        data = layout.write_types(to_arrow_table(data, config.quarantine_cols, compact=False))
+        identifier = (database_name, config.quarantine_table)
+        if catalog_name.table_exists(identifier):
+            table = catalog_name.load_table(identifier)
+        else:
+            logger.info('Creating quarantine table: %s', identifier)
+            table = catalog_name.create_table(
+                identifier=identifier,
+                schema=config.quarantine_schema,
+                location=f"{table_location}/{config.quarantine_table}",
+                properties=layout.write_properties()
+            )
+        table.append(data)
+        logger.warning("Quarantined %s rows from %s into %s", data.num_rows, source_key, identifier)
+        return data.num_rows
+    except Exception as e:
+        logger.error("Error loading data to quarantine table: %s", e)
+        raise
+
+
+def quarantine_invalid_rows(
+    data: pd.DataFrame | pa.Table,
+    file_metadata: Dict[str, str],
+    source_key: str,
+    catalog_name: object,
+    database_name: str,
+    table_location: str
+) -> Tuple[Dict[str, Any], pa.Table]:
+    """
+    Validates rows, quarantines the rejected ones and keeps the clean ones.
+    The file is treated as valid when at least one clean row is left.
+    Returns the result dictionary and the clean rows.
+    """
+    result, clean, rejected = validate_arrow_rows(data)
+    load_to_quarantine_table(rejected, file_metadata, source_key, catalog_name, database_name, table_location)
+    result["is_valid"] = clean.num_rows > 0
+    return result, clean
+
+
+def read_file_in_chunks(bucket_name: str, key_value: str, s3: object, chunk_size: int = config.chunk_size) -> Iterator[pd.DataFrame]:
+    """
+    Reads a CSV file from S3 in bounded chunks instead of loading the whole object.
+    Takes bucket and key along with s3 client object and the number of rows per chunk.
+    Yields pandas dataframes of at most chunk_size rows.
+    """
+    try:
+        obj = s3.get_object(Bucket=bucket_name, Key=key_value)
+        metrics.record('s3_get', bytes_read=obj.get('ContentLength'))
+        logger.info('Streaming %s file from s3 in chunks of %s rows...', key_value, chunk_size)
+        file_format, compression = input_format(key_value)
+        if file_format == 'parquet':
+            for batch in iter_parquet(obj['Body'].read(), chunk_size):
+                yield batch.to_pandas()
+            return
+        with pd.read_csv(input_stream(obj['Body'], compression), chunksize=chunk_size) as reader:
+            for chunk in reader:
+                yield chunk.reset_index(drop=True)
+    except ClientError as ex:
+        if ex.response['Error']['Code'] == 'NoSuchKey':
+            logger.error("Key doesn't match. Please check the key value entered: %s", key_value)
+            raise FileNotFoundError(f"Key not found: {key_value}") from ex
+        else:
+            logger.error("ClientError while reading from S3: %s", ex)
+            raise
+    except Exception as e:
+        logger.error("Error reading file from S3: %s", e)
+        raise
+
+
+def read_file_arrow(bucket_name: str, key_value: str, s3: object) -> pa.Table:
+    """
+    Reads a CSV (plain, gzip or zstd) or Parquet file from S3 straight into an arrow table.
+    CSV columns are parsed with the types declared in F1TelemetryValidator.
+    If a value cannot be parsed, the file is read again with inferred types so validation can report it.
+    """
+    try:
+        logger.info('Reading %s file from s3 with arrow...', key_value)
+        if config.range_reads:
+            body = ranged.download(s3, bucket_name, key_value, config.range_part_size, config.range_concurrency)
+            return parse_file_arrow(body, key_value)
+        obj = s3.get_object(Bucket=bucket_name, Key=key_value)
+        metrics.record('s3_get', bytes_read=obj.get('ContentLength'))
+        return parse_file_arrow(obj['Body'].read(), key_value)
+    except ClientError as ex:
+        if ex.response['Error']['Code'] == 'NoSuchKey':
+            logger.error("Key doesn't match. Please check the key value entered: %s", key_value)
+            raise FileNotFoundError(f"Key not found: {key_value}") from ex
+        else:
+            logger.error("ClientError while reading from S3: %s", ex)
+            raise
+    except Exception as e:
+        logger.error("Error reading file from S3: %s", e)
+        raise
+
+
+def download_file(bucket_name: str, key_value: str, s3: object) -> bytes | bytearray:
+    """
+    Downloads a file from S3 into memory.
+    Takes bucket and key along with s3 client object.
+    Large objects are downloaded with concurrent ranged GETs (see src.ranged). Parsing starts once the whole
+    object is here, only read_file_arrow_in_chunks parses parts while the next ones download.
+    Returns the raw bytes of the object.
+    """
+    try:
+        logger.info('Downloading %s file from s3...', key_value)
+        if config.range_reads:
+            return ranged.download(s3, bucket_name, key_value, config.range_part_size, config.range_concurrency)
+        obj = s3.get_object(Bucket=bucket_name, Key=key_value)
+        metrics.record('s3_get', bytes_read=obj.get('ContentLength'))
+        return obj['Body'].read()
+    except ClientError as ex:
+        if ex.response['Error']['Code'] == 'NoSuchKey':
+            logger.error("Key doesn't match. Please check the key value entered: %s", key_value)
+            raise FileNotFoundError(f"Key not found: {key_value}") from ex
+        else:
+            logger.error("ClientError while reading from S3: %s", ex)
+            raise
+    except Exception as e:
+        logger.error("Error reading file from S3: %s", e)
+        raise
+
+
+def parse_csv(body: bytes, compression: Optional[str] = None) -> pd.DataFrame:
+    """
+    Parses CSV bytes into a DataFrame the same way read_file does.
+    """
+    if compression:
+        return pd.read_csv(input_stream(body, compression))
+    return pd.read_csv(io.BytesIO(body))
+
+
+def parse_csv_arrow(body: bytes, compression: Optional[str] = None) -> pa.Table:
+    """
+    Parses CSV bytes into an arrow table using the types declared in F1TelemetryValidator.
+    If a value cannot be parsed, the bytes are parsed again with inferred types so validation can report it.
+    """
+    buffer = pa.py_buffer(body)
+    convert_options = pacsv.ConvertOptions(column_types=get_validator().arrow_types)
+    try:
+        return pacsv.read_csv(input_stream(buffer, compression), convert_options=convert_options)
+    except pa.ArrowInvalid as e:
+        logger.warning("Typed parsing failed, using inferred types: %s", e)
+        return pacsv.read_csv(input_stream(buffer, compression))
+
+
+def parquet_columns(parquet_file: pq.ParquetFile) -> List[str]:
+    """
+    Returns the required columns present in a Parquet file. Missing ones are reported by validation.
+    """
+    names = parquet_file.schema_arrow.names
+    return [column for column in get_validator().required_columns if column in names]
+
+
+def parse_parquet(body: bytes) -> pa.Table:
+    """
+    Reads Parquet bytes into an arrow table, decoding only the required columns.
+    Parquet values are already typed, validation casts them to the declared types.
+    """
+    parquet_file = pq.ParquetFile(pa.BufferReader(body))
+    return parquet_file.read(columns=parquet_columns(parquet_file))
+
+
+def iter_parquet(body: bytes, batch_size: int) -> Iterator[pa.Table]:
+    """
+    Reads Parquet bytes as arrow tables of at most batch_size rows with only the required columns.
+    """
+    parquet_file = pq.ParquetFile(pa.BufferReader(body))
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=parquet_columns(parquet_file)):
+        yield pa.Table.from_batches([batch])
+
+
+def parse_file(body: bytes, key_value: str) -> pd.DataFrame:
+    """
+    Parses a downloaded CSV (plain, gzip or zstd) or Parquet file into a DataFrame, by the format of its key.
+    """
+    file_format, compression = input_format(key_value)
+    if file_format == 'parquet':
+        return parse_parquet(body).to_pandas()
+    return parse_csv(body, compression)
+
+
+def parse_file_arrow(body: bytes, key_value: str) -> pa.Table:
+    """
+    Parses a downloaded CSV (plain, gzip or zstd) or Parquet file into an arrow table, by the format of its key.
+    """
+    file_format, compression = input_format(key_value)
+    if file_format == 'parquet':
+        return parse_parquet(body)
+    return parse_csv_arrow(body, compression)
+
+
+def parse_timestamps(table: pa.Table) -> pa.Table:
+    """
+    Parses the timeUtc text of a streamed block to the declared type. Timestamps without a zone offset are
+    taken as UTC, as validation does with the inferred types of parse_csv_arrow. Text that parses neither
+    way is left as it is, so validation reports it like the other engines.
+    """
+    if 'timeUtc' not in table.column_names:
+        return table
+    arrow_type = get_validator().arrow_types['timeUtc']
+    index = table.schema.get_field_index('timeUtc')
+    values = table.column(index)
+    try:
+        return table.set_column(index, 'timeUtc', values.cast(arrow_type))
+    except pa.ArrowInvalid:
+        pass
+    try:
+        naive = values.cast(pa.timestamp(arrow_type.unit))
+        return table.set_column(index, 'timeUtc', pc.assume_timezone(naive, 'UTC'))
+    except pa.ArrowInvalid:
+        return table
+
+
+def read_file_arrow_in_chunks(
+    bucket_name: str,
+    key_value: str,
+    s3: object,
+    block_size: int = config.block_size,
+    typed: bool = True
+) -> Iterator[pa.Table]:
+    """
+    Reads a CSV (plain, gzip or zstd) file from S3 as a stream of arrow tables with pyarrow.csv.
+    Each table holds one parsed block of roughly block_size bytes, compressed files are decompressed as they are read.
+    Columns are parsed with the types declared in F1TelemetryValidator, so a bad value raises ArrowInvalid.
+    timeUtc is read as text and parsed per block (see parse_timestamps), so naive timestamps are accepted
+    like they are by parse_csv_arrow and the pandas engine.
+    With typed=False the required columns are read as strings instead.
+    Parquet files are read in batches of chunk_size rows with only the required columns.
+    Uncompressed CSV is downloaded with concurrent ranged GETs and each part is parsed
+    while the next ones download, one table per part of range_part_size bytes.
+    """
+    try:
+        file_format, compression = input_format(key_value)
+        arrow_types = get_validator().arrow_types
+        if typed:
+            arrow_types = {**arrow_types, 'timeUtc': pa.string()}
+        else:
+            arrow_types = {column: pa.string() for column in arrow_types}
+        if config.range_reads and file_format == 'csv' and compression is None:
+            logger.info('Streaming %s file from s3 with arrow in ranged parts...', key_value)
+            header, chunks = ranged.header_and_chunks(ranged.iter_parts(
+                s3, bucket_name, key_value, config.range_part_size, config.range_concurrency
+            ))
+            read_options = pacsv.ReadOptions(column_names=pacsv.read_csv(pa.py_buffer(header)).column_names)
+            convert_options = pacsv.ConvertOptions(column_types=arrow_types)
+            for chunk in chunks:
+                table = pacsv.read_csv(pa.py_buffer(chunk), read_options=read_options, convert_options=convert_options)
+                yield parse_timestamps(table) if typed else table
+            return
+        obj = s3.get_object(Bucket=bucket_name, Key=key_value)
+        metrics.record('s3_get', bytes_read=obj.get('ContentLength'))
+        logger.info('Streaming %s file from s3 with arrow in blocks of %s bytes...', key_value, block_size)
+        if file_format == 'parquet':
+            # Row groups need random access, so the file is downloaded first
+            yield from iter_parquet(obj['Body'].read(), config.chunk_size)
+            return
+        reader = pacsv.open_csv(
+            input_stream(obj['Body'], compression),
+            read_options=pacsv.ReadOptions(block_size=block_size),
+            convert_options=pacsv.ConvertOptions(column_types=arrow_types)
+        )
+        for batch in reader:
+            table = pa.Table.from_batches([batch])
+            yield parse_timestamps(table) if typed else table
+    except ClientError as ex:
+        if ex.response['Error']['Code'] == 'NoSuchKey':
+            logger.error("Key doesn't match. Please check the key value entered: %s", key_value)
+            raise FileNotFoundError(f"Key not found: {key_value}") from ex
+        else:
+            logger.error("ClientError while reading from S3: %s", ex)
+            raise
+    except pa.ArrowInvalid:
+        raise
+    except Exception as e:
+        logger.error("Error reading file from S3: %s", e)
+        raise
+
+
+def to_arrow_table(df: pd.DataFrame | pa.Table, columns: List[str] = config.cols, compact: bool = True) -> pa.Table:
+    """
+    Converts the transformed dataframe into an arrow table with the staging table columns.
+    Arrow tables from the arrow engine are used as they are.
+    In compact mode the validated columns are narrowed to F1TelemetryValidator.compact_arrow_types,
+    unless compact is False, e.g. for rejected rows whose values may not fit the narrow types.
+    """
+    final_df = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df)
+    final_df = final_df.select(columns)
+    # Fixing timestamp column
+    final_df = final_df.set_column(
+        final_df.schema.get_field_index("timeUtc"),
+        "timeUtc",
+        final_df.column("timeUtc").cast(pa.timestamp("ms"))
+    )
+    if config.compact and compact:
+        final_df = get_validator().compact_arrow_table(final_df)
+    return final_df
+
+
+def deduplicate_rows(table: pa.Table, keep: str = config.dedup_keep) -> Tuple[pa.Table, int]:
     """
-    Loads DataFrame to an Iceberg table (staging table).
+    Sorts rows by driverNumber and timeUtc and collapses rows sharing both, exact repeats included,
+    to the first or last one in file order ('first' or 'last'). With 'none' rows are only sorted.
+    Duplicates would otherwise be staged and several source rows would match one pk_id in the MERGE.
+    Returns the unique rows and the number of rows dropped.
+    """
+    if keep not in ('first', 'last', 'none'):
+        raise ValueError(f"dedup_keep must be 'first', 'last' or 'none', got: {keep}")
+    # sort_indices is stable, rows of one key stay in file order
+    table = table.take(pc.sort_indices(table, sort_keys=[('driverNumber', 'ascending'), ('timeUtc', 'ascending')]))
+    if keep == 'none' or table.num_rows < 2:
+        return table, 0
+    drivers = table.column('driverNumber').combine_chunks()
+    times = table.column('timeUtc').combine_chunks()
+    # same_key[i] tells whether row i + 1 repeats the key of row i, null keys are never duplicates
+    same_key = pc.fill_null(pc.and_(
+        pc.equal(drivers[1:], drivers[:-1]), pc.equal(times[1:], times[:-1])
+    ), False)
+    unique = pc.invert(same_key)
+    if keep == 'first':
+        mask = pa.concat_arrays([pa.array([True]), unique])
+    else:
+        mask = pa.concat_arrays([unique, pa.array([True])])
+    unique_rows = table.filter(mask)
+    dropped = table.num_rows - unique_rows.num_rows
+    if dropped:
+        logger.info("Dropped %s duplicate rows, kept the %s of each driverNumber and timeUtc", dropped, keep)
+    return unique_rows, dropped
+
+
+def staged_key_rows(chunk: pa.Table, staged_keys: Optional[pa.Table]) -> pa.Array:
+    """
+    Returns the indices of the chunk rows whose driverNumber and timeUtc were staged from earlier chunks.
+    staged_keys holds the driverNumber and timeUtc of those chunks, null keys never match.
+    """
+    if staged_keys is None or not chunk.num_rows:
+        return pa.array([], pa.int64())
+    keys = chunk.select(['driverNumber', 'timeUtc']).cast(staged_keys.schema)
+    keys = keys.append_column('row', pa.array(np.arange(chunk.num_rows)))
+    return keys.join(staged_keys, keys=['driverNumber', 'timeUtc'], join_type='left semi').column('row').combine_chunks()
+
+
+def staged_keys_filter(keys: pa.Table) -> BooleanExpression:
+    """
+    Returns an iceberg row filter matching the driverNumber and timeUtc pairs of keys.
+    """
+    keys = keys.set_column(1, 'timeUtc', keys.column('timeUtc').cast(pa.timestamp('us')).cast(pa.int64()))
+    predicates = [
+        And(EqualTo('driverNumber', group['driverNumber']), In('timeUtc', group['timeUtc_list']))
+        for group in keys.group_by('driverNumber').aggregate([('timeUtc', 'list')]).to_pylist()
+    ]
+    return functools.reduce(Or, predicates)
+
+
+def staging_table_name(event_id: str, session_id: str) -> str:
+    """
+    Returns the staging table name for an event and session.
+    """
+    return "stg_" + str(event_id) + "_" + str(session_id)
+
+
+def create_staging_table(catalog_name: object, database_name: str, table_location: str, event_id: str, session_id: str) -> object:
+    """
+    Creates an empty staging table for the event and session.
+    Drops the table first if it already exists. So, each run will have new copy of the table.
+    Returns the pyiceberg table.
+    """
+    identifier = (database_name, staging_table_name(event_id, session_id))
+    if catalog_name.table_exists(identifier):
+        catalog_name.drop_table(identifier)
+        logger.info("Dropped existing table: %s", identifier)
+    logger.info('Creating staging table: %s', identifier)
+    return catalog_name.create_table(
+        identifier=identifier,
+        schema=config.staging_schema,
+        location=table_location,
+        sort_order=config.staging_sort_order,
+        properties=layout.write_properties()
+    )
+
+
+def load_to_iceberg_table(df: pd.DataFrame | pa.Table, catalog_name: object, database_name: str, table_location: str) -> str:
+    """
+    Loads DataFrame or arrow table to an Iceberg table (staging table).
     Checks if stg tables exists and delete it before writing data.
     Then overwrites the data. So, each run will have new copy of the table.
     """
     try:
-        final_df = pa.Table.from_pandas(df)
-        final_df = final_df.select(config.cols)
-        # Fixing timestamp column
-        final_df = final_df.set_column(
-            final_df.schema.get_field_index("timeUtc"),
-            "timeUtc",
-            final_df.column("timeUtc").cast(pa.timestamp("ms"))
-        )
+        final_df = layout.sort_rows(to_arrow_table(df), config.staging_sort_order, config.schema)
         # Check if dataframe is not empty before writing to table
-        if not df['event_id'].empty:
-            event_id = df['event_id'][0]
-            session_id = df['session_id'][0]
-            table_name = "stg_" + str(event_id) + "_" + str(session_id)
+        if final_df.num_rows:
+            event_id = final_df.column('event_id')[0].as_py()
+            session_id = final_df.column('session_id')[0].as_py()
+            table_name = staging_table_name(event_id, session_id)
             identifier = (database_name, table_name)
             logger.info('Data is ready to populate: %s', identifier)
         else:
             logger.error("No data available to load in table.")
             raise Exception("No data available to load in table.")
 
-        #  Drop table if already exists and create new one 
-        if catalog_name.table_exists(identifier):
-            catalog_name.drop_table(identifier)
-            logger.info("Dropped existing table: %s", identifier)
+        table = create_staging_table(catalog_name, database_name, table_location, event_id, session_id)
         logger.info('Writing data in iceberg table: %s', identifier)
-        table = catalog_name.create_table(
-            identifier=(database_name, table_name),
-            schema=config.schema,
-            location=table_location
-        )
-        # Writing to stg table
-        if catalog_name.table_exists(identifier):
-            table.overwrite(final_df)
-            logger.info("Data ingested successfully into %s", identifier)
+        # Writing to stg table, which was just created empty
+        table.append(final_df)
+        logger.info("Data ingested successfully into %s", identifier)
         return table_name
     except Exception as e:
         logger.error("Error loading data to Iceberg table: %s", e)
         raise
 
+
+def stream_to_iceberg_table(
+    bucket_name: str,
+    key_value: str,
+    s3: object,
+    file_metadata: Dict[str, str],
+    catalog_name: object,
+    database_name: str,
+    table_location: str,
+    chunk_size: int = config.chunk_size,
+    engine: str = config.engine,
+    row_validation: bool = config.row_validation
+) -> Tuple[Dict[str, Any], str, Optional[pa.Table]]:
+    """
+    Streams a CSV file from S3 into the staging table chunk by chunk.
+    Each chunk is validated, transformed and appended on its own, so peak memory
+    depends on chunk_size (block_size for the arrow engine) and not on the size of the file.
+    All appends are committed together once every chunk is valid. With row_validation,
+    the clean rows of each chunk are kept and the bad rows are collected, for the caller to quarantine
+    once the file is committed (see main.quarantine_rows).
+    Duplicate samples are dropped across the whole file (see deduplicate_rows). The driverNumber and timeUtc
+    of every staged row are kept to find repeats in later chunks. With dedup_keep 'first' the repeats are
+    dropped from the later chunk, with 'last' the earlier rows are deleted in the same transaction.
+    The staging table of an invalid file is dropped again.
+    Returns the combined validation result, the staging table name and the rejected rows, if any.
+    """
+    validation_result = {
+        "is_valid": True,
+        "errors": [],
+        "rows_dropped": 0
+    }
+    if row_validation:
+        validation_result.update(rows_valid=0, rows_rejected=0)
+    try:
+        table = create_staging_table(
+            catalog_name, database_name, table_location,
+            file_metadata['event_id'], file_metadata['session_id']
+        )
+        table_name = staging_table_name(file_metadata['event_id'], file_metadata['session_id'])
+        txn = table.transaction()
+        rows = 0
+        staged_keys = None
+        rejected = []
+        if engine == 'arrow':
+            # Row validation nulls out bad values itself, so columns are read as text
+            chunks = read_file_arrow_in_chunks(bucket_name, key_value, s3, typed=not row_validation)
+        else:
+            chunks = read_file_in_chunks(bucket_name, key_value, s3, chunk_size)
+        chunk_num = 0
+        try:
+            for chunk_num, chunk in enumerate(chunks):
+                first_row = rows
+                if row_validation:
+                    result, chunk, chunk_rejected = validate_arrow_rows(chunk)
+                    result["is_valid"] = True
+                    if chunk_rejected.num_rows:
+                        rejected.append(chunk_rejected)
+                    validation_result["rows_valid"] += result["rows_valid"]
+                    validation_result["rows_rejected"] += result["rows_rejected"]
+                    validation_result["errors"].extend(f"Chunk {chunk_num}: {error}" for error in result["errors"])
+                    if not chunk.num_rows:
+                        continue
+                elif engine == 'arrow':
+                    result, chunk = validate_arrow_data(chunk)
+                else:
+                    result = validate_data(chunk)
+                if not result["is_valid"]:
+                    validation_result["is_valid"] = False
+                    validation_result["errors"].extend(
+                        f"Chunk {chunk_num} (rows {first_row}-{first_row + len(chunk) - 1}): {error}" for error in result["errors"]
+                    )
+                    break
+                if engine == 'arrow' or row_validation:
+                    chunk = transform_arrow_data(chunk, file_metadata)
+                else:
+                    chunk = transform_data(chunk, file_metadata)
+                chunk, dropped = deduplicate_rows(to_arrow_table(chunk))
+                validation_result["rows_dropped"] += dropped
+                if config.dedup_keep != 'none':
+                    # Duplicates spanning chunks, one row of each key is kept across the file
+                    repeated = staged_key_rows(chunk, staged_keys)
+                    if len(repeated):
+                        if config.dedup_keep == 'first':
+                            chunk = chunk.filter(pc.invert(pc.is_in(pa.array(np.arange(chunk.num_rows)), repeated)))
+                        else:
+                            txn.delete(staged_keys_filter(chunk.select(['driverNumber', 'timeUtc']).take(repeated)))
+                            rows -= len(repeated)
+                        validation_result["rows_dropped"] += len(repeated)
+                        logger.info("Dropped %s rows repeating a key of an earlier chunk", len(repeated))
+                    keys = chunk.select(['driverNumber', 'timeUtc'])
+                    staged_keys = keys if staged_keys is None else pa.concat_tables([staged_keys, keys.cast(staged_keys.schema)])
+                txn.append(layout.sort_rows(chunk, config.staging_sort_order, config.schema))
+                rows += chunk.num_rows
+        except pa.ArrowInvalid as e:
+            validation_result["is_valid"] = False
+            validation_result["errors"].append(f"Chunk {chunk_num}: values could not be parsed with the declared types: {e}")
+        if row_validation and validation_result["is_valid"]:
+            validation_result["is_valid"] = validation_result["rows_valid"] > 0
+        # Nothing is committed for a file with invalid data
+        if validation_result["is_valid"]:
+            txn.commit_transaction()
+            validation_result["rows_loaded"] = rows
+            logger.info("Streamed %s rows into %s", rows, table_name)
+        else:
+            logger.error("Streaming aborted for %s", key_value)
+            # Invalid files are not retried, the empty staging table would never be merged and purged
+            try:
+                catalog_name.purge_table((database_name, table_name))
+                logger.info("Deleted staging table: %s", table_name)
+            except Exception as e:
+                logger.warning("Failed to delete staging table %s: %s", table_name, e)
+        rejected = pa.concat_tables(rejected, promote_options='permissive') if rejected else None
+        return validation_result, table_name, rejected
+    except Exception as e:
+        logger.error("Error streaming data to Iceberg table: %s", e)
+        raise
+
+
 def load_sql_query(filepath: str) -> str:
     with open(filepath, 'r') as file:
         return file.read()
 
+def build_merge_query(catalog: str, database: str, src_table: str, dst_table: str) -> str:
+    """
+    Renders the merge query from src/sql/merge_fact_table.sql.
+    """
+    sql_path = 'src/sql/merge_fact_table.sql'
+    query_template = load_sql_query(sql_path)
+    return query_template.format(
+        catalog=catalog,
+        database=database,
+        src_table=src_table,
+        dst_table=dst_table
+    )
+
+
+def append_disjoint_staging(iceberg_catalog: object, database: str, src_table: str, dst_table: str) -> Optional[Dict[str, Any]]:
+    """
+    Appends the rows of a staging table to the fact table when none of their keys can be in it yet.
+    Rows get the casts and pk_id of src/sql/merge_fact_table.sql (see upsert.to_fact_rows).
+    Returns the number of rows appended, or None when the rows must be merged.
+    """
+    try:
+        fact = iceberg_catalog.load_table((database, dst_table))
+        rows = upsert.to_fact_rows(iceberg_catalog.load_table((database, src_table)).scan().to_arrow())
+    except Exception as e:
+        logger.warning("Could not probe the key index for %s, merging: %s", src_table, e)
+        return None
+    if not upsert.append_if_disjoint(fact, rows):
+        return None
+    logger.info("Appended %s rows of %s, none of their keys are in %s yet", rows.num_rows, src_table, dst_table)
+    return {"state": "APPENDED", "rows": rows.num_rows}
+
+
 def merge_to_fact_table(
     athena_client: object,
     catalog: str,
     database: str,
     athena_output_bucket: str,
     src_table: str,
-    dst_table: str
-) -> None:
+    dst_table: str,
+    iceberg_catalog: Optional[object] = None
+) -> Dict[str, Any]:
     """
     Merges stage data into the fact table using Athena.
     It takes athena clients and details for source and destination tables.
-    Performs merge operation with fact table.
-    If successful, dropping the source (staging table) in the end.       
+    Performs merge operation with fact table. With key_index, staged rows whose keys cannot be in the
+    fact table yet are appended with pyiceberg instead (see upsert.append_if_disjoint), the append
+    commits against the probed snapshot so a concurrent MERGE or append makes it probe again.
+    If successful, the source (staging table) and its data files are purged through the iceberg catalog.
+    Returns the execution details (queue time, engine time, bytes scanned) of the merge,
+    or the number of rows appended.
     """
     client = athena_client
+    staging_catalog = config.glue_catalog if iceberg_catalog is None else iceberg_catalog
 
     try:
-        sql_path = 'src/sql/merge_fact_table.sql'
-        query_template = load_sql_query(sql_path)
-        query = query_template.format(
-            catalog=catalog,
-            database=database,
-            src_table=src_table,
-            dst_table=dst_table
-        )
-        response = client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={
-                'Database': database
-            },
-            ResultConfiguration={
-                'OutputLocation': athena_output_bucket
-            }
-        )
-        logger.info("Started Athena query for merging tables: %s", response)
-        query_execution_id = response['QueryExecutionId']
-
-        while True:
-            response = client.get_query_execution(QueryExecutionId=query_execution_id)
-            state = response['QueryExecution']['Status']['State']
-            if state in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                break
-            time.sleep(10)
-        if state == 'SUCCEEDED':
-            logger.info("Successfully added data in the fact table: %s", dst_table)
-            try:
-                client.delete_table(CatalogId=catalog, DatabaseName=database, Name=src_table)
-                logger.info("Deleted staging table: %s", src_table)
-            except Exception as e:
-                logger.warning("Failed to delete staging table %s: %s", src_table, e)
-        else:
-            logger.error("Error in ingesting data into fact table. State: %s", state)
-            raise Exception(f"Athena query failed with state: {state}")
+        execution = None
+        if config.key_index:
+            execution = append_disjoint_staging(staging_catalog, database, src_table, dst_table)
+        if execution is None:
+            query = build_merge_query(catalog, database, src_table, dst_table)
+            execution = athena.run_query(client, query, database, athena_output_bucket)
+            # Athena committed outside pyiceberg, so cached metadata of the fact table is stale
+            catalog_cache.invalidate(staging_catalog, (database, dst_table))
+        logger.info("Successfully added data in the fact table: %s", dst_table)
+        try:
+            staging_catalog.purge_table((database, src_table))
+            logger.info("Deleted staging table: %s", src_table)
+        except Exception as e:
+            logger.warning("Failed to delete staging table %s: %s", src_table, e)
+        return execution
     except Exception as e:
         logger.error("Error during merge to fact table: %s", e)
-        raise 
\ No newline at end of file
+        raise
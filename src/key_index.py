@@ -0,0 +1,98 @@
+import logging
+import pyarrow as pa
+from functools import reduce
+from typing import Dict, List, Any, Optional
+from pyiceberg.expressions import (
+    AlwaysFalse,
+    And,
+    BooleanExpression,
+    EqualTo,
+    GreaterThanOrEqual,
+    LessThanOrEqual,
+    Or
+)
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+# The primary key is derived from event_id, session_id, drivernumber and ts, rows of two batches
+# can only collide when all four overlap.
+# Above this many ranges a batch is probed with one range per session instead of one per driver
+MAX_RANGES = 200
+
+
+def ranges_from_rows(rows: pa.Table) -> List[Dict[str, Any]]:
+    """
+    Returns the ts range of each event, session and driver in fact table rows.
+    Each range maps a key column to its (min, max), ts in microseconds like the manifest bounds.
+    """
+    rows = rows.select(['event_id', 'session_id', 'drivernumber', 'ts'])
+    rows = rows.set_column(3, 'ts', rows.column('ts').cast(pa.timestamp('us')).cast(pa.int64()))
+    stats = rows.group_by(['event_id', 'session_id', 'drivernumber']).aggregate([('ts', 'min'), ('ts', 'max')])
+    return [
+        {
+            'event_id': (row['event_id'], row['event_id']),
+            'session_id': (row['session_id'], row['session_id']),
+            'drivernumber': (row['drivernumber'], row['drivernumber']),
+            'ts': (row['ts_min'], row['ts_max'])
+        }
+        for row in stats.to_pylist()
+    ]
+
+
+def overlap_filter(ranges: List[Dict[str, Any]]) -> BooleanExpression:
+    """
+    Builds the fact table filter matching every row that falls in one of the ranges.
+    """
+    def range_filter(bounds: Dict[str, Any]) -> BooleanExpression:
+        predicates = []
+        for column, (low, high) in bounds.items():
+            if low == high:
+                predicates.append(EqualTo(column, low))
+            else:
+                predicates.extend([GreaterThanOrEqual(column, low), LessThanOrEqual(column, high)])
+        return And(*predicates)
+
+    if not ranges:
+        return AlwaysFalse()
+    return reduce(Or, (range_filter(bounds) for bounds in ranges))
+
+
+def may_overlap(fact_table: object, ranges: Optional[List[Dict[str, Any]]]) -> bool:
+    """
+    Tells whether the fact table may already hold keys in the ranges.
+    Iceberg keeps the min/max of every column of every data file in the manifests, per event_id partition,
+    and fact files are sorted by driver and time, so these bounds act as the key index: a batch of a new
+    session, or of new laps, matches no file and is disjoint. False positives only cost the overwrite.
+    Unknown ranges (None) may overlap.
+    """
+    if ranges is None:
+        return True
+    if len(ranges) > MAX_RANGES:
+        ranges = coarsen(ranges)
+    files = fact_table.scan(row_filter=overlap_filter(ranges), selected_fields=('pk_id',)).plan_files()
+    return any(True for _ in files)
+
+
+def coarsen(ranges: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Merges ranges per event and session, covering every driver and the whole ts span of the session.
+    """
+    merged = {}
+    for bounds in ranges:
+        key = (bounds['event_id'], bounds['session_id'])
+        if key not in merged:
+            merged[key] = dict(bounds)
+            continue
+        current = merged[key]
+        for column in ('drivernumber', 'ts'):
+            current[column] = (min(current[column][0], bounds[column][0]), max(current[column][1], bounds[column][1]))
+    return list(merged.values())
+
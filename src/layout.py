@@ -0,0 +1,136 @@
+import logging
+import pyarrow as pa
+import pyiceberg
+from pyiceberg.partitioning import PartitionSpec
+from pyiceberg.schema import Schema
+from pyiceberg.table.sorting import SortOrder, SortField
+from pyiceberg.table.update import AddSortOrderUpdate, SetDefaultSortOrderUpdate
+from typing import List, Dict, Any, Optional, Tuple
+import src.config as config
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+# pyiceberg versions whose private Transaction._apply is known to work, see apply_updates.
+# pyproject.toml pins pyiceberg to them.
+PRIVATE_API_VERSIONS = ('0.9.1',)
+
+
+def write_properties() -> Dict[str, str]:
+    """
+    Returns table properties for data file and row group sizes.
+    The write.* properties are used by pyiceberg, write_target_data_file_size_bytes by Athena.
+    Row groups are limited by rows only, pyiceberg warns on every write of a table with write.parquet.row-group-size-bytes.
+    """
+    return {
+        "write.target-file-size-bytes": str(config.target_file_size_bytes),
+        "write.parquet.row-group-limit": str(config.row_group_limit),
+        "write_target_data_file_size_bytes": str(config.target_file_size_bytes)
+    }
+
+
+def apply_updates(txn: object, updates: Tuple[object, ...]) -> None:
+    """
+    Adds table metadata updates that pyiceberg has no public API for yet, replacing the sort order
+    and expiring snapshots, to a transaction through the private Transaction._apply.
+    Raises RuntimeError on pyiceberg versions not in PRIVATE_API_VERSIONS, whose private API may differ.
+    """
+    if pyiceberg.__version__ not in PRIVATE_API_VERSIONS:
+        raise RuntimeError(
+            f"Transaction._apply is only known to work with pyiceberg {', '.join(PRIVATE_API_VERSIONS)}, "
+            f"found {pyiceberg.__version__}"
+        )
+    txn._apply(updates)
+
+
+def sort_columns(sort_order: SortOrder, schema: Schema) -> List[str]:
+    """
+    Returns the column names of a sort order.
+    """
+    return [schema.find_column_name(field.source_id) for field in sort_order.fields]
+
+
+def write_types(data: pa.Table) -> pa.Table:
+    """
+    Widens compact columns to types iceberg can store: dictionary columns are decoded
+    (the parquet writer dictionary encodes them again) and 8 and 16 bit integers become int32.
+    """
+    for index, field in enumerate(data.schema):
+        if pa.types.is_dictionary(field.type):
+            data = data.set_column(index, field.name, data.column(index).cast(field.type.value_type))
+        elif field.type in (pa.int8(), pa.int16()):
+            data = data.set_column(index, field.name, data.column(index).cast(pa.int32()))
+    return data
+
+
+def sort_rows(data: pa.Table, sort_order: SortOrder, schema: Schema) -> pa.Table:
+    """
+    Sorts rows by the columns of the table sort order before they are written.
+    Sorted files have narrow min/max stats, so readers can skip files and row groups.
+    Compact columns are widened after sorting (see write_types). Rows of an unsorted table keep their order.
+    """
+    columns = sort_columns(sort_order, schema)
+    return write_types(data.sort_by([(column, "ascending") for column in columns]) if columns else data)
+
+
+def plan_table_layout(table: object, sort_order: SortOrder, schema: Schema, partition_spec: Optional[PartitionSpec] = None) -> Dict[str, Any]:
+    """
+    Compares an existing table, e.g. one created by Athena DDL, to the configured layout.
+    Sort order and partition spec refer to field ids of schema and are matched to the table by column name.
+    Returns the write properties to set, the sort fields when the sort order differs (else None)
+    and the missing partition fields.
+    """
+    table_schema = table.schema()
+
+    def table_field(source_id: int) -> int:
+        return table_schema.find_field(schema.find_column_name(source_id)).field_id
+
+    properties = {key: value for key, value in write_properties().items() if table.properties.get(key) != value}
+    sort_fields = [SortField(table_field(field.source_id), field.transform) for field in sort_order.fields]
+    current_sort_fields = [(field.source_id, str(field.transform)) for field in table.sort_order().fields]
+    if [(field.source_id, str(field.transform)) for field in sort_fields] == current_sort_fields:
+        sort_fields = None
+    missing_partitions = []
+    if partition_spec is not None:
+        current_partitions = [(field.source_id, str(field.transform)) for field in table.spec().fields]
+        missing_partitions = [
+            field for field in partition_spec.fields
+            if (table_field(field.source_id), str(field.transform)) not in current_partitions
+        ]
+    return {"properties": properties, "sort_fields": sort_fields, "partitions": missing_partitions}
+
+
+def apply_table_layout(table: object, sort_order: SortOrder, schema: Schema, partition_spec: Optional[PartitionSpec] = None) -> object:
+    """
+    Brings an existing table to the configured layout (see plan_table_layout).
+    Sets write properties, declares the sort order and adds missing partition fields.
+    Evolving the spec is a table maintenance step (see src.maintenance), never part of a write.
+    Nothing is committed when the table already has the layout.
+    Returns the refreshed table.
+    """
+    plan = plan_table_layout(table, sort_order, schema, partition_spec)
+    if not plan["properties"] and plan["sort_fields"] is None and not plan["partitions"]:
+        return table
+
+    logger.info("Updating layout of table %s", table.name())
+    with table.transaction() as txn:
+        if plan["properties"]:
+            txn.set_properties(plan["properties"])
+        if plan["sort_fields"] is not None:
+            order_id = max(order.order_id for order in table.metadata.sort_orders) + 1
+            apply_updates(txn, (
+                AddSortOrderUpdate(sort_order=SortOrder(*plan["sort_fields"], order_id=order_id)),
+                SetDefaultSortOrderUpdate(sort_order_id=-1)
+            ))
+        if plan["partitions"]:
+            with txn.update_spec() as update:
+                for field in plan["partitions"]:
+                    update.add_field(schema.find_column_name(field.source_id), field.transform, field.name)
+    return table.refresh()
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import datetime
+import threading
+import logging
+import pyarrow as pa
+from pyiceberg.exceptions import CommitFailedException
+from pyiceberg.expressions import And, EqualTo, In
+from typing import Dict, List, Any, Optional
+import src.config as config
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+# Files in these states are not processed again for the same ETag and size.
+# Invalid files would fail validation the same way, failed ones are retried.
+COMPLETED_STATUSES = ['succeeded', 'invalid']
+
+
+def file_identity(s3: object, bucket_name: str, key_value: str) -> Dict[str, Any]:
+    """
+    Identifies an S3 object version by bucket, key, ETag and size with a single head_object call.
+    """
+    head = s3.head_object(Bucket=bucket_name, Key=key_value)
+    return {
+        "bucket": bucket_name,
+        "key": key_value,
+        "etag": head['ETag'].strip('"'),
+        "size": head['ContentLength']
+    }
+
+
+def ledger_entry(identity: Dict[str, Any], status: str, started: float, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Builds a ledger entry for a processed file. started is a time.time() timestamp.
+    """
+    result = result or {}
+    finished = time.time()
+    return {
+        **identity,
+        "status": status,
+        "rows_loaded": result.get("rows_loaded"),
+        "rows_rejected": result.get("rows_rejected"),
+        "started_at": datetime.datetime.fromtimestamp(started, datetime.UTC).replace(tzinfo=None),
+        "finished_at": datetime.datetime.fromtimestamp(finished, datetime.UTC).replace(tzinfo=None),
+        "duration_ms": int((finished - started) * 1000),
+        "error": error
+    }
+
+
+class FileLedger:
+    """
+    Ingestion ledger kept as a JSON lines file, for local runs and backfills.
+    Entries are loaded once and looked up in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def _key(self, identity: Dict[str, Any]) -> tuple:
+        return (identity["bucket"], identity["key"], identity["etag"], identity["size"])
+
+    def _load(self) -> Dict[tuple, Dict[str, Any]]:
+        if self.entries is None:
+            self.entries = {}
+            if os.path.exists(self.path):
+                with open(self.path) as file:
+                    for line in file:
+                        entry = json.loads(line)
+                        self.entries[self._key(entry)] = entry
+        return self.entries
+
+    def lookup(self, identity: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Returns the latest entry for the file, or None if it was never processed.
+        """
+        return self.lookup_many([identity])[0]
+
+    def lookup_many(self, identities: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Returns the latest entry of each file, None for files never processed.
+        """
+        with self.lock:
+            entries = self._load()
+            return [entries.get(self._key(identity)) for identity in identities]
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """
+        Stores the entry of a processed file.
+        """
+        self.record_many([entry])
+
+    def record_many(self, entries: List[Dict[str, Any]]) -> None:
+        """
+        Stores the entries of processed files with a single write.
+        """
+        if not entries:
+            return
+        with self.lock:
+            loaded = self._load()
+            with open(self.path, 'a') as file:
+                file.write("".join(json.dumps(entry, default=str) + "\n" for entry in entries))
+            for entry in entries:
+                loaded[self._key(entry)] = entry
+
+
+class IcebergLedger:
+    """
+    Ingestion ledger kept as a small iceberg table next to the fact table.
+    Entries recorded by this process are also kept in memory, so duplicates in warm
+    invocations need no lookup at all.
+    """
+
+    def __init__(self, catalog_name: object, database_name: str, table_name: str, table_location: str):
+        self.catalog_name = catalog_name
+        self.identifier = (database_name, table_name)
+        self.table_location = f"{table_location}/{table_name}"
+        self.lock = threading.Lock()
+        self.table = None
+        self.recent = {}
+
+    def _key(self, identity: Dict[str, Any]) -> tuple:
+        return (identity["bucket"], identity["key"], identity["etag"], identity["size"])
+
+    def _table(self) -> object:
+        if self.table is None:
+            if self.catalog_name.table_exists(self.identifier):
+                self.table = self.catalog_name.load_table(self.identifier)
+            else:
+                logger.info('Creating ledger table: %s', self.identifier)
+                self.table = self.catalog_name.create_table(
+                    identifier=self.identifier,
+                    schema=config.ledger_schema,
+                    location=self.table_location
+                )
+        return self.table
+
+    def lookup(self, identity: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Returns the latest entry for the file, or None if it was never processed.
+        """
+        return self.lookup_many([identity])[0]
+
+    def lookup_many(self, identities: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Returns the latest entry of each file, None for files never processed.
+        Files not recorded by this process are looked up with one scan of the ledger per bucket.
+        """
+        with self.lock:
+            found = {}
+            missing = [identity for identity in identities if self._key(identity) not in self.recent]
+            if missing:
+                table = self._table().refresh()
+                for bucket in sorted({identity["bucket"] for identity in missing}):
+                    keys = sorted({identity["key"] for identity in missing if identity["bucket"] == bucket})
+                    rows = table.scan(row_filter=And(EqualTo('bucket', bucket), In('key', keys))).to_arrow()
+                    for row in rows.to_pylist():
+                        key = self._key(row)
+                        if key not in found or row["finished_at"] > found[key]["finished_at"]:
+                            found[key] = row
+            return [self.recent.get(self._key(identity), found.get(self._key(identity))) for identity in identities]
+
+    def record(self, entry: Dict[str, Any], retries: int = config.commit_retries) -> None:
+        """
+        Stores the entry of a processed file.
+        """
+        self.record_many([entry], retries)
+
+    def record_many(self, entries: List[Dict[str, Any]], retries: int = config.commit_retries) -> None:
+        """
+        Stores the entries of processed files in a single commit.
+        Concurrent invocations append to the same table, the commit is retried when another one committed first.
+        """
+        if not entries:
+            return
+        with self.lock:
+            data = pa.Table.from_pylist(entries, schema=config.ledger_schema.as_arrow())
+            table = self._table()
+            for attempt in range(retries + 1):
+                try:
+                    table.append(data)
+                    break
+                except CommitFailedException as e:
+                    if attempt == retries:
+                        raise
+                    logger.warning("Commit conflict on %s, retrying: %s", self.identifier, e)
+                    table = table.refresh()
+            for entry in entries:
+                self.recent[self._key(entry)] = entry
+
+
+def record_entry(ledger: FileLedger | IcebergLedger, entry: Dict[str, Any]) -> bool:
+    """
+    Records an entry without raising. The outcome of the file does not depend on it: a loaded file stays loaded,
+    and a missing entry only means a re-delivery of the file is processed again, which the MERGE makes harmless.
+    Returns whether the entry was stored.
+    """
+    try:
+        ledger.record(entry)
+        return True
+    except Exception as e:
+        logger.error("Failed to record %s as %s in the ledger: %s", entry["key"], entry["status"], e)
+        return False
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def open_ledger(spec: str) -> FileLedger | IcebergLedger:
+    """
+    Opens a ledger from its setting: 'iceberg' for the ledger table or 'file:<path>' for a local file.
+    """
+    if spec.startswith('file:'):
+        return FileLedger(spec[len('file:'):])
+    return IcebergLedger(config.glue_catalog, config.database_name, config.ledger_table, config.table_location)
+
+
+def get_ledger() -> Optional[FileLedger | IcebergLedger]:
+    """
+    Returns the configured ledger, or None when the ledger is disabled.
+    """
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None and config.ledger:
+            _ledger = open_ledger(config.ledger)
+        return _ledger
@@ -0,0 +1,390 @@
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+from urllib.parse import urlparse
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+from pyiceberg.exceptions import CommitFailedException
+from pyiceberg.expressions import AlwaysTrue, EqualTo
+from pyiceberg.table.update import RemoveSnapshotsUpdate
+import src.config as config
+import src.layout as layout
+import src.catalog_cache as catalog_cache
+import src.metrics as metrics
+from src.athena import run_query
+from src.etl import load_sql_query
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+# see the 'status' and 'data_file.content' columns of Table.inspect.entries()
+DELETED_STATUS = 2
+DATA_CONTENT = 0
+STAGING_PREFIX = 'stg_'
+# metadata json files are never treated as orphans, catalogs may still point at older versions
+METADATA_SUFFIXES = ('.metadata.json', 'version-hint.text')
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def summarize(files: Dict[str, int]) -> Dict[str, int]:
+    """
+    Returns the file count and total bytes of {path: size}.
+    """
+    return {"files": len(files), "bytes": sum(files.values())}
+
+
+def partition_files(table: object, small_file_bytes: int) -> Dict[str, Dict[str, int]]:
+    """
+    Counts the live files of each event_id partition of the current snapshot:
+    data files and bytes, data files under small_file_bytes and delete files.
+    An unpartitioned table, like the ledger or quarantine table, is counted as one partition keyed None.
+    Returns an empty dict for tables partitioned by other fields.
+    """
+    fields = [field.name for field in table.spec().fields]
+    if fields and 'event_id' not in fields:
+        return {}
+    entries = table.inspect.entries().to_pylist()
+    partitions = {}
+    for file in (entry['data_file'] for entry in entries if entry['status'] != DELETED_STATUS):
+        stats = partitions.setdefault(file['partition']['event_id'] if fields else None, {
+            "data_files": 0, "data_bytes": 0, "small_files": 0, "small_bytes": 0, "delete_files": 0, "delete_bytes": 0
+        })
+        size = file['file_size_in_bytes']
+        if file['content'] == DATA_CONTENT:
+            stats["data_files"] += 1
+            stats["data_bytes"] += size
+            if size < small_file_bytes:
+                stats["small_files"] += 1
+                stats["small_bytes"] += size
+        else:
+            stats["delete_files"] += 1
+            stats["delete_bytes"] += size
+    return partitions
+
+
+def plan_compaction(
+    table: object,
+    small_file_bytes: int = config.small_file_bytes,
+    min_files: int = config.compaction_min_files,
+    delete_file_threshold: int = config.delete_file_threshold,
+    target_file_size_bytes: int = config.target_file_size_bytes
+) -> List[Dict[str, Any]]:
+    """
+    Picks the event_id partitions worth compacting: at least min_files small data files,
+    or at least delete_file_threshold delete files. The event_id of an unpartitioned table is None.
+    Each entry holds the files and bytes that are rewritten and the expected number of files after.
+    """
+    plan = []
+    for event_id, stats in sorted(partition_files(table, small_file_bytes).items()):
+        if stats["small_files"] < min_files and stats["delete_files"] < delete_file_threshold:
+            continue
+        rewritten = stats["small_bytes"] + stats["delete_bytes"]
+        plan.append({
+            "event_id": event_id,
+            "files": stats["small_files"] + stats["delete_files"],
+            "bytes": rewritten,
+            "files_after": math.ceil(stats["small_bytes"] / target_file_size_bytes)
+        })
+    return plan
+
+
+def compact_partition(
+    table: object,
+    event_id: Optional[str],
+    write_mode: str,
+    database_name: str,
+    athena_client: Optional[object] = None,
+    retries: int = config.commit_retries
+) -> None:
+    """
+    Rewrites one event_id partition into files of the target size.
+    With Athena, OPTIMIZE bin packs the small files and applies the delete files in place.
+    Direct writes never produce delete files, so the partition is read, sorted and overwritten with pyiceberg,
+    retrying when another writer committed first. An unpartitioned table (event_id None) is rewritten whole
+    with pyiceberg in both modes, the ledger and quarantine tables are only ever appended by pyiceberg.
+    """
+    if write_mode == 'athena' and event_id is not None:
+        query = load_sql_query('src/sql/optimize_partition.sql').format(
+            database=database_name, table=table.name()[-1], event_id=event_id
+        )
+        client = config.athena if athena_client is None else athena_client
+        run_query(client, query, database_name, config.table_location)
+        return
+    row_filter = AlwaysTrue() if event_id is None else EqualTo('event_id', event_id)
+    for attempt in range(retries + 1):
+        rows = layout.sort_rows(table.scan(row_filter=row_filter).to_arrow(), table.sort_order(), table.schema())
+        try:
+            table.overwrite(rows, overwrite_filter=row_filter)
+            return
+        except CommitFailedException as e:
+            if attempt == retries:
+                raise
+            logger.warning("Commit conflict compacting %s of %s, retrying: %s", event_id, table.name(), e)
+            table = table.refresh()
+
+
+def snapshot_files(table: object, snapshots: List[object], cache: Optional[Dict[str, Dict[str, int]]] = None) -> Dict[str, int]:
+    """
+    Returns {path: size} of every file the snapshots reference: manifest lists, manifests and live data and delete files.
+    Manifests are shared between snapshots, so their entries are read once and kept in cache.
+    """
+    cache = {} if cache is None else cache
+    io = table.io
+    files = {}
+    for snapshot in snapshots:
+        files[snapshot.manifest_list] = len(io.new_input(snapshot.manifest_list))
+        for manifest in snapshot.manifests(io):
+            if manifest.manifest_path not in cache:
+                cache[manifest.manifest_path] = {
+                    entry.data_file.file_path: entry.data_file.file_size_in_bytes
+                    for entry in manifest.fetch_manifest_entry(io, discard_deleted=True)
+                }
+            files[manifest.manifest_path] = manifest.manifest_length
+            files.update(cache[manifest.manifest_path])
+    return files
+
+
+def plan_snapshot_expiry(
+    table: object,
+    max_age_seconds: int = config.snapshot_max_age_seconds,
+    retain_last: int = config.snapshots_retain_last
+) -> Dict[str, Any]:
+    """
+    Picks the snapshots older than max_age_seconds, keeping the newest retain_last and every branch or tag head.
+    Returns their ids and the {path: size} of files no retained snapshot references, which expiring them frees.
+    """
+    snapshots = sorted(table.metadata.snapshots, key=lambda snapshot: snapshot.timestamp_ms)
+    kept_ids = {ref.snapshot_id for ref in table.metadata.refs.values()}
+    if retain_last:
+        kept_ids.update(snapshot.snapshot_id for snapshot in snapshots[-retain_last:])
+    cutoff = now_ms() - max_age_seconds * 1000
+    expired = [s for s in snapshots if s.timestamp_ms < cutoff and s.snapshot_id not in kept_ids]
+    if not expired:
+        return {"snapshot_ids": [], "files": {}}
+    expired_ids = {snapshot.snapshot_id for snapshot in expired}
+    cache = {}
+    retained = snapshot_files(table, [s for s in snapshots if s.snapshot_id not in expired_ids], cache)
+    files = {path: size for path, size in snapshot_files(table, expired, cache).items() if path not in retained}
+    return {"snapshot_ids": sorted(expired_ids), "files": files}
+
+
+def expire_snapshots(table: object, plan: Dict[str, Any]) -> None:
+    """
+    Removes the planned snapshots from the table metadata, then deletes the files only they referenced.
+    Files are deleted after the commit, so a failed commit leaves the table intact.
+    """
+    if not plan["snapshot_ids"]:
+        return
+    with table.transaction() as txn:
+        layout.apply_updates(txn, (RemoveSnapshotsUpdate(snapshot_ids=plan["snapshot_ids"]),))
+    delete_files(table.io, plan["files"])
+
+
+def delete_files(io: object, files: Dict[str, int]) -> None:
+    for path in files:
+        try:
+            io.delete(path)
+        except FileNotFoundError:
+            pass
+
+
+def list_files(location: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    Yields path, size and last modified time in ms of every file under a table location.
+    S3 locations are listed page by page, file locations are walked (local catalogs).
+    """
+    parsed = urlparse(location)
+    if parsed.scheme in ('s3', 's3a', 's3n'):
+        paginator = config.s3.get_paginator('list_objects_v2')
+        prefix = parsed.path.lstrip('/').rstrip('/') + '/'
+        for page in paginator.paginate(Bucket=parsed.netloc, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield f"{parsed.scheme}://{parsed.netloc}/{obj['Key']}", obj['Size'], int(obj['LastModified'].timestamp() * 1000)
+        return
+    root = parsed.path if parsed.scheme == 'file' else location
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            yield f"file://{path}" if parsed.scheme == 'file' else path, stat.st_size, int(stat.st_mtime * 1000)
+
+
+def plan_orphans(table: object, min_age_seconds: int = config.orphan_min_age_seconds) -> Dict[str, int]:
+    """
+    Finds files under the table location that no snapshot references, e.g. left by failed writes.
+    Files younger than min_age_seconds may belong to a commit in progress and are kept, as are metadata json files.
+    Returns {path: size} of the orphans.
+    """
+    referenced = snapshot_files(table, table.metadata.snapshots)
+    cutoff = now_ms() - min_age_seconds * 1000
+    return {
+        path: size for path, size, modified in list_files(table.location())
+        if path not in referenced and modified < cutoff and not path.endswith(METADATA_SUFFIXES)
+    }
+
+
+def plan_staging_sweep(catalog_name: object, database_name: str, max_age_seconds: int = config.staging_max_age_seconds) -> Dict[str, Dict[str, int]]:
+    """
+    Finds staging tables not updated for max_age_seconds, left behind when a merge failed.
+    Tables still being written or merged are updated more recently and are kept.
+    Returns the file count and bytes of each stale table.
+    """
+    cutoff = now_ms() - max_age_seconds * 1000
+    stale = {}
+    for identifier in catalog_name.list_tables(database_name):
+        if not identifier[-1].startswith(STAGING_PREFIX):
+            continue
+        table = catalog_name.load_table(identifier)
+        if table.metadata.last_updated_ms < cutoff:
+            stale[identifier[-1]] = summarize(snapshot_files(table, table.metadata.snapshots))
+    return stale
+
+
+def maintain_table(
+    catalog_name: object,
+    database_name: str,
+    table_name: str,
+    dry_run: bool = False,
+    write_mode: str = config.write_mode
+) -> Dict[str, Any]:
+    """
+    Brings the fact table to the configured layout, compacts the partitions of one table, expires its old snapshots
+    and removes its orphaned files, in that order, so compaction writes the new layout and the files it replaced
+    are freed once their snapshots expire.
+    Returns what was done, or with dry_run what would be done, as files and bytes per action.
+    """
+    table = catalog_name.load_table((database_name, table_name))
+    table_layout = {"properties": {}, "sort_fields": None, "partitions": []}
+    if table_name == config.fact_table:
+        table_layout = layout.plan_table_layout(
+            table, config.fact_sort_order, config.fact_schema, config.fact_partition_spec
+        )
+        if not dry_run:
+            table = layout.apply_table_layout(
+                table, config.fact_sort_order, config.fact_schema, config.fact_partition_spec
+            )
+    compaction = plan_compaction(
+        table, config.small_file_bytes, config.compaction_min_files, config.delete_file_threshold,
+        config.target_file_size_bytes
+    )
+    if not dry_run:
+        for partition in compaction:
+            logger.info("Compacting %s of %s: %s", partition["event_id"], table_name, partition)
+            compact_partition(table, partition["event_id"], write_mode, database_name)
+        # Athena OPTIMIZE commits outside pyiceberg
+        catalog_cache.invalidate(catalog_name, (database_name, table_name))
+        table = table.refresh()
+    expiry = plan_snapshot_expiry(table, config.snapshot_max_age_seconds, config.snapshots_retain_last)
+    if not dry_run:
+        expire_snapshots(table, expiry)
+        table = table.refresh()
+    orphans = plan_orphans(table, config.orphan_min_age_seconds)
+    if not dry_run:
+        delete_files(table.io, orphans)
+    report = {
+        "layout": {
+            "properties": sorted(table_layout["properties"]),
+            "sort_order": table_layout["sort_fields"] is not None,
+            "partitions": [field.name for field in table_layout["partitions"]]
+        },
+        "compaction": {
+            "partitions": [partition["event_id"] for partition in compaction],
+            "files": sum(partition["files"] for partition in compaction),
+            "bytes": sum(partition["bytes"] for partition in compaction),
+            "files_after": sum(partition["files_after"] for partition in compaction)
+        },
+        "expired_snapshots": {"snapshots": len(expiry["snapshot_ids"]), **summarize(expiry["files"])},
+        "orphans": summarize(orphans)
+    }
+    logger.info("%s %s: %s", "Would maintain" if dry_run else "Maintained", table_name, report)
+    return report
+
+
+def run_maintenance(
+    catalog_name: object,
+    database_name: str,
+    tables: Optional[List[str]] = None,
+    dry_run: bool = False,
+    write_mode: str = config.write_mode
+) -> Dict[str, Any]:
+    """
+    Maintains the given tables, by default the fact, rollup, quarantine and ledger tables that exist,
+    and purges stale staging tables. A table that fails is reported with its error and the others still run.
+    Returns a report of files and bytes reclaimed per table and action, and the totals.
+    """
+    if not tables:
+        tables = config.maintenance_tables or [
+            config.fact_table, config.driver_session_table, config.telemetry_1hz_table, config.quarantine_table,
+            config.ledger_table
+        ]
+        tables = [name for name in tables if name and catalog_name.table_exists((database_name, name))]
+    report = {"dry_run": dry_run, "tables": {}}
+    for table_name in tables:
+        with metrics.stage('maintenance'):
+            try:
+                report["tables"][table_name] = maintain_table(catalog_name, database_name, table_name, dry_run, write_mode)
+            except Exception as e:
+                logger.error("Error maintaining %s: %s", table_name, e)
+                report["tables"][table_name] = {"error": str(e)}
+    staging = plan_staging_sweep(catalog_name, database_name, config.staging_max_age_seconds)
+    if not dry_run:
+        for table_name in staging:
+            logger.info("Purging stale staging table: %s", table_name)
+            catalog_name.purge_table((database_name, table_name))
+    report["staging_tables"] = staging
+
+    maintained = [table for table in report["tables"].values() if "error" not in table]
+    report["reclaimed"] = {
+        "files": sum(table["expired_snapshots"]["files"] + table["orphans"]["files"] for table in maintained)
+        + sum(table["files"] for table in staging.values()),
+        "bytes": sum(table["expired_snapshots"]["bytes"] + table["orphans"]["bytes"] for table in maintained)
+        + sum(table["bytes"] for table in staging.values()),
+        "compacted_files": sum(table["compaction"]["files"] - table["compaction"]["files_after"] for table in maintained)
+    }
+    metrics.record(
+        'maintenance',
+        reclaimed_files=report["reclaimed"]["files"],
+        reclaimed_bytes=report["reclaimed"]["bytes"],
+        compacted_files=report["reclaimed"]["compacted_files"],
+        staging_tables=len(staging)
+    )
+    return report
+
+
+def maintenance_handler(event, context):
+    """
+    Lambda entry point for scheduled maintenance, e.g. a daily EventBridge rule.
+    The event may set "dry_run" and "tables".
+    """
+    event = event or {}
+    dry_run = bool(event.get("dry_run", False))
+    metrics.start(request_id=getattr(context, 'aws_request_id', None), dry_run=dry_run)
+    try:
+        report = run_maintenance(config.glue_catalog, config.database_name, event.get("tables"), dry_run)
+        return {'statusCode': 200, 'body': report}
+    finally:
+        metrics.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact, expire snapshots and remove orphaned and staging files")
+    parser.add_argument("--dry-run", action="store_true", help="only report the files and bytes that would be reclaimed")
+    parser.add_argument("--table", action="append", dest="tables", help="table to maintain, repeatable")
+    parser.add_argument("--write-mode", choices=["athena", "direct"], default=config.write_mode)
+    args = parser.parse_args()
+    result = run_maintenance(config.glue_catalog, config.database_name, args.tables, args.dry_run, args.write_mode)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if any("error" in table for table in result["tables"].values()) else 0)
@@ -0,0 +1,177 @@
+import json
+import time
+import resource
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Iterator, Callable, Tuple
+import src.config as config
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+# CloudWatch keeps at most 100 values per metric of an embedded metric format record
+MAX_VALUES = 100
+
+
+def unit(name: str) -> str:
+    """
+    Returns the CloudWatch unit of a measurement from its suffix.
+    """
+    measurement = name.rsplit('.', 1)[-1]
+    if measurement.endswith('_ms'):
+        return 'Milliseconds'
+    if measurement.endswith('_bytes') or measurement.startswith('bytes_'):
+        return 'Bytes'
+    return 'Count'
+
+
+class Metrics:
+    """
+    Measurements of one invocation, keyed by stage and measurement name.
+    Every stage run appends its values, so a batch of files gives one value per file and
+    CloudWatch can compute percentiles over them.
+    """
+
+    def __init__(self, namespace: str = config.metrics_namespace, dimensions: Optional[Dict[str, str]] = None):
+        self.namespace = namespace
+        self.dimensions = dimensions or {"service": config.metrics_service}
+        self.properties = {}
+        self.stages: Dict[str, Dict[str, List[float]]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, **values: Optional[float]) -> None:
+        """
+        Adds measurements of a stage. None values are ignored.
+        """
+        with self.lock:
+            measurements = self.stages.setdefault(stage, {})
+            for name, value in values.items():
+                if value is not None:
+                    measurements.setdefault(name, []).append(value)
+
+    def merge(self, stages: Dict[str, Dict[str, List[float]]]) -> None:
+        """
+        Adds the measurements taken by another Metrics, e.g. in a worker process.
+        """
+        with self.lock:
+            for stage, values in stages.items():
+                measurements = self.stages.setdefault(stage, {})
+                for name, value in values.items():
+                    measurements.setdefault(name, []).extend(value)
+
+    def to_emf(self) -> Dict[str, Any]:
+        """
+        Builds a CloudWatch embedded metric format record, with metrics named '<stage>.<measurement>'.
+        """
+        with self.lock:
+            values = {
+                f"{stage}.{name}": measurements[:MAX_VALUES]
+                for stage, stage_values in self.stages.items()
+                for name, measurements in stage_values.items()
+            }
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [list(self.dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit(name)} for name in values]
+                }]
+            },
+            **self.dimensions,
+            **self.properties,
+            **values
+        }
+
+    def emit(self) -> Dict[str, Any]:
+        """
+        Writes the record as one JSON line on stdout, where Lambda picks it up for CloudWatch.
+        Returns the record.
+        """
+        record = self.to_emf()
+        print(json.dumps(record, default=str), flush=True)
+        return record
+
+
+_active: Optional[Metrics] = None
+
+
+def start(**properties: Any) -> Metrics:
+    """
+    Starts collecting the measurements of an invocation. properties are added to the record as is.
+    """
+    global _active
+    _active = Metrics()
+    _active.properties.update(properties)
+    return _active
+
+
+def current() -> Optional[Metrics]:
+    return _active
+
+
+def finish() -> Optional[Dict[str, Any]]:
+    """
+    Emits the record of the current invocation and stops collecting.
+    Returns the record, or None if nothing was collected or metrics are disabled.
+    """
+    global _active
+    metrics, _active = _active, None
+    if metrics is None or not config.metrics:
+        return None
+    return metrics.emit()
+
+
+def record(stage: str, **values: Optional[float]) -> None:
+    """
+    Adds measurements of a stage to the current invocation, if one is being collected.
+    """
+    metrics = _active
+    if metrics is not None:
+        metrics.record(stage, **values)
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Dict[str, Any]]:
+    """
+    Measures wall time, CPU time of the calling thread and growth of the process peak memory of a block.
+    The yielded dict takes further measurements of the stage, e.g. rows_in, rows_out or bytes_read.
+    """
+    values = {}
+    peak_rss = _peak_rss_bytes()
+    cpu_started = time.thread_time()
+    started = time.perf_counter()
+    try:
+        yield values
+    finally:
+        values["wall_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        values["cpu_ms"] = round((time.thread_time() - cpu_started) * 1000, 3)
+        values["peak_memory_delta_bytes"] = _peak_rss_bytes() - peak_rss
+        logger.debug("Stage %s: %s", name, values)
+        record(name, **values)
+
+
+def call_with_metrics(func: Callable, *args: Any) -> Tuple[Any, Dict[str, Dict[str, List[float]]]]:
+    """
+    Calls func collecting its stage measurements on their own, for work submitted to a process pool.
+    Returns what func returned and the measurements, to be merged into the invocation (see Metrics.merge).
+    """
+    global _active
+    metrics = _active = Metrics()
+    try:
+        return func(*args), metrics.stages
+    finally:
+        _active = None
@@ -0,0 +1,257 @@
+import io
+import time
+import datetime
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+import pyarrow as pa
+from pyiceberg.expressions import (
+    AlwaysTrue,
+    And,
+    BooleanExpression,
+    EqualTo,
+    GreaterThanOrEqual,
+    In,
+    LessThan
+)
+from pyiceberg.io import FileIO, InputFile, InputStream, OutputFile
+from pyiceberg.io.pyarrow import ArrowScan
+from pyiceberg.table import DataScan, FileScanTask
+import src.config as config
+import src.metrics as metrics
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+# manifest lists and manifests are the only avro files of an iceberg table
+MANIFEST_SUFFIX = '.avro'
+# planned scans kept per query instance, keyed by table metadata file and filter
+MAX_PLANS = 256
+
+
+def build_filter(
+    event_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    drivernumber: Optional[int | Iterable[int]] = None,
+    ts_from: Optional[datetime.datetime | str] = None,
+    ts_to: Optional[datetime.datetime | str] = None
+) -> BooleanExpression:
+    """
+    Builds the row filter of a fact table query. event_id prunes partitions, the others prune files by min/max stats.
+    drivernumber takes one driver or several, the ts range includes ts_from and excludes ts_to.
+    """
+    predicates = []
+    if event_id is not None:
+        predicates.append(EqualTo('event_id', event_id))
+    if session_id is not None:
+        predicates.append(EqualTo('session_id', session_id))
+    if isinstance(drivernumber, int):
+        predicates.append(EqualTo('drivernumber', drivernumber))
+    elif drivernumber is not None:
+        predicates.append(In('drivernumber', set(drivernumber)))
+    if ts_from is not None:
+        predicates.append(GreaterThanOrEqual('ts', ts_from))
+    if ts_to is not None:
+        predicates.append(LessThan('ts', ts_to))
+    if not predicates:
+        return AlwaysTrue()
+    return predicates[0] if len(predicates) == 1 else And(*predicates)
+
+
+class MemoryInputFile(InputFile):
+    """
+    InputFile over bytes already in memory.
+    """
+
+    def __init__(self, location: str, data: bytes):
+        super().__init__(location)
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def exists(self) -> bool:
+        return True
+
+    def open(self, seekable: bool = True) -> InputStream:
+        return io.BytesIO(self.data)
+
+
+class ManifestCacheIO(FileIO):
+    """
+    FileIO that keeps manifest lists and manifests in memory, least recently used first out past max_bytes.
+    Iceberg never rewrites these files in place, so cached bytes stay valid for as long as they are kept.
+    Every other file is read through the wrapped FileIO.
+    """
+
+    def __init__(self, file_io: FileIO, max_bytes: int = config.query_manifest_cache_bytes):
+        super().__init__(file_io.properties)
+        self.file_io = file_io
+        self.max_bytes = max_bytes
+        self.files: OrderedDict[str, bytes] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def new_input(self, location: str) -> InputFile:
+        if not location.endswith(MANIFEST_SUFFIX):
+            return self.file_io.new_input(location)
+        with self.lock:
+            data = self.files.get(location)
+            if data is not None:
+                self.files.move_to_end(location)
+                self.hits += 1
+                return MemoryInputFile(location, data)
+            self.misses += 1
+        with self.file_io.new_input(location).open() as stream:
+            data = stream.read()
+        with self.lock:
+            if location not in self.files and len(data) <= self.max_bytes:
+                self.files[location] = data
+                self.size += len(data)
+                while self.size > self.max_bytes:
+                    _, evicted = self.files.popitem(last=False)
+                    self.size -= len(evicted)
+        return MemoryInputFile(location, data)
+
+    def new_output(self, location: str) -> OutputFile:
+        return self.file_io.new_output(location)
+
+    def delete(self, location: str | InputFile | OutputFile) -> None:
+        self.file_io.delete(location)
+
+
+class TelemetryQuery:
+    """
+    Reads slices of the fact table in-process with pyiceberg, for lookups too small to be worth an Athena query.
+    Scans are planned with partition and min/max pruning, and only the matching files are read.
+    The table metadata is reused for metadata_ttl seconds, manifests and planned scans are cached
+    until the table changes, so repeated lookups skip the catalog and S3 round trips of planning.
+    """
+
+    def __init__(
+        self,
+        catalog_name: object,
+        database_name: str,
+        table_name: str,
+        metadata_ttl: float = config.query_metadata_ttl,
+        manifest_cache_bytes: int = config.query_manifest_cache_bytes
+    ):
+        self.catalog_name = catalog_name
+        self.database_name = database_name
+        self.table_name = table_name
+        self.metadata_ttl = metadata_ttl
+        self.manifest_cache_bytes = manifest_cache_bytes
+        self.manifest_io: Optional[ManifestCacheIO] = None
+        self.plans: OrderedDict[Tuple[str, str], List[FileScanTask]] = OrderedDict()
+        self.lock = threading.Lock()
+        self._table = None
+        self._loaded_at = 0.0
+
+    def table(self) -> object:
+        """
+        Returns the table, loading it from the catalog when the cached metadata is older than metadata_ttl.
+        """
+        with self.lock:
+            if self._table is None or time.monotonic() - self._loaded_at >= self.metadata_ttl:
+                self._table = self.catalog_name.load_table((self.database_name, self.table_name))
+                self._loaded_at = time.monotonic()
+                # Each load brings a new FileIO, the cached manifests are kept and only the wrapped io is swapped
+                if self.manifest_io is None:
+                    self.manifest_io = ManifestCacheIO(self._table.io, self.manifest_cache_bytes)
+                else:
+                    self.manifest_io.file_io = self._table.io
+            return self._table
+
+    def invalidate(self) -> None:
+        """
+        Drops the cached table metadata, e.g. right after a write, so the next query sees it.
+        Manifests stay cached, they are still valid.
+        """
+        with self.lock:
+            self._table = None
+
+    def plan(self, row_filter: BooleanExpression) -> Tuple[object, List[FileScanTask]]:
+        """
+        Returns the table and the files of its current snapshot that may hold rows matching row_filter.
+        """
+        table = self.table()
+        key = (table.metadata_location, repr(row_filter))
+        with self.lock:
+            tasks = self.plans.get(key)
+            if tasks is not None:
+                self.plans.move_to_end(key)
+                return table, tasks
+        with metrics.stage('query_plan') as stage:
+            scan = DataScan(table_metadata=table.metadata, io=self.manifest_io, row_filter=row_filter)
+            tasks = list(scan.plan_files())
+            stage["files"] = len(tasks)
+        with self.lock:
+            self.plans[key] = tasks
+            while len(self.plans) > MAX_PLANS:
+                self.plans.popitem(last=False)
+        return table, tasks
+
+    def batches(
+        self,
+        event_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        drivernumber: Optional[int | Iterable[int]] = None,
+        ts_from: Optional[datetime.datetime | str] = None,
+        ts_to: Optional[datetime.datetime | str] = None,
+        columns: Optional[List[str]] = None,
+        limit: Optional[int] = None
+    ) -> pa.RecordBatchReader:
+        """
+        Streams the matching rows as arrow record batches, reading the planned files one after another.
+        columns selects the returned columns, all by default.
+        """
+        row_filter = build_filter(event_id, session_id, drivernumber, ts_from, ts_to)
+        table, tasks = self.plan(row_filter)
+        projection = table.schema().select(*columns) if columns else table.schema()
+        arrow_scan = ArrowScan(table.metadata, table.io, projection, row_filter, True, limit)
+        logger.debug("Reading %s files of %s for %s", len(tasks), self.table_name, row_filter)
+        return pa.RecordBatchReader.from_batches(projection.as_arrow(), arrow_scan.to_record_batches(tasks))
+
+    def to_arrow(self, **filters: Any) -> pa.Table:
+        """
+        Reads the matching rows into one arrow table, see batches for the filters.
+        """
+        return self.batches(**filters).read_all()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the cached plans and the manifest cache usage.
+        """
+        manifest_io = self.manifest_io
+        return {
+            "plans": len(self.plans),
+            "manifest_bytes": manifest_io.size if manifest_io else 0,
+            "manifest_hits": manifest_io.hits if manifest_io else 0,
+            "manifest_misses": manifest_io.misses if manifest_io else 0
+        }
+
+
+_default: Optional[TelemetryQuery] = None
+_default_lock = threading.Lock()
+
+
+def read_telemetry(**filters: Any) -> pa.RecordBatchReader:
+    """
+    Streams rows of the configured fact table, see TelemetryQuery.batches for the filters.
+    The query and its caches are created on first use and shared by later calls, like the AWS clients.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = TelemetryQuery(config.glue_catalog, config.database_name, config.fact_table)
+    return _default.batches(**filters)
@@ -0,0 +1,160 @@
+import re
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Iterator, Iterable, Optional
+from botocore.exceptions import ClientError
+import src.config as config
+import src.metrics as metrics
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+CONTENT_RANGE_PATTERN = re.compile(r"bytes \d+-\d+/(\d+)")
+
+
+def get_range(
+    s3: object, bucket_name: str, key_value: str, start: int, end: int, etag: Optional[str] = None
+) -> Tuple[bytes, int, Optional[str]]:
+    """
+    Downloads bytes start to end (inclusive) of an object.
+    With etag the GET is conditional (IfMatch), S3 fails it with PreconditionFailed when the object was
+    replaced since, so the ranges of one download always come from the same object version.
+    Returns the bytes, the size of the whole object and its ETag. A client that ignores the range
+    (no ContentRange in the response) returned the whole object.
+    """
+    request = {"Bucket": bucket_name, "Key": key_value, "Range": f"bytes={start}-{end}"}
+    if etag is not None:
+        request["IfMatch"] = etag
+    try:
+        obj = s3.get_object(**request)
+    except ClientError as ex:
+        # Ranges of an empty object cannot be satisfied
+        if ex.response['Error']['Code'] == 'InvalidRange' and start == 0:
+            return b"", 0, None
+        raise
+    body = obj['Body'].read()
+    metrics.record('s3_get', bytes_read=len(body))
+    match = CONTENT_RANGE_PATTERN.match(obj.get('ContentRange') or "")
+    return body, int(match.group(1)) if match else len(body), obj.get('ETag')
+
+
+def iter_sized_parts(
+    s3: object,
+    bucket_name: str,
+    key_value: str,
+    part_size: int = config.range_part_size,
+    concurrency: int = config.range_concurrency
+) -> Iterator[Tuple[bytes, int]]:
+    """
+    Yields an object in order as parts of part_size bytes, each with the size of the whole object.
+    The first part tells the object size and ETag. Objects up to part_size bytes take this single GET,
+    larger ones are fetched with up to concurrency ranged GETs in flight, each conditional on the ETag,
+    so the caller can work on a part while the next ones download. At most concurrency parts are held
+    ahead of the caller.
+    """
+    first, size, etag = get_range(s3, bucket_name, key_value, 0, part_size - 1)
+    yield first, size
+    if len(first) >= size:
+        return
+    starts = iter(range(len(first), size, part_size))
+    logger.info("Downloading %s (%s bytes) in parts of %s bytes, %s at a time", key_value, size, part_size, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+
+        def submit() -> None:
+            start = next(starts, None)
+            if start is not None:
+                end = min(start + part_size, size) - 1
+                pending.append(executor.submit(get_range, s3, bucket_name, key_value, start, end, etag))
+
+        for _ in range(concurrency):
+            submit()
+        try:
+            while pending:
+                body, _, _ = pending.popleft().result()
+                submit()
+                yield body, size
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def iter_parts(
+    s3: object,
+    bucket_name: str,
+    key_value: str,
+    part_size: int = config.range_part_size,
+    concurrency: int = config.range_concurrency
+) -> Iterator[bytes]:
+    """
+    Yields an object in order as parts of part_size bytes (see iter_sized_parts).
+    """
+    for part, _ in iter_sized_parts(s3, bucket_name, key_value, part_size, concurrency):
+        yield part
+
+
+def download(
+    s3: object,
+    bucket_name: str,
+    key_value: str,
+    part_size: int = config.range_part_size,
+    concurrency: int = config.range_concurrency
+) -> bytes | bytearray:
+    """
+    Downloads a whole object with concurrent ranged GETs (see iter_sized_parts).
+    Parts are copied into a buffer of the object size as they arrive, instead of joining them at the end,
+    so the object is held about once rather than twice. A single part is returned as is.
+    """
+    data, offset = None, 0
+    for part, size in iter_sized_parts(s3, bucket_name, key_value, part_size, concurrency):
+        if data is None:
+            if len(part) >= size:
+                return part
+            data = bytearray(size)
+        data[offset:offset + len(part)] = part
+        offset += len(part)
+    return data
+
+
+def iter_lines(parts: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Realigns parts on newlines, so each yielded chunk only holds whole lines.
+    The bytes after the last newline of a part are carried over to the next one.
+    Telemetry files have no quoted values, so every newline ends a row.
+    """
+    rest = b""
+    for part in parts:
+        data = rest + part if rest else part
+        end = data.rfind(b"\n") + 1
+        if end:
+            rest = data[end:]
+            yield data[:end]
+        else:
+            rest = data
+    if rest:
+        yield rest
+
+
+def header_and_chunks(parts: Iterable[bytes]) -> Tuple[bytes, Iterator[bytes]]:
+    """
+    Splits the CSV header line off newline aligned chunks of parts.
+    Returns the header and the chunks, the first chunk starting with the first row.
+    """
+    chunks = iter_lines(parts)
+    first = next(chunks, b"")
+    end = first.find(b"\n") + 1 or len(first)
+
+    def rows() -> Iterator[bytes]:
+        if first[end:]:
+            yield first[end:]
+        yield from chunks
+
+    return first[:end], rows()
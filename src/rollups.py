@@ -0,0 +1,207 @@
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyiceberg.exceptions import CommitFailedException
+from pyiceberg.expressions import And, EqualTo
+from pyiceberg.schema import Schema
+from pyiceberg.table.sorting import SortOrder
+from typing import Dict, List, Tuple, Any
+import src.config as config
+import src.layout as layout
+from src.etl import get_race_id
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+METADATA_COLUMNS = ['event_id', 'event_year', 'event_code', 'event_num', 'session_id']
+# drs values of 10 and above mean the flap is open
+DRS_OPEN_MIN = 10
+# a sample counts for the time until the next sample of the driver, unless the gap is longer than this
+MAX_SAMPLE_GAP_MS = 1000
+THROTTLE_BUCKETS = [(0, 25), (25, 50), (50, 75), (75, None)]
+
+
+def sample_seconds(data: pa.Table) -> np.ndarray:
+    """
+    Returns the seconds each sample lasts, up to the next sample of the same driver.
+    Rows must be sorted by drivernumber and ts. Last samples and gaps over MAX_SAMPLE_GAP_MS count as 0.
+    """
+    ts = data.column('ts').cast(pa.timestamp('ms')).cast(pa.int64()).to_numpy()
+    drivers = data.column('drivernumber').to_numpy()
+    gaps = np.zeros(len(ts), dtype=np.float64)
+    if len(ts) > 1:
+        gaps[:-1] = np.diff(ts)
+        gaps[:-1][drivers[:-1] != drivers[1:]] = 0
+    gaps[gaps > MAX_SAMPLE_GAP_MS] = 0
+    return gaps / 1000
+
+
+def driver_session_stats(data: pa.Table) -> pa.Table:
+    """
+    Aggregates fact rows of one event and session per driver: sample count, time range,
+    max/avg speed and rpm, average throttle, time spent in each throttle bucket, braking and with DRS open.
+    Returns arrow table with the driver_session_schema columns.
+    """
+    data = data.sort_by([('drivernumber', 'ascending'), ('ts', 'ascending')])
+    seconds = pa.array(sample_seconds(data))
+    zero = pa.scalar(0.0)
+    throttle = data.column('throttle')
+    timed = {}
+    for low, high in THROTTLE_BUCKETS:
+        in_bucket = pc.greater_equal(throttle, low)
+        if high is not None:
+            in_bucket = pc.and_(in_bucket, pc.less(throttle, high))
+        timed[f"throttle_{low}_{high or 100}_s"] = pc.if_else(in_bucket, seconds, zero)
+    timed["brake_s"] = pc.if_else(data.column('breaks'), seconds, zero)
+    timed["drs_open_s"] = pc.if_else(pc.greater_equal(data.column('drs'), DRS_OPEN_MIN), seconds, zero)
+    for name, values in timed.items():
+        data = data.append_column(name, values)
+    stats = data.group_by('drivernumber').aggregate([
+        ('ts', 'count'), ('ts', 'min'), ('ts', 'max'),
+        ('speed', 'max'), ('speed', 'mean'), ('rpm', 'max'), ('rpm', 'mean'), ('throttle', 'mean'),
+        *[(name, 'sum') for name in timed]
+    ])
+    rows = stats.num_rows
+    return pa.table({
+        **{column: pa.repeat(data.column(column)[0], rows) for column in METADATA_COLUMNS},
+        'drivernumber': stats.column('drivernumber'),
+        'samples': stats.column('ts_count'),
+        'first_ts': stats.column('ts_min'),
+        'last_ts': stats.column('ts_max'),
+        'max_speed': stats.column('speed_max'),
+        'avg_speed': stats.column('speed_mean'),
+        'max_rpm': stats.column('rpm_max'),
+        'avg_rpm': stats.column('rpm_mean'),
+        'avg_throttle': stats.column('throttle_mean'),
+        **{name: stats.column(f"{name}_sum") for name in timed}
+    })
+
+
+def downsample_1hz(data: pa.Table) -> pa.Table:
+    """
+    Downsamples fact rows of one event and session to one row per driver and second:
+    average rpm, speed and throttle, top speed and gear, whether the driver braked and the highest drs value.
+    Returns arrow table with the telemetry_1hz_schema columns.
+    """
+    data = data.append_column('second', pc.floor_temporal(data.column('ts'), unit='second'))
+    grouped = data.group_by(['drivernumber', 'second']).aggregate([
+        ('ts', 'count'), ('rpm', 'mean'), ('speed', 'mean'), ('speed', 'max'), ('gear', 'max'),
+        ('throttle', 'mean'), ('breaks', 'any'), ('drs', 'max')
+    ])
+    rows = grouped.num_rows
+    return pa.table({
+        **{column: pa.repeat(data.column(column)[0], rows) for column in METADATA_COLUMNS},
+        'ts': grouped.column('second'),
+        'drivernumber': grouped.column('drivernumber'),
+        'samples': grouped.column('ts_count').cast(pa.int32()),
+        'avg_rpm': grouped.column('rpm_mean'),
+        'avg_speed': grouped.column('speed_mean'),
+        'max_speed': grouped.column('speed_max'),
+        'max_gear': grouped.column('gear_max'),
+        'avg_throttle': grouped.column('throttle_mean'),
+        'breaks': grouped.column('breaks_any'),
+        'max_drs': grouped.column('drs_max')
+    })
+
+
+def load_rollup_table(
+    catalog_name: object,
+    database_name: str,
+    table_name: str,
+    table_location: str,
+    schema: Schema,
+    sort_order: SortOrder
+) -> object:
+    """
+    Loads a rollup table, creating it partitioned by event_id if it does not exist yet.
+    """
+    identifier = (database_name, table_name)
+    if catalog_name.table_exists(identifier):
+        return catalog_name.load_table(identifier)
+    logger.info('Creating rollup table: %s', identifier)
+    return catalog_name.create_table(
+        identifier=identifier,
+        schema=schema,
+        partition_spec=config.rollup_partition_spec,
+        sort_order=sort_order,
+        location=f"{table_location}/{table_name}",
+        properties=layout.write_properties()
+    )
+
+
+def replace_session(table: object, rows: pa.Table, event_id: str, session_id: str, schema: Schema, sort_order: SortOrder, retries: int) -> None:
+    """
+    Overwrites the rows of one event and session, retrying when another writer committed first.
+    """
+    row_filter = And(EqualTo('event_id', event_id), EqualTo('session_id', session_id))
+    rows = layout.sort_rows(rows.cast(schema.as_arrow()), sort_order, schema)
+    for attempt in range(retries + 1):
+        try:
+            table.overwrite(rows, overwrite_filter=row_filter)
+            return
+        except CommitFailedException as e:
+            if attempt == retries:
+                raise
+            logger.warning("Commit conflict on %s, retrying: %s", table.name(), e)
+            table = table.refresh()
+
+
+def refresh_rollups(
+    catalog_name: object,
+    database_name: str,
+    fact_table: str,
+    table_location: str,
+    event_id: str,
+    session_id: str,
+    retries: int = config.commit_retries
+) -> Dict[str, Any]:
+    """
+    Recomputes both rollup tables for one event and session from the fact table.
+    Only that session is read (the event_id partition) and only its rollup rows are replaced,
+    so rows merged by earlier files of the session are included.
+    Returns number of rows written to each rollup table.
+    """
+    try:
+        fact = catalog_name.load_table((database_name, fact_table))
+        data = fact.scan(
+            row_filter=And(EqualTo('event_id', event_id), EqualTo('session_id', session_id)),
+            selected_fields=tuple(METADATA_COLUMNS) + ('ts', 'drivernumber', 'rpm', 'speed', 'gear', 'throttle', 'breaks', 'drs')
+        ).to_arrow()
+        if not data.num_rows:
+            logger.warning("No rows of %s %s in %s, rollups not refreshed", event_id, session_id, fact_table)
+            return {}
+        written = {}
+        for table_name, schema, sort_order, rollup in [
+            (config.driver_session_table, config.driver_session_schema, config.driver_session_sort_order, driver_session_stats),
+            (config.telemetry_1hz_table, config.telemetry_1hz_schema, config.telemetry_1hz_sort_order, downsample_1hz)
+        ]:
+            rows = rollup(data)
+            table = load_rollup_table(catalog_name, database_name, table_name, table_location, schema, sort_order)
+            replace_session(table, rows, event_id, session_id, schema, sort_order, retries)
+            written[table_name] = rows.num_rows
+        logger.info("Refreshed rollups of %s %s from %s rows: %s", event_id, session_id, data.num_rows, written)
+        return written
+    except Exception as e:
+        logger.error("Error refreshing rollups of %s %s: %s", event_id, session_id, e)
+        raise
+
+
+def sessions(keys: List[str]) -> List[Tuple[str, str]]:
+    """
+    Returns the distinct (event_id, session_id) pairs of file keys, in order.
+    """
+    pairs = []
+    for key in keys:
+        race_id = get_race_id(key)
+        pair = (race_id['event_id'], race_id['session_id'])
+        if pair not in pairs:
+            pairs.append(pair)
+    return pairs
@@ -0,0 +1,28 @@
+CREATE TABLE driver_session_stats (
+    event_id STRING,
+    event_year STRING,
+    event_code STRING,
+    event_num STRING,
+    session_id STRING,
+    drivernumber INT,
+    samples BIGINT,
+    first_ts TIMESTAMP,
+    last_ts TIMESTAMP,
+    max_speed INT,
+    avg_speed DOUBLE,
+    max_rpm INT,
+    avg_rpm DOUBLE,
+    avg_throttle DOUBLE,
+    throttle_0_25_s DOUBLE,
+    throttle_25_50_s DOUBLE,
+    throttle_50_75_s DOUBLE,
+    throttle_75_100_s DOUBLE,
+    brake_s DOUBLE,
+    drs_open_s DOUBLE)
+PARTITIONED BY (event_id) 
+LOCATION 's3://telem-data/iceberg_tbl/driver_session_stats'
+TBLPROPERTIES (
+  'table_type'='ICEBERG',
+  'format'='parquet',
+  'write_compression'='snappy'
+)
@@ -19,5 +19,6 @@ TBLPROPERTIES (
   'table_type'='ICEBERG',
   'format'='parquet',
   'write_compression'='snappy',
-  'optimize_rewrite_delete_file_threshold'='10'
+  'optimize_rewrite_delete_file_threshold'='10',
+  'write_target_data_file_size_bytes'='134217728'
 )
\ No newline at end of file
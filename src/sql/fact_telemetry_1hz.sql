@@ -0,0 +1,23 @@
+CREATE TABLE fact_telemetry_1hz (
+    event_id STRING,
+    event_year STRING,
+    event_code STRING,
+    event_num STRING,
+    session_id STRING,
+    ts TIMESTAMP,
+    drivernumber INT,
+    samples INT,
+    avg_rpm DOUBLE,
+    avg_speed DOUBLE,
+    max_speed INT,
+    max_gear INT,
+    avg_throttle DOUBLE,
+    breaks BOOLEAN,
+    max_drs INT)
+PARTITIONED BY (event_id) 
+LOCATION 's3://telem-data/iceberg_tbl/fact_telemetry_1hz'
+TBLPROPERTIES (
+  'table_type'='ICEBERG',
+  'format'='parquet',
+  'write_compression'='snappy'
+)
@@ -0,0 +1,2 @@
+OPTIMIZE {database}.{table} REWRITE DATA USING BIN_PACK
+WHERE event_id = '{event_id}'
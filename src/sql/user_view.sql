@@ -10,4 +10,18 @@ CREATE VIEW aa_telemtry_view AS(
           event_id, event_year, event_code, event_num, session_id, ts, rpm, speed, gear, throttle, breaks, drs
      FROM fact_telemetry
      WHERE drivernumber = 23
-);
\ No newline at end of file
+);
+
+CREATE VIEW cs_telemtry_1hz_view AS(
+     SELECT 
+          event_id, event_year, event_code, event_num, session_id, ts, avg_rpm, avg_speed, max_speed, max_gear, avg_throttle, breaks, max_drs
+     FROM fact_telemetry_1hz
+     WHERE drivernumber = 55
+);
+
+CREATE VIEW aa_telemtry_1hz_view AS(
+     SELECT 
+          event_id, event_year, event_code, event_num, session_id, ts, avg_rpm, avg_speed, max_speed, max_gear, avg_throttle, breaks, max_drs
+     FROM fact_telemetry_1hz
+     WHERE drivernumber = 23
+);
@@ -0,0 +1,192 @@
+import hashlib
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyiceberg.exceptions import CommitFailedException
+from pyiceberg.expressions import And, EqualTo, In
+from typing import Dict, Any
+import src.config as config
+import src.key_index as key_index
+import src.layout as layout
+import src.metrics as metrics
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+handler.setFormatter(formatter)
+if not logger.hasHandlers():
+    logger.addHandler(handler)
+
+
+def md5_hex(values: pa.Array) -> pa.Array:
+    """
+    Returns the lower hex MD5 of each value of a string array.
+    Arrow has no MD5 kernel, so each value is hashed with hashlib straight from the arrow value buffer,
+    without python strings, and the digests are hex encoded in one call into the buffer of the result.
+    """
+    values = values.cast(pa.large_string())
+    if not len(values):
+        return pa.array([], pa.string())
+    offsets = np.frombuffer(values.buffers()[1], np.int64)[values.offset:values.offset + len(values) + 1].tolist()
+    data = memoryview(values.buffers()[2] or b"")
+    md5 = hashlib.md5
+    digests = b"".join([md5(data[start:end]).digest() for start, end in zip(offsets[:-1], offsets[1:])])
+    return pa.StringArray.from_buffers(
+        len(values),
+        pa.py_buffer(np.arange(0, 32 * len(values) + 1, 32, dtype=np.int32)),
+        pa.py_buffer(digests.hex().encode())
+    )
+
+
+def primary_keys(data: pa.Table) -> pa.Array:
+    """
+    Computes pk_id the same way src/sql/merge_fact_table.sql does:
+    lower hex MD5 of event_id, session_id, drivernumber and timeutc cast to varchar.
+    Athena reads iceberg timestamps as timestamp(6), so timeutc is formatted with microseconds,
+    which the string cast of a naive timestamp[us] does (strftime is about 20 times slower).
+    MD5 is the main cost of to_fact_rows, about 1 s per million rows (see the primary_keys benchmark stage).
+    """
+    ts = data.column('timeUtc').cast(pa.timestamp('us')).cast(pa.string())
+    # rows read back from iceberg hold large_string columns, the join needs one string type
+    keys = pc.binary_join_element_wise(
+        data.column('event_id').cast(pa.large_string()),
+        data.column('session_id').cast(pa.large_string()),
+        data.column('driverNumber').cast(pa.large_string()),
+        ts.cast(pa.large_string()),
+        pa.scalar('', pa.large_string())
+    )
+    return md5_hex(keys.combine_chunks() if isinstance(keys, pa.ChunkedArray) else keys)
+
+
+def to_fact_rows(data: pa.Table) -> pa.Table:
+    """
+    Applies the casts and renames of src/sql/merge_fact_table.sql to staged rows
+    (brake to breaks as boolean, timeUtc to ts, lower case int columns) and adds pk_id.
+    Returns arrow table with the fact table columns.
+    """
+    data = layout.write_types(data)
+    return pa.table({
+        'pk_id': primary_keys(data),
+        'event_id': data.column('event_id'),
+        'event_year': data.column('event_year'),
+        'event_code': data.column('event_code'),
+        'event_num': data.column('event_num'),
+        'session_id': data.column('session_id'),
+        'ts': data.column('timeUtc').cast(pa.timestamp('us')),
+        'drivernumber': data.column('driverNumber').cast(pa.int32()),
+        'rpm': data.column('rpm').cast(pa.int32()),
+        'speed': data.column('speed').cast(pa.int32()),
+        'gear': data.column('gear').cast(pa.int32()),
+        'throttle': data.column('throttle').cast(pa.int32()),
+        'breaks': data.column('brake').cast(pa.bool_()),
+        'drs': data.column('drs').cast(pa.int32())
+    }).select(config.fact_cols)
+
+
+def load_fact_table(catalog_name: object, database_name: str, dst_table: str, table_location: str) -> object:
+    """
+    Loads the fact table, creating it with the fact_telemetry.sql layout if it does not exist yet.
+    An existing table is used as is, table maintenance brings it to the configured layout (see src.maintenance).
+    """
+    identifier = (database_name, dst_table)
+    if catalog_name.table_exists(identifier):
+        return catalog_name.load_table(identifier)
+    logger.info('Creating fact table: %s', identifier)
+    return catalog_name.create_table(
+        identifier=identifier,
+        schema=config.fact_schema,
+        partition_spec=config.fact_partition_spec,
+        sort_order=config.fact_sort_order,
+        location=f"{table_location}/{dst_table}",
+        properties=layout.write_properties()
+    )
+
+
+def append_if_disjoint(table: object, rows: pa.Table, retries: int = config.commit_retries) -> bool:
+    """
+    Appends fact table rows when the key index (see src.key_index) shows that none of their keys can be
+    in the table yet. The append commits against the probed snapshot, so when another writer, pyiceberg
+    or an Athena MERGE, commits first it fails and the table is probed again.
+    Returns whether the rows were appended, False when they may overlap and must be merged.
+    """
+    ranges = key_index.ranges_from_rows(rows)
+    for attempt in range(retries + 1):
+        if key_index.may_overlap(table, ranges):
+            metrics.record('key_index', appended=0, merged=1)
+            return False
+        try:
+            table.append(layout.sort_rows(rows, config.fact_sort_order, config.fact_schema))
+            metrics.record('key_index', appended=1, merged=0)
+            return True
+        except CommitFailedException as e:
+            if attempt == retries:
+                raise
+            logger.warning("Commit conflict appending to %s, probing again: %s", table.name(), e)
+            table = table.refresh()
+    return False
+
+
+def upsert_to_fact_table(
+    data: pa.Table,
+    catalog_name: object,
+    database_name: str,
+    dst_table: str,
+    table_location: str,
+    retries: int = config.commit_retries
+) -> Dict[str, Any]:
+    """
+    Upserts staged rows of one event straight into the fact table with pyiceberg,
+    without a staging table or an Athena MERGE.
+    Existing rows of the sessions in the data are read from the event_id partition only, rows whose pk_id is
+    in the new data are replaced and the sessions are overwritten in a single commit.
+    When the key index (see src.key_index) shows that none of the keys can be in the table yet,
+    the rows are appended without reading the partition. The append commits against the probed snapshot,
+    so a writer committing in between fails it and the retry probes again.
+    The commit is retried when another writer committed first.
+    Returns number of rows inserted and updated.
+    """
+    try:
+        rows = to_fact_rows(data)
+        event_ids = pc.unique(rows.column('event_id')).to_pylist()
+        if len(event_ids) != 1:
+            raise ValueError(f"Rows of one event expected, got: {event_ids}")
+        session_ids = pc.unique(rows.column('session_id')).to_pylist()
+        session_filter = EqualTo('session_id', session_ids[0]) if len(session_ids) == 1 else In('session_id', session_ids)
+        row_filter = And(EqualTo('event_id', event_ids[0]), session_filter)
+        table = load_fact_table(catalog_name, database_name, dst_table, table_location)
+        ranges = key_index.ranges_from_rows(rows) if config.key_index else None
+        for attempt in range(retries + 1):
+            try:
+                # Probed again on retry, the other writer may have added the same keys
+                if ranges is not None and not key_index.may_overlap(table, ranges):
+                    updated = 0
+                    table.append(layout.sort_rows(rows, config.fact_sort_order, config.fact_schema))
+                    metrics.record('key_index', appended=1, merged=0)
+                    break
+                existing = table.scan(row_filter=row_filter).to_arrow()
+                matched = pc.is_in(existing.column('pk_id'), value_set=rows.column('pk_id'))
+                kept = existing.filter(pc.invert(matched))
+                updated = existing.num_rows - kept.num_rows
+                merged = layout.sort_rows(
+                    pa.concat_tables([kept.cast(rows.schema), rows]), config.fact_sort_order, config.fact_schema
+                )
+                table.overwrite(merged, overwrite_filter=row_filter)
+                if ranges is not None:
+                    metrics.record('key_index', appended=0, merged=1)
+                break
+            except CommitFailedException as e:
+                if attempt == retries:
+                    raise
+                logger.warning("Commit conflict on %s, retrying: %s", dst_table, e)
+                table = table.refresh()
+        logger.info(
+            "Upserted %s rows into %s (%s inserted, %s updated)",
+            rows.num_rows, dst_table, rows.num_rows - updated, updated
+        )
+        return {"inserted": rows.num_rows - updated, "updated": updated}
+    except Exception as e:
+        logger.error("Error upserting data into fact table: %s", e)
+        raise
@@ -0,0 +1,12 @@
+import pytest
+from pyiceberg.catalog.sql import SqlCatalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    """
+    SQLite catalog with an empty 'db' namespace, its warehouse in tmp_path.
+    """
+    catalog = SqlCatalog('local', uri=f'sqlite:///{tmp_path}/catalog.db', warehouse=f'file://{tmp_path}')
+    catalog.create_namespace('db')
+    return catalog
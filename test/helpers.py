@@ -0,0 +1,47 @@
+import datetime
+import pyarrow as pa
+
+
+def staged(rpms, start=0):
+    """
+    Staged rows of one driver and session, one sample per second from 12:00:<start>.
+    """
+    n = len(rpms)
+    return pa.table({
+        'event_id': ['23001A'] * n,
+        'event_year': ['23'] * n,
+        'event_code': ['A'] * n,
+        'event_num': ['001'] * n,
+        'session_id': ['Q1'] * n,
+        'timeUtc': pa.array([datetime.datetime(2023, 1, 1, 12, 0, start + i) for i in range(n)], pa.timestamp('ms')),
+        'driverNumber': [44] * n,
+        'rpm': rpms,
+        'speed': [300] * n,
+        'gear': [5] * n,
+        'throttle': [80] * n,
+        'brake': [1] * n,
+        'drs': [0] * n
+    })
+
+
+def fact_rows(session_id='R', drivers=(1, 44), samples=6):
+    """
+    Fact table rows without pk_id, samples every 250 ms for each driver.
+    """
+    n = len(drivers) * samples
+    start = datetime.datetime(2023, 1, 1, 12, 0, 0)
+    return pa.table({
+        'event_id': ['23001A'] * n,
+        'event_year': ['23'] * n,
+        'event_code': ['A'] * n,
+        'event_num': ['001'] * n,
+        'session_id': [session_id] * n,
+        'ts': pa.array([start + datetime.timedelta(milliseconds=250 * i) for i in range(samples)] * len(drivers), pa.timestamp('us')),
+        'drivernumber': pa.array([driver for driver in drivers for _ in range(samples)], pa.int32()),
+        'rpm': pa.array(range(n), pa.int32()),
+        'speed': pa.array([100 + i for i in range(samples)] * len(drivers), pa.int32()),
+        'gear': pa.array([3] * n, pa.int32()),
+        'throttle': pa.array([0, 30, 60, 100, 100, 100][:samples] * len(drivers), pa.int32()),
+        'breaks': [True, False] * (n // 2),
+        'drs': pa.array([12, 0] * (n // 2), pa.int32())
+    })
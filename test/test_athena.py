@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+from src import athena
+
+
+def execution(state, query_id='q1'):
+    return {'QueryExecution': {
+        'QueryExecutionId': query_id,
+        'Status': {'State': state},
+        'Statistics': {
+            'QueryQueueTimeInMillis': 120,
+            'EngineExecutionTimeInMillis': 900,
+            'TotalExecutionTimeInMillis': 1100,
+            'DataScannedInBytes': 2048
+        }
+    }}
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(athena.config, 'athena_poll_initial', 0.001)
+    monkeypatch.setattr(athena.config, 'athena_poll_max', 0.004)
+
+
+def test_run_query_reports_statistics():
+    client = MagicMock()
+    client.start_query_execution.return_value = {'QueryExecutionId': 'q1'}
+    client.get_query_execution.side_effect = [execution('QUEUED'), execution('RUNNING'), execution('SUCCEEDED')]
+    details = athena.run_query(client, 'SELECT 1', 'db', 's3://out')
+    assert details['state'] == 'SUCCEEDED'
+    assert (details['queue_time_ms'], details['engine_time_ms'], details['data_scanned_bytes']) == (120, 900, 2048)
+    assert client.get_query_execution.call_count == 3
+
+
+def test_wait_for_query_failed_state_raises():
+    client = MagicMock()
+    client.get_query_execution.return_value = execution('FAILED')
+    with pytest.raises(athena.AthenaQueryError) as err:
+        athena.wait_for_query(client, 'q1')
+    assert err.value.execution['state'] == 'FAILED'
+
+
+def test_wait_for_query_timeout_cancels():
+    client = MagicMock()
+    client.get_query_execution.return_value = execution('RUNNING')
+    with pytest.raises(athena.AthenaQueryError):
+        athena.wait_for_query(client, 'q1', timeout=0.01)
+    client.stop_query_execution.assert_called_once_with(QueryExecutionId='q1')
+
+
+def test_run_queries_async_waits_for_all():
+    client = MagicMock()
+    client.start_query_execution.side_effect = [{'QueryExecutionId': 'q1'}, {'QueryExecutionId': 'q2'}]
+    states = {'q1': iter(['RUNNING', 'SUCCEEDED']), 'q2': iter(['FAILED'])}
+    client.get_query_execution.side_effect = lambda QueryExecutionId: execution(next(states[QueryExecutionId]), QueryExecutionId)
+    results = asyncio.run(athena.run_queries_async(client, ['SELECT 1', 'SELECT 2'], 'db', 's3://out'))
+    assert results[0]['state'] == 'SUCCEEDED'
+    assert isinstance(results[1], athena.AthenaQueryError)
@@ -0,0 +1,117 @@
+import io
+import json
+import pytest
+from unittest.mock import MagicMock
+import backfill
+from main import prepare_file
+from src import clients, config
+
+
+CSV = (
+    "timeUtc,driverNumber,rpm,speed,gear,throttle,brake,drs\n"
+    "2023-01-01T12:00:00Z,44,12000,300,5,80,0,1\n"
+    "2023-01-01T12:00:01Z,44,12100,301,5,81,0,1\n"
+)
+FILES = {
+    'season/23001A_FP1.csv': CSV,
+    'season/23001A_Q.csv': CSV,
+    'season/23002B_R.csv': CSV,
+    'season/23002B_Q.csv': "timeUtc,driverNumber\nnot a time,44\n",
+    'season/notes.txt': "",
+}
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    s3 = MagicMock()
+    keys = sorted(FILES)
+    # two listing pages
+    s3.get_paginator.return_value.paginate.return_value = [
+        {'Contents': [{'Key': key, 'ETag': f'"{key}"', 'Size': len(FILES[key])} for key in keys[:2]]},
+        {'Contents': [{'Key': key, 'ETag': f'"{key}"', 'Size': len(FILES[key])} for key in keys[2:]]}
+    ]
+    s3.get_object.side_effect = lambda Bucket, Key: {'Body': io.BytesIO(FILES[Key].encode())}
+    clients.register('s3', s3)
+    clients.use_local_catalog(str(tmp_path / 'warehouse'), namespace='db')
+    for name, value in {
+        'database_name': 'db', 'fact_table': 'fact_telemetry', 'table_location': f'file://{tmp_path}/tables',
+        'range_reads': False
+    }.items():
+        monkeypatch.setattr(config, name, value)
+    yield s3
+    clients.reset()
+
+
+def test_group_by_event():
+    files = [{'key': key} for key in FILES if key.endswith('.csv')]
+    groups = backfill.group_by_event(files)
+    assert list(groups) == ['23001A', '23002B']
+    assert [file['key'] for file in groups['23002B']] == ['season/23002B_Q.csv', 'season/23002B_R.csv']
+    assert [len(batch) for _, batch in backfill.plan_batches(groups, 1)] == [1, 1, 1, 1]
+
+
+def test_backfill_resumes_from_checkpoint(s3, tmp_path):
+    checkpoint = f"file:{tmp_path / 'checkpoint.jsonl'}"
+    first = backfill.run_backfill('telem-data', 'season/', checkpoint, write_mode='direct', events=['23001A'])
+    assert first['succeeded'] == 2 and first['rows'] == 4
+    assert first['files_per_s'] > 0 and first['rows_per_s'] > 0
+
+    # the stopped run is picked up where it left off, loaded files are not read again
+    s3.get_object.reset_mock()
+    second = backfill.run_backfill('telem-data', 'season/', checkpoint, batch_files=1, write_mode='direct')
+    assert (second['total_files'], second['succeeded'], second['invalid']) == (2, 1, 1)
+    assert sorted(call.kwargs['Key'] for call in s3.get_object.call_args_list) == ['season/23002B_Q.csv', 'season/23002B_R.csv']
+
+    fact = config.glue_catalog.load_table(('db', 'fact_telemetry'))
+    assert fact.scan().to_arrow().num_rows == 6
+    with open(tmp_path / 'checkpoint.jsonl') as file:
+        statuses = [json.loads(line)['status'] for line in file]
+    assert sorted(statuses) == ['invalid', 'succeeded', 'succeeded', 'succeeded']
+    assert backfill.run_backfill('telem-data', 'season/', checkpoint, write_mode='direct')['total_files'] == 0
+
+
+def test_backfill_quarantines_once_and_dedupes_across_files(s3, tmp_path, monkeypatch):
+    files = {
+        'season/a/23003C_R.csv': CSV,
+        # repeats the second sample of the first file and has a gear out of range
+        'season/b/23003C_R.csv': (
+            "timeUtc,driverNumber,rpm,speed,gear,throttle,brake,drs\n"
+            "2023-01-01T12:00:01Z,44,13000,301,5,81,0,1\n"
+            "2023-01-01T12:00:02Z,44,13100,302,20,82,0,1\n"
+            "2023-01-01T12:00:03Z,44,13200,303,6,83,0,1\n"
+        )
+    }
+    s3.get_paginator.return_value.paginate.return_value = [
+        {'Contents': [{'Key': key, 'ETag': f'"{key}"', 'Size': len(body)} for key, body in files.items()]}
+    ]
+    s3.get_object.side_effect = lambda Bucket, Key: {'Body': io.BytesIO(files[Key].encode())}
+    checkpoint = f"file:{tmp_path / 'checkpoint.jsonl'}"
+    quarantine = ('db', config.quarantine_table)
+
+    with monkeypatch.context() as patched:
+        patched.setattr(backfill, 'upsert_to_fact_table', MagicMock(side_effect=RuntimeError('commit failed')))
+        failed = backfill.run_backfill('telem-data', 'season/', checkpoint, write_mode='direct', row_validation=True)
+    assert failed['failed'] == 2
+    # rows of a batch that did not commit are not quarantined yet
+    assert not config.glue_catalog.table_exists(quarantine)
+
+    resumed = backfill.run_backfill('telem-data', 'season/', checkpoint, write_mode='direct', row_validation=True)
+    assert resumed['succeeded'] == 2
+    assert config.glue_catalog.load_table(quarantine).scan().to_arrow().num_rows == 1
+    rows = config.glue_catalog.load_table(('db', 'fact_telemetry')).scan().to_arrow().sort_by('ts')
+    assert rows.column('rpm').to_pylist() == [12000, 13000, 13200]
+
+
+def test_athena_batch_stages_each_session_once_without_repeats(s3, monkeypatch):
+    batcher = MagicMock()
+    monkeypatch.setattr(backfill, 'MergeBatcher', MagicMock(return_value=batcher))
+    monkeypatch.setattr(backfill, 'update_rollups', MagicMock())
+    clients.register('athena', MagicMock())
+    keys = ['season/a/23003C_R.csv', 'season/b/23003C_R.csv', 'season/23003C_Q.csv']
+    prepared = [({'key': key}, {}, prepare_file(CSV.encode(), key, 'arrow', False)[1]) for key in keys]
+    backfill.commit_batch('23003C', prepared, 'athena')
+    added = {call.args[0]: call.args[1] for call in batcher.add.call_args_list}
+    assert list(added) == ['season/a/23003C_R.csv, season/b/23003C_R.csv', 'season/23003C_Q.csv']
+    # both R files hold the same two samples
+    assert added['season/a/23003C_R.csv, season/b/23003C_R.csv'].num_rows == 2
+    batcher.flush.assert_called_once()
@@ -0,0 +1,63 @@
+import pytest
+import pyarrow as pa
+from unittest.mock import MagicMock, patch
+from src import batching
+
+
+def rows(n):
+    return pa.table({'timeUtc': list(range(n, 0, -1)), 'driverNumber': [44] * n, 'rpm': list(range(n))})
+
+
+def make_batcher(**kwargs):
+    catalog = MagicMock()
+    batcher = batching.MergeBatcher(catalog, MagicMock(), 'db', 's3://loc', 'AwsDataCatalog', 'fact_telemetry', **kwargs)
+    return batcher, catalog
+
+
+def test_batch_flushes_once_full():
+    batcher, catalog = make_batcher(max_files=2, max_bytes=1 << 30, max_seconds=3600)
+    with patch.object(batching, 'merge_to_fact_table', return_value={'state': 'SUCCEEDED'}) as merge:
+        assert batcher.add('a.csv', rows(3)) is None
+        assert batcher.add('a.csv', rows(3)) is None
+        batch = batcher.add('b.csv', rows(2))
+        assert batcher.flush() is None
+    assert batch['keys'] == ['a.csv', 'b.csv']
+    assert batch['rows'] == 5
+    assert merge.call_count == 1
+    assert catalog.create_table.call_count == 1
+    appended = catalog.create_table.return_value.transaction.return_value.append.call_args_list
+    assert len(appended) == 2
+    assert appended[0][0][0].column('timeUtc').to_pylist() == [1, 2, 3]
+
+
+def test_flush_merges_remaining_files():
+    batcher, _ = make_batcher(max_files=10, max_bytes=1 << 30, max_seconds=3600)
+    with patch.object(batching, 'merge_to_fact_table', return_value={'state': 'SUCCEEDED'}) as merge:
+        batcher.add('a.csv', rows(1))
+        batch = batcher.flush()
+    assert batch['staging_table'].startswith('stg_batch_')
+    assert merge.call_args[0][4] == batch['staging_table']
+
+
+def test_failed_merge_reports_every_key():
+    batcher, _ = make_batcher(max_files=10, max_bytes=1 << 30, max_seconds=3600)
+    with patch.object(batching, 'merge_to_fact_table', side_effect=RuntimeError('FAILED')):
+        batcher.add('a.csv', rows(1))
+        batcher.add('b.csv', rows(1))
+        with pytest.raises(batching.BatchMergeError) as err:
+            batcher.flush()
+    assert err.value.keys == ['a.csv', 'b.csv']
+
+
+def test_same_session_twice_merges_the_batch_first():
+    batcher, catalog = make_batcher(max_files=10, max_bytes=1 << 30, max_seconds=3600)
+    session = rows(2).append_column('event_id', pa.array(['23001A'] * 2)).append_column('session_id', pa.array(['Q1'] * 2))
+    with patch.object(batching, 'merge_to_fact_table', return_value={'state': 'SUCCEEDED'}) as merge:
+        batcher.add('23001A_Q1.csv', session)
+        batcher.add('23001A_R.csv', session.set_column(4, 'session_id', pa.array(['R'] * 2)))
+        assert merge.call_count == 0
+        batcher.add('23001A_Q1.csv.gz', session)
+        assert merge.call_count == 1
+        batch = batcher.flush()
+    assert batch['keys'] == ['23001A_Q1.csv.gz']
+    assert catalog.create_table.call_count == 2
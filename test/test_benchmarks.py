@@ -0,0 +1,41 @@
+import pyarrow.csv as pacsv
+from benchmarks.generate import generate_csv
+from benchmarks.run import compare, failed_stages, run
+from src import clients
+
+
+def test_generate_csv_is_deterministic(tmp_path):
+    first, second = tmp_path / 'first.csv', tmp_path / 'second.csv'
+    assert generate_csv(str(first), 5_000, drivers=4, seed=7) == 5_000
+    generate_csv(str(second), 5_000, drivers=4, seed=7)
+    assert first.read_bytes() == second.read_bytes()
+    data = pacsv.read_csv(first)
+    assert data.num_rows == 5_000
+    assert len(set(data.column('driverNumber').to_pylist())) == 4
+
+
+def test_generate_csv_injects_bad_rows(tmp_path):
+    path = tmp_path / 'bad.csv'
+    generate_csv(str(path), 10_000, bad_fraction=0.05, seed=1)
+    data = pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(column_types={'timeUtc': 'string', 'rpm': 'string'}))
+    bad = sum(value == 'n/a' for value in data.column('timeUtc').to_pylist())
+    bad += sum(value in ('-1', '99999', 'err') for value in data.column('rpm').to_pylist())
+    assert bad > 0
+
+
+def test_compare_flags_slower_stages():
+    previous = {'commit': 'a', 'timestamp': 't0', 'stages': [{'stage': 'read_file', 'wall_s': 1.0}, {'stage': 'validate_data', 'wall_s': 1.0}]}
+    record = {'stages': [{'stage': 'read_file', 'wall_s': 1.05}, {'stage': 'validate_data', 'wall_s': 1.5}]}
+    assert compare(record, previous) == ['validate_data']
+
+
+def test_validation_crash_fails_the_run(tmp_path):
+    # bad rows leave text in numeric columns, the pandas checks raise TypeError on them
+    try:
+        stages = run(10_000, 4, 4.0, 0.05, 1, 'pandas', str(tmp_path), trace_allocations=False)
+    finally:
+        clients.reset()
+    assert stages[-1]['stage'] == 'validate_data'
+    assert 'TypeError' in stages[-1]['error']
+    assert failed_stages(stages) == ['validate_data']
+    assert compare({'stages': stages}, {'commit': 'a', 'timestamp': 't0', 'stages': stages}) == []
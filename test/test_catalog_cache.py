@@ -0,0 +1,78 @@
+import pytest
+import pyarrow as pa
+from pyiceberg.exceptions import CommitFailedException, NoSuchTableError
+from src import config, etl, upsert
+from src.catalog_cache import CachedCatalog, call_counts
+from src.data_definition import get_validator
+from test.helpers import fact_rows
+
+
+@pytest.fixture
+def catalog(catalog):
+    return CachedCatalog(catalog, ttl=3600)
+
+
+def staged_rows():
+    rows = fact_rows('R')
+    return pa.table({
+        **{column: rows.column(column) for column in ['event_id', 'event_year', 'event_code', 'event_num', 'session_id']},
+        'timeUtc': rows.column('ts'),
+        'driverNumber': rows.column('drivernumber').cast(pa.int64()),
+        **{column: rows.column(column).cast(pa.int64()) for column in ['rpm', 'speed', 'gear', 'throttle']},
+        'brake': rows.column('breaks').cast(pa.int64()),
+        'drs': rows.column('drs').cast(pa.int64())
+    })
+
+
+def test_staging_a_file_twice_reuses_lookups(catalog, tmp_path):
+    location = f'file://{tmp_path}/stg'
+    etl.load_to_iceberg_table(staged_rows(), catalog, 'db', location)
+    first = call_counts(catalog)
+    assert first['load_table'] == 1 and first['create_table'] == 1
+    catalog.purge_table(('db', 'stg_23001A_R'))
+    etl.load_to_iceberg_table(staged_rows(), catalog, 'db', location)
+    counts = call_counts(catalog)
+    # the purge and the second file only drop and create, existence comes from the cache
+    assert counts['load_table'] == 1
+    assert counts['drop_table'] == 1 and counts['create_table'] == 2
+    assert counts['hits'] > 0
+    assert catalog.load_table(('db', 'stg_23001A_R')).scan().to_arrow().num_rows == 12
+
+
+def test_commits_refresh_and_failures_invalidate(catalog, tmp_path):
+    fact = upsert.load_fact_table(catalog, 'db', 'fact_telemetry', f'file://{tmp_path}')
+    rows = fact_rows('R')
+    rows = rows.add_column(0, 'pk_id', pa.array([str(i) for i in range(rows.num_rows)]))
+    fact.append(rows.cast(fact.schema().as_arrow()))
+    loads = call_counts(catalog)['load_table']
+    # the cached metadata already holds the append
+    assert catalog.load_table(('db', 'fact_telemetry')).scan().to_arrow().num_rows == 12
+    assert call_counts(catalog)['load_table'] == loads
+
+    stale = catalog.load_table(('db', 'fact_telemetry'))
+    fact.append(rows.cast(fact.schema().as_arrow()))
+    with pytest.raises(CommitFailedException):
+        stale.append(rows.cast(fact.schema().as_arrow()))
+    assert stale.refresh().scan().to_arrow().num_rows == 24
+    assert call_counts(catalog)['load_table'] == loads + 1
+    # refresh always asks the catalog, a writer in another container is seen right away
+    other = CachedCatalog(catalog.catalog, ttl=3600)
+    other.load_table(('db', 'fact_telemetry')).append(rows.cast(fact.schema().as_arrow()))
+    assert fact.refresh().scan().to_arrow().num_rows == 36
+    assert call_counts(catalog)['load_table'] == loads + 2
+
+    catalog.drop_table(('db', 'fact_telemetry'))
+    assert not catalog.table_exists(('db', 'fact_telemetry'))
+    with pytest.raises(NoSuchTableError):
+        catalog.load_table(('db', 'fact_telemetry'))
+
+
+def test_validator_is_built_once():
+    assert get_validator() is get_validator()
+    result, clean, rejected = get_validator().validate_arrow_rows(pa.table({
+        column: pa.array([1, 200], pa.int64()) for column in get_validator().required_columns if column != 'timeUtc'
+    }).append_column('timeUtc', pa.array(['2023-01-01 12:00:00'] * 2)))
+    assert result['rows_valid'] == 1
+    assert rejected.column('failed_rules').to_pylist() == [
+        'driverNumber_out_of_range,gear_out_of_range,throttle_out_of_range,brake_out_of_range,drs_out_of_range'
+    ]
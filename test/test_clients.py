@@ -0,0 +1,30 @@
+import pytest
+from unittest.mock import MagicMock
+from src import clients, config
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    clients.reset()
+    yield
+    clients.reset()
+
+
+def test_clients_created_once_on_first_use(monkeypatch):
+    monkeypatch.setenv('aws_region_name', 'eu-west-1')
+    assert 's3' not in clients._registry
+    s3 = config.s3
+    assert config.s3 is s3
+    assert s3.meta.config.max_pool_connections == config.max_pool_connections
+
+
+def test_registered_stand_in_is_used():
+    athena = MagicMock()
+    clients.register('athena', athena)
+    assert config.athena is athena
+
+
+def test_use_local_catalog(tmp_path):
+    catalog = clients.use_local_catalog(str(tmp_path / 'warehouse'), namespace='telemetry')
+    assert config.glue_catalog is catalog
+    assert ('telemetry',) in catalog.list_namespaces()
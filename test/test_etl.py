@@ -1,5 +1,7 @@
+import io
 import pytest
 import pandas as pd
+import pyarrow as pa
 from unittest.mock import MagicMock
 from src import etl
 
@@ -15,6 +17,13 @@ def test_get_race_id_valid():
     assert result['event_code'] == 'A'
 
 
+@pytest.mark.parametrize('extention', ['csv.gz', 'csv.zst', 'parquet'])
+def test_get_race_id_compressed_and_parquet(extention):
+    result = etl.get_race_id(f'in/23001A_Q1.{extention}')
+    assert result['extention'] == extention
+    assert result['session_id'] == 'Q1'
+
+
 def test_get_race_id_invalid_format():
     key = 'badfile.csv'
     with pytest.raises(ValueError):
@@ -98,4 +107,249 @@ def test_read_file_no_such_key():
     s3 = MagicMock()
     s3.get_object.side_effect = Exception('NoSuchKey')
     with pytest.raises(Exception):
-        etl.read_file('bucket', 'bad/key.csv', s3) 
\ No newline at end of file
+        etl.read_file('bucket', 'bad/key.csv', s3) 
+
+CSV_BODY = (
+    "timeUtc,driverNumber,rpm,speed,gear,throttle,brake,drs\n"
+    "2023-01-01T12:00:00Z,44,12000,300,5,80,0,1\n"
+    "2023-01-01T12:00:01Z,44,12100,301,5,81,0,1\n"
+    "2023-01-01T12:00:02Z,44,12200,302,6,82,0,1\n"
+)
+
+META = {
+    'event_id': '23001A',
+    'event_year': '23',
+    'event_num': '001',
+    'event_code': 'A',
+    'session_id': 'Q1',
+    'file_name_with_extention': '23001A_Q1.csv',
+    'file_name': '23001A_Q1',
+    'extention': 'csv'
+}
+
+
+def s3_with_body(body):
+    s3 = MagicMock()
+    s3.get_object.side_effect = lambda **kwargs: {'Body': io.BytesIO(body.encode())}
+    return s3
+
+
+def encode(body, extention):
+    """
+    Encodes CSV text as the bytes of a csv, csv.gz, csv.zst or parquet file.
+    """
+    if extention == 'parquet':
+        import pyarrow.csv as pacsv
+        import pyarrow.parquet as pq
+        sink = io.BytesIO()
+        data = pacsv.read_csv(io.BytesIO(body.encode()))
+        pq.write_table(data.append_column('extra', pa.array(['x'] * data.num_rows)), sink)
+        return sink.getvalue()
+    if extention == 'csv':
+        return body.encode()
+    codec = 'gzip' if extention == 'csv.gz' else 'zstd'
+    sink = pa.BufferOutputStream()
+    with pa.CompressedOutputStream(sink, codec) as stream:
+        stream.write(body.encode())
+    return sink.getvalue().to_pybytes()
+
+
+def s3_with_bytes(body):
+    s3 = MagicMock()
+    s3.get_object.side_effect = lambda **kwargs: {'Body': io.BytesIO(body)}
+    return s3
+
+
+@pytest.mark.parametrize('extention', ['csv.gz', 'csv.zst', 'parquet'])
+def test_compressed_and_parquet_inputs_match_csv(extention):
+    key = f'in/23001A_Q1.{extention}'
+    body = encode(CSV_BODY, extention)
+    expected_result, expected = etl.validate_arrow_data(etl.read_file_arrow('bucket', '23001A_Q1.csv', s3_with_body(CSV_BODY)))
+    result, table = etl.validate_arrow_data(etl.read_file_arrow('bucket', key, s3_with_bytes(body)))
+    assert result == expected_result
+    assert table.equals(expected)
+    assert etl.validate_data(etl.read_file('bucket', key, s3_with_bytes(body)))['is_valid']
+    chunks = list(etl.read_file_in_chunks('bucket', key, s3_with_bytes(body), chunk_size=2))
+    assert sum(len(chunk) for chunk in chunks) == 3
+    blocks = list(etl.read_file_arrow_in_chunks('bucket', key, s3_with_bytes(body)))
+    assert sum(block.num_rows for block in blocks) == 3
+
+
+def test_parquet_reads_only_required_columns():
+    table = etl.parse_file_arrow(encode(CSV_BODY, 'parquet'), '23001A_Q1.parquet')
+    assert 'extra' not in table.column_names
+
+
+def test_read_file_in_chunks_bounded():
+    chunks = list(etl.read_file_in_chunks('bucket', '23001A_Q1.csv', s3_with_body(CSV_BODY), chunk_size=2))
+    assert [len(c) for c in chunks] == [2, 1]
+    assert chunks[1].index[0] == 0
+
+
+def test_stream_to_iceberg_table_commits_valid_file():
+    catalog = MagicMock()
+    catalog.table_exists.return_value = False
+    txn = catalog.create_table.return_value.transaction.return_value
+    result, table_name, _ = etl.stream_to_iceberg_table(
+        'bucket', '23001A_Q1.csv', s3_with_body(CSV_BODY), META, catalog, 'db', 's3://loc', chunk_size=2
+    )
+    assert result['is_valid']
+    assert table_name == 'stg_23001A_Q1'
+    assert txn.append.call_count == 2
+    txn.commit_transaction.assert_called_once()
+
+
+def test_stream_to_iceberg_table_invalid_chunk_not_committed():
+    body = CSV_BODY + "2023-01-01T12:00:03Z,44,99999,302,6,82,0,1\n"
+    catalog = MagicMock()
+    catalog.table_exists.return_value = False
+    txn = catalog.create_table.return_value.transaction.return_value
+    result, _, _ = etl.stream_to_iceberg_table(
+        'bucket', '23001A_Q1.csv', s3_with_body(body), META, catalog, 'db', 's3://loc', chunk_size=2
+    )
+    assert not result['is_valid']
+    assert any('rpm' in err and 'Chunk 1' in err for err in result['errors'])
+    txn.commit_transaction.assert_not_called()
+    catalog.purge_table.assert_called_once_with(('db', 'stg_23001A_Q1'))
+
+
+def test_arrow_engine_matches_pandas_result():
+    body = CSV_BODY + "2023-01-01T12:00:03Z,44,12200,302,6,82,0,25\n"
+    table = etl.read_file_arrow('bucket', '23001A_Q1.csv', s3_with_body(body))
+    arrow_result, table = etl.validate_arrow_data(table)
+    pandas_result = etl.validate_data(pd.read_csv(io.StringIO(body)))
+    assert arrow_result == pandas_result
+    assert not arrow_result['is_valid']
+    assert table.column_names == ['timeUtc', 'driverNumber', 'rpm', 'speed', 'gear', 'throttle', 'brake', 'drs']
+
+
+def test_read_file_arrow_unparsable_value():
+    body = CSV_BODY + "2023-01-01T12:00:03Z,44,fast,302,6,82,0,1\n"
+    table = etl.read_file_arrow('bucket', '23001A_Q1.csv', s3_with_body(body))
+    result, _ = etl.validate_arrow_data(table)
+    assert not result['is_valid']
+    assert any("'rpm'" in err for err in result['errors'])
+
+
+def test_transform_arrow_data_to_staging_columns():
+    table = etl.read_file_arrow('bucket', '23001A_Q1.csv', s3_with_body(CSV_BODY))
+    result, table = etl.validate_arrow_data(table)
+    assert result['is_valid']
+    final = etl.to_arrow_table(etl.transform_arrow_data(table, META))
+    assert final.column_names == etl.config.cols
+    assert final.column('event_id').to_pylist() == ['23001A'] * 3
+
+
+def test_validate_arrow_rows_splits_bad_rows():
+    body = CSV_BODY + "2023-01-01T12:00:03Z,44,fast,302,6,82,0,1\nbad,44,25000,302,6,82,0,1\n"
+    result, clean, rejected = etl.validate_arrow_rows(pd.read_csv(io.StringIO(body)))
+    assert not result['is_valid']
+    assert (result['rows_valid'], result['rows_rejected']) == (3, 2)
+    assert clean.num_rows == 3
+    assert rejected.column('failed_rules').to_pylist() == ['rpm_invalid', 'timeUtc_invalid,rpm_out_of_range']
+
+
+def test_stream_to_iceberg_table_row_validation_returns_rejected_rows():
+    body = CSV_BODY + "2023-01-01T12:00:03Z,44,99999,302,6,82,0,1\n"
+    catalog = MagicMock()
+    catalog.table_exists.return_value = False
+    txn = catalog.create_table.return_value.transaction.return_value
+    result, _, rejected = etl.stream_to_iceberg_table(
+        'bucket', '23001A_Q1.csv', s3_with_body(body), META, catalog, 'db', 's3://loc', chunk_size=2,
+        engine='arrow', row_validation=True
+    )
+    assert result['is_valid']
+    assert (result['rows_valid'], result['rows_rejected']) == (3, 1)
+    txn.commit_transaction.assert_called_once()
+    # quarantined by the caller once the file is merged
+    catalog.create_table.return_value.append.assert_not_called()
+    assert rejected.column('rpm').to_pylist() == [99999]
+    assert rejected.column('failed_rules').to_pylist() == ['rpm_out_of_range']
+
+
+def test_compact_mode_narrows_columns(monkeypatch):
+    monkeypatch.setattr(etl.config, 'compact', True)
+    _, table = etl.validate_arrow_data(etl.parse_csv_arrow(CSV_BODY.encode()))
+    table = etl.to_arrow_table(etl.transform_arrow_data(table, META))
+    assert pa.types.is_dictionary(table.schema.field('event_id').type)
+    assert table.schema.field('driverNumber').type == pa.int8()
+    assert table.schema.field('rpm').type == pa.int16()
+    assert table.schema.field('brake').type == pa.bool_()
+    pandas_table = etl.to_arrow_table(etl.transform_data(pd.read_csv(io.StringIO(CSV_BODY)), META))
+    assert pandas_table.schema.field('session_id').type == table.schema.field('session_id').type
+    assert pandas_table.column('event_id').to_pylist() == ['23001A'] * 3
+
+
+@pytest.mark.parametrize("keep,rpms", [('first', [11000, 12000, 12100]), ('last', [11000, 12050, 12100])])
+def test_deduplicate_rows_sorts_and_keeps_one_sample(keep, rpms):
+    body = (
+        "timeUtc,driverNumber,rpm,speed,gear,throttle,brake,drs\n"
+        "2023-01-01T12:00:01Z,44,12100,301,5,81,0,1\n"
+        "2023-01-01T12:00:00Z,44,12000,300,5,80,0,1\n"
+        "2023-01-01T12:00:00Z,1,11000,290,5,70,0,0\n"
+        "2023-01-01T12:00:00Z,44,12050,300,5,80,0,1\n"
+        "2023-01-01T12:00:01Z,44,12100,301,5,81,0,1\n"
+    )
+    _, table = etl.validate_arrow_data(etl.parse_csv_arrow(body.encode()))
+    table, dropped = etl.deduplicate_rows(etl.to_arrow_table(etl.transform_arrow_data(table, META)), keep)
+    assert dropped == 2
+    assert table.column('driverNumber').to_pylist() == [1, 44, 44]
+    assert table.column('rpm').to_pylist() == rpms
+    assert etl.deduplicate_rows(table, 'none')[1] == 0
+    with pytest.raises(ValueError):
+        etl.deduplicate_rows(table, 'any')
+
+
+def test_quarantine_keeps_out_of_range_values_in_compact_mode(monkeypatch):
+    monkeypatch.setattr(etl.config, 'compact', True)
+    body = CSV_BODY + "2023-01-01T12:00:03Z,44,99999,302,6,82,0,1\n"
+    catalog = MagicMock()
+    catalog.table_exists.return_value = False
+    result, clean = etl.quarantine_invalid_rows(
+        etl.parse_csv_arrow(body.encode()), META, '23001A_Q1.csv', catalog, 'db', 's3://loc'
+    )
+    assert (result['rows_valid'], result['rows_rejected']) == (3, 1)
+    quarantined = catalog.create_table.return_value.append.call_args[0][0]
+    assert quarantined.column('rpm').to_pylist() == [99999]
+    assert not any(pa.types.is_dictionary(field.type) for field in quarantined.schema)
+
+
+def test_violation_mask_matches_rule_by_rule_checks():
+    validator = etl.get_validator()
+    rows = {column: pa.array([5, None, 0, 300, 1], pa.int64()) for column in validator.validation_rules}
+    rows['timeUtc'] = pa.array([None, 1, 2, 3, 4], pa.timestamp('ns', tz='UTC'))
+    table = pa.table(rows).select(validator.required_columns)
+    expected = [0] * table.num_rows
+    for bit, (_, column, rules) in enumerate(validator.row_rules):
+        for row, value in enumerate(table.column(column).to_pylist()):
+            if (value is None) if rules is None else (value is not None and not rules['min'] <= value <= rules['max']):
+                expected[row] |= 1 << bit
+    assert validator.violation_mask(table).to_pylist() == expected
+    assert validator.violation_mask(table.slice(4)).to_pylist() == [0]
+
+
+def test_naive_timestamps_give_the_same_result_with_every_reader(monkeypatch):
+    monkeypatch.setattr(etl.config, 'range_reads', False)
+    body = CSV_BODY.replace('T', ' ').replace('Z', '')
+    pandas_result = etl.validate_data(etl.read_file('bucket', '23001A_Q1.csv', s3_with_body(body)))
+    arrow_result, arrow_table = etl.validate_arrow_data(etl.read_file_arrow('bucket', '23001A_Q1.csv', s3_with_body(body)))
+    blocks = list(etl.read_file_arrow_in_chunks('bucket', '23001A_Q1.csv', s3_with_body(body)))
+    stream_result, stream_table = etl.validate_arrow_data(pa.concat_tables(blocks))
+    assert pandas_result == arrow_result == stream_result == {'is_valid': True, 'errors': []}
+    assert stream_table.equals(arrow_table)
+    _, expected = etl.validate_arrow_data(etl.read_file_arrow('bucket', '23001A_Q1.csv', s3_with_body(CSV_BODY)))
+    assert stream_table.column('timeUtc').equals(expected.column('timeUtc'))
+
+
+@pytest.mark.parametrize('keep, rpm', [('last', 12150), ('first', 12100)])
+def test_stream_to_iceberg_table_deduplicates_across_chunks(catalog, monkeypatch, keep, rpm):
+    monkeypatch.setattr(etl.config, 'dedup_keep', keep)
+    # chunk_size=2 puts the repeated 12:00:01 sample in both chunks
+    body = CSV_BODY + "2023-01-01T12:00:01Z,44,12150,301,5,81,0,1\n"
+    result, table_name, _ = etl.stream_to_iceberg_table(
+        'bucket', '23001A_Q1.csv', s3_with_body(body), META, catalog, 'db', None, chunk_size=2
+    )
+    assert result['is_valid']
+    assert (result['rows_loaded'], result['rows_dropped']) == (3, 1)
+    staged = catalog.load_table(('db', table_name)).scan().to_arrow().sort_by('timeUtc')
+    assert staged.column('rpm').to_pylist() == [12000, rpm, 12200]
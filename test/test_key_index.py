@@ -0,0 +1,78 @@
+from unittest.mock import MagicMock, patch
+from pyiceberg.expressions import AlwaysFalse, And, EqualTo, GreaterThanOrEqual, LessThanOrEqual
+from src import etl, key_index, upsert
+from test.helpers import staged
+
+
+def test_ranges_from_rows_and_filter():
+    ranges = key_index.ranges_from_rows(upsert.to_fact_rows(staged([1000, 1001, 1002])))
+    start = 1672574400 * 1000000
+    assert ranges == [{
+        'event_id': ('23001A', '23001A'), 'session_id': ('Q1', 'Q1'),
+        'drivernumber': (44, 44), 'ts': (start, start + 2000000)
+    }]
+    assert key_index.overlap_filter(ranges) == And(
+        EqualTo('event_id', '23001A'), EqualTo('session_id', 'Q1'), EqualTo('drivernumber', 44),
+        GreaterThanOrEqual('ts', start), LessThanOrEqual('ts', start + 2000000)
+    )
+    assert key_index.overlap_filter([]) == AlwaysFalse()
+    assert len(key_index.coarsen(ranges * 3)) == 1
+
+
+def operations(table):
+    return [snapshot.summary.operation.value for snapshot in table.snapshots()]
+
+
+def test_upsert_appends_disjoint_rows(catalog, tmp_path):
+    location = f'file://{tmp_path}'
+    upsert.upsert_to_fact_table(staged([1000, 1001]), catalog, 'db', 'fact_telemetry', location)
+    later = upsert.upsert_to_fact_table(staged([1010], start=10), catalog, 'db', 'fact_telemetry', location)
+    table = catalog.load_table(('db', 'fact_telemetry'))
+    assert later == {'inserted': 1, 'updated': 0}
+    assert operations(table) == ['append', 'append']
+    # a key inside the bounds of a file falls back to the read and overwrite
+    again = upsert.upsert_to_fact_table(staged([2001], start=1), catalog, 'db', 'fact_telemetry', location)
+    table = catalog.load_table(('db', 'fact_telemetry'))
+    assert again == {'inserted': 0, 'updated': 1}
+    assert operations(table)[2:] == ['delete', 'append']
+    assert sorted(table.scan().to_arrow().column('rpm').to_pylist()) == [1000, 1010, 2001]
+
+
+def test_upsert_probes_again_after_losing_a_commit_race(catalog, tmp_path):
+    location = f'file://{tmp_path}'
+    upsert.upsert_to_fact_table(staged([1000, 1001]), catalog, 'db', 'fact_telemetry', location)
+    stale = catalog.load_table(('db', 'fact_telemetry'))
+    # another writer loads the same keys after this one read the table
+    upsert.upsert_to_fact_table(staged([1010], start=10), catalog, 'db', 'fact_telemetry', location)
+    with patch.object(upsert, 'load_fact_table', return_value=stale):
+        result = upsert.upsert_to_fact_table(staged([2010], start=10), catalog, 'db', 'fact_telemetry', location)
+    assert result == {'inserted': 0, 'updated': 1}
+    rows = catalog.load_table(('db', 'fact_telemetry')).scan().to_arrow()
+    assert sorted(rows.column('rpm').to_pylist()) == [1000, 1001, 2010]
+
+
+def test_athena_flow_appends_disjoint_staging_and_merges_the_rest(catalog, tmp_path):
+    location = f'file://{tmp_path}'
+    upsert.upsert_to_fact_table(staged([1000, 1001]), catalog, 'db', 'fact_telemetry', location)
+    athena = MagicMock()
+    with patch.object(etl.athena, 'run_query', return_value={'state': 'SUCCEEDED'}) as run_query:
+        table = etl.load_to_iceberg_table(staged([1010], start=10), catalog, 'db', location)
+        execution = etl.merge_to_fact_table(athena, 'AwsDataCatalog', 'db', location, table, 'fact_telemetry', catalog)
+        assert execution == {'state': 'APPENDED', 'rows': 1}
+        assert not run_query.called
+        assert not catalog.table_exists(('db', table))
+        # a key inside the bounds of a fact file is left to the MERGE
+        table = etl.load_to_iceberg_table(staged([2001], start=1), catalog, 'db', location)
+        assert etl.merge_to_fact_table(athena, 'AwsDataCatalog', 'db', location, table, 'fact_telemetry', catalog) == {'state': 'SUCCEEDED'}
+        assert run_query.call_count == 1
+    assert operations(catalog.load_table(('db', 'fact_telemetry'))) == ['append', 'append']
+
+
+def test_append_probes_again_after_a_concurrent_commit(catalog, tmp_path):
+    location = f'file://{tmp_path}'
+    upsert.upsert_to_fact_table(staged([1000]), catalog, 'db', 'fact_telemetry', location)
+    stale = catalog.load_table(('db', 'fact_telemetry'))
+    # another delivery of the same rows commits after this writer probed
+    assert upsert.append_if_disjoint(catalog.load_table(('db', 'fact_telemetry')), upsert.to_fact_rows(staged([1010], start=10)))
+    assert not upsert.append_if_disjoint(stale, upsert.to_fact_rows(staged([1010], start=10)))
+    assert catalog.load_table(('db', 'fact_telemetry')).scan().to_arrow().num_rows == 2
@@ -0,0 +1,64 @@
+import warnings
+import pytest
+import pyarrow as pa
+from pyiceberg.partitioning import PartitionSpec, PartitionField
+from pyiceberg.transforms import IdentityTransform
+from unittest.mock import MagicMock
+from src import layout, maintenance, upsert
+from test.helpers import staged
+
+
+def test_sort_rows_by_driver_and_time():
+    data = pa.table({'timeUtc': [3, 1, 2, 1], 'driverNumber': [44, 44, 1, 1], 'rpm': [1, 2, 3, 4]})
+    sorted_rows = layout.sort_rows(data, layout.config.staging_sort_order, layout.config.schema)
+    assert sorted_rows.column('rpm').to_pylist() == [4, 3, 2, 1]
+
+
+def test_apply_table_layout_updates_existing_table(catalog):
+    # Same shape as the table created by src/sql/fact_telemetry.sql
+    table = catalog.create_table(
+        ('db', 'fact_telemetry'),
+        schema=layout.config.fact_schema,
+        partition_spec=PartitionSpec(PartitionField(2, 1000, IdentityTransform(), 'event_id'))
+    )
+    spec = PartitionSpec(
+        PartitionField(2, 1000, IdentityTransform(), 'event_id'),
+        PartitionField(6, 1001, IdentityTransform(), 'session_id')
+    )
+    table = layout.apply_table_layout(table, layout.config.fact_sort_order, layout.config.fact_schema, spec)
+    assert [f.source_id for f in table.sort_order().fields] == [8, 7]
+    assert [f.name for f in table.spec().fields] == ['event_id', 'session_id']
+    assert table.properties['write.target-file-size-bytes'] == str(layout.config.target_file_size_bytes)
+    metadata = table.metadata_location
+    assert layout.apply_table_layout(table, layout.config.fact_sort_order, layout.config.fact_schema, spec).metadata_location == metadata
+
+
+def test_writes_leave_the_layout_to_maintenance(catalog, tmp_path, monkeypatch):
+    table = catalog.create_table(('db', 'fact_telemetry'), schema=layout.config.fact_schema)
+    metadata = table.metadata_location
+    upsert.upsert_to_fact_table(staged([1000]), catalog, 'db', 'fact_telemetry', f'file://{tmp_path}')
+    # tables created with write_properties are written without pyiceberg warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        upsert.upsert_to_fact_table(staged([1000]), catalog, 'db', 'fact_new', f'file://{tmp_path}')
+    table = catalog.load_table(('db', 'fact_telemetry'))
+    assert len(table.metadata.metadata_log) == 1 and table.metadata.metadata_log[0].metadata_file == metadata
+    assert table.sort_order().is_unsorted
+
+    monkeypatch.setattr(layout.config, 'fact_table', 'fact_telemetry')
+    report = maintenance.maintain_table(catalog, 'db', 'fact_telemetry', dry_run=True, write_mode='direct')
+    assert report['layout'] == {'properties': sorted(layout.write_properties()), 'sort_order': True, 'partitions': ['event_id']}
+    maintenance.maintain_table(catalog, 'db', 'fact_telemetry', write_mode='direct')
+    table = catalog.load_table(('db', 'fact_telemetry'))
+    assert [f.source_id for f in table.sort_order().fields] == [8, 7]
+    assert [f.name for f in table.spec().fields] == ['event_id']
+    report = maintenance.maintain_table(catalog, 'db', 'fact_telemetry', dry_run=True, write_mode='direct')
+    assert report['layout'] == {'properties': [], 'sort_order': False, 'partitions': []}
+
+
+def test_apply_updates_refuses_unknown_pyiceberg_versions(monkeypatch):
+    txn = MagicMock()
+    monkeypatch.setattr(layout.pyiceberg, '__version__', '0.10.0')
+    with pytest.raises(RuntimeError, match='0.10.0'):
+        layout.apply_updates(txn, ())
+    txn._apply.assert_not_called()
@@ -0,0 +1,97 @@
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+import main
+from src import clients, ledger
+
+
+IDENTITY = {'bucket': 'telem-data', 'key': 'in/23001A_Q1.csv', 'etag': 'abc', 'size': 10}
+
+
+@pytest.fixture
+def s3():
+    s3 = MagicMock()
+    s3.head_object.return_value = {'ETag': '"abc"', 'ContentLength': 10}
+    clients.register('s3', s3)
+    yield s3
+    clients.reset()
+
+
+def test_file_ledger_round_trip(tmp_path):
+    path = str(tmp_path / 'ledger.jsonl')
+    ledger.FileLedger(path).record(ledger.ledger_entry(IDENTITY, 'succeeded', time.time(), {'rows_loaded': 5}))
+    entry = ledger.FileLedger(path).lookup(IDENTITY)
+    assert entry['status'] == 'succeeded'
+    assert entry['rows_loaded'] == 5
+    assert ledger.FileLedger(path).lookup({**IDENTITY, 'etag': 'changed'}) is None
+
+
+def test_main_skips_already_loaded_file(tmp_path, s3):
+    file_ledger = ledger.FileLedger(str(tmp_path / 'ledger.jsonl'))
+    with patch.object(main, 'get_ledger', return_value=file_ledger), \
+            patch.object(main, 'run_file', return_value={'is_valid': True, 'errors': [], 'rows_loaded': 3}) as run_file:
+        main.main('telem-data', 'in/23001A_Q1.csv')
+        result = main.main('telem-data', 'in/23001A_Q1.csv')
+    assert run_file.call_count == 1
+    assert result['skipped']
+    assert s3.head_object.call_count == 2
+
+
+def test_main_retries_failed_file(tmp_path, s3):
+    file_ledger = ledger.FileLedger(str(tmp_path / 'ledger.jsonl'))
+    with patch.object(main, 'get_ledger', return_value=file_ledger), \
+            patch.object(main, 'run_file', side_effect=[RuntimeError('boom'), {'is_valid': True, 'errors': []}]) as run_file:
+        with pytest.raises(RuntimeError):
+            main.main('telem-data', 'in/23001A_Q1.csv')
+        assert file_ledger.lookup(IDENTITY)['status'] == 'failed'
+        main.main('telem-data', 'in/23001A_Q1.csv')
+    assert run_file.call_count == 2
+    assert file_ledger.lookup(IDENTITY)['status'] == 'succeeded'
+
+
+def test_iceberg_ledger_round_trip(tmp_path):
+    catalog = clients.use_local_catalog(str(tmp_path), namespace='db')
+    clients.reset()
+    ledger.IcebergLedger(catalog, 'db', 'ingestion_ledger', f'file://{tmp_path}').record(
+        ledger.ledger_entry(IDENTITY, 'invalid', time.time())
+    )
+    entry = ledger.IcebergLedger(catalog, 'db', 'ingestion_ledger', f'file://{tmp_path}').lookup(IDENTITY)
+    assert entry['status'] == 'invalid'
+
+
+def test_iceberg_ledger_batches_lookups_and_records(tmp_path):
+    catalog = clients.use_local_catalog(str(tmp_path), namespace='db')
+    clients.reset()
+    identities = [{**IDENTITY, 'key': f'in/23001A_{session}.csv'} for session in ['FP1', 'FP2', 'Q']]
+    writer = ledger.IcebergLedger(catalog, 'db', 'ingestion_ledger', f'file://{tmp_path}')
+    writer.record(ledger.ledger_entry(identities[0], 'failed', time.time()))
+    writer.record_many([ledger.ledger_entry(identity, 'succeeded', time.time()) for identity in identities[:2]])
+    assert len(catalog.load_table(('db', 'ingestion_ledger')).snapshots()) == 2
+
+    reader = ledger.IcebergLedger(catalog, 'db', 'ingestion_ledger', f'file://{tmp_path}')
+    entries = reader.lookup_many([*identities, {**identities[0], 'etag': 'changed'}])
+    assert [entry and entry['status'] for entry in entries] == ['succeeded', 'succeeded', None, None]
+
+
+def test_iceberg_ledger_retries_concurrent_commits(tmp_path):
+    catalog = clients.use_local_catalog(str(tmp_path), namespace='db')
+    clients.reset()
+    first = ledger.IcebergLedger(catalog, 'db', 'ingestion_ledger', f'file://{tmp_path}')
+    second = ledger.IcebergLedger(catalog, 'db', 'ingestion_ledger', f'file://{tmp_path}')
+    first.record(ledger.ledger_entry(IDENTITY, 'failed', time.time()))
+    assert second.lookup(IDENTITY)['status'] == 'failed'
+    # the second container still holds the table as it was before this commit
+    first.record(ledger.ledger_entry({**IDENTITY, 'key': 'in/23001A_R.csv'}, 'succeeded', time.time()))
+    second.record(ledger.ledger_entry(IDENTITY, 'succeeded', time.time()))
+    rows = catalog.load_table(('db', 'ingestion_ledger')).scan().to_arrow()
+    assert rows.num_rows == 3
+
+
+def test_main_reports_loaded_file_when_ledger_fails(s3):
+    failing_ledger = MagicMock()
+    failing_ledger.lookup.return_value = None
+    failing_ledger.record.side_effect = RuntimeError('ledger down')
+    with patch.object(main, 'get_ledger', return_value=failing_ledger), \
+            patch.object(main, 'run_file', return_value={'is_valid': True, 'errors': []}):
+        assert main.main('telem-data', 'in/23001A_Q1.csv')['is_valid']
+    failing_ledger.record.assert_called_once()
@@ -0,0 +1,132 @@
+import json
+import time
+import threading
+import pytest
+import pyarrow as pa
+from unittest.mock import MagicMock, patch
+import main
+from src import clients
+
+
+def s3_record(key):
+    return {
+        'eventSource': 'aws:s3',
+        's3': {'bucket': {'name': 'telem-data'}, 'object': {'key': key}}
+    }
+
+
+def test_get_event_records_s3_and_sqs():
+    sqs_event = {'Records': [
+        {'eventSource': 'aws:sqs', 'messageId': 'm1', 'body': json.dumps({'Records': [s3_record('in/23001A_Q1.csv')]})},
+        {'eventSource': 'aws:sqs', 'messageId': 'm2', 'body': json.dumps({'Event': 's3:TestEvent'})},
+    ]}
+    assert main.get_event_records(sqs_event) == [('m1', 'telem-data', 'in/23001A_Q1.csv')]
+    s3_event = {'Records': [s3_record('in/23001A+Q2.csv')]}
+    assert main.get_event_records(s3_event) == [('in/23001A Q2.csv', 'telem-data', 'in/23001A Q2.csv')]
+
+
+def test_lambda_handler_partial_batch_response():
+    event = {'Records': [
+        {'eventSource': 'aws:sqs', 'messageId': f'm{i}', 'body': json.dumps({'Records': [s3_record(f'in/23001A_Q{i}.csv')]})}
+        for i in range(3)
+    ]}
+
+    def fake_main(bucket, key, pool=None):
+        if key.endswith('Q1.csv'):
+            raise RuntimeError('boom')
+
+    with patch.object(main, 'main', side_effect=fake_main), patch.object(main, 'get_process_pool', return_value=None):
+        response = main.lambda_handler(event, None)
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+
+
+def test_duplicate_records_load_each_key_once_and_one_session_at_a_time():
+    keys = ['in/23001A_Q1.csv', 'in/23001A_Q1.csv', 'in/23001A_Q1.csv.gz', 'in/23001A_R.csv']
+    event = {'Records': [
+        {'eventSource': 'aws:sqs', 'messageId': f'm{i}', 'body': json.dumps({'Records': [s3_record(key)]})}
+        for i, key in enumerate(keys)
+    ]}
+    calls, running, overlaps = [], set(), []
+    lock = threading.Lock()
+
+    def fake_main(bucket, key, pool=None):
+        session = key.split('/')[-1].split('.')[0]
+        with lock:
+            calls.append(key)
+            if session in running:
+                overlaps.append(key)
+            running.add(session)
+        time.sleep(0.05)
+        with lock:
+            running.discard(session)
+        if key == 'in/23001A_Q1.csv':
+            raise RuntimeError('boom')
+
+    with patch.object(main, 'main', side_effect=fake_main), patch.object(main, 'get_process_pool', return_value=None):
+        response = main.lambda_handler(event, None)
+    assert sorted(calls) == sorted(set(keys))
+    assert overlaps == []
+    # both messages of the failed key are retried
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm0'}, {'itemIdentifier': 'm1'}]}
+
+
+def test_lambda_handler_s3_event_raises_on_failure():
+    with patch.object(main, 'main', side_effect=RuntimeError('boom')), patch.object(main, 'get_process_pool', return_value=None):
+        with pytest.raises(RuntimeError):
+            main.lambda_handler({'Records': [s3_record('in/23001A_Q1.csv')]}, None)
+
+
+def test_prepare_file_matches_between_engines():
+    body = (
+        b"timeUtc,driverNumber,rpm,speed,gear,throttle,brake,drs\n"
+        b"2023-01-01T12:00:00Z,44,12000,300,5,80,0,1\n"
+    )
+    pandas_result, pandas_data, _ = main.prepare_file(body, 'in/23001A_Q1.csv', 'pandas', False)
+    arrow_result, arrow_data, _ = main.prepare_file(body, 'in/23001A_Q1.csv', 'arrow', False)
+    assert pandas_result == arrow_result
+    assert pandas_data.to_pylist() == arrow_data.to_pylist()
+
+
+def test_rollup_failure_does_not_fail_the_file(monkeypatch):
+    monkeypatch.setattr(main.config, 'rollups', True)
+    with patch.object(main, 'refresh_rollups', side_effect=RuntimeError('boom')) as refresh:
+        main.update_rollups({'event_id': '23001A', 'session_id': 'Q1'}, None, 'db', 'fact_telemetry', 's3://loc')
+    refresh.assert_called_once()
+
+
+def test_process_pool_unavailable_keeps_config(monkeypatch):
+    monkeypatch.setattr(main.config, 'cpu_workers', 4)
+    monkeypatch.setattr(main, '_process_pool', None)
+    monkeypatch.setattr(main, '_process_pool_unavailable', False)
+    with patch.object(main, 'ProcessPoolExecutor', side_effect=OSError('no /dev/shm')) as pool:
+        assert main.get_process_pool() is None
+        assert main.get_process_pool() is None
+    pool.assert_called_once()
+    assert main.config.cpu_workers == 4
+
+
+@pytest.mark.parametrize('merge_error', [None, RuntimeError('merge failed')])
+def test_streamed_rejects_are_quarantined_after_the_merge(merge_error):
+    rejected = pa.table({'rpm': ['99999']})
+    calls = []
+
+    def merge(*args):
+        calls.append('merge')
+        if merge_error:
+            raise merge_error
+
+    streamed = ({'is_valid': True, 'errors': [], 'rows_loaded': 3}, 'stg_23001A_Q1', rejected)
+    for name in ('s3', 'athena', 'catalog'):
+        clients.register(name, MagicMock())
+    try:
+        with patch.object(main, 'stream_to_iceberg_table', return_value=streamed), \
+                patch.object(main, 'merge_to_fact_table', side_effect=merge), \
+                patch.object(main, 'quarantine_rows', side_effect=lambda key, rows: calls.append(('quarantine', rows))):
+            if merge_error:
+                with pytest.raises(RuntimeError):
+                    main.run_file('telem-data', 'in/23001A_Q1.csv', True, 'arrow', True, 'athena')
+            else:
+                main.run_file('telem-data', 'in/23001A_Q1.csv', True, 'arrow', True, 'athena')
+    finally:
+        clients.reset()
+    assert calls == (['merge'] if merge_error else ['merge', ('quarantine', rejected)])
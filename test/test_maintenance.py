@@ -0,0 +1,82 @@
+import os
+import time
+import pytest
+import pyarrow as pa
+from src import config, ledger, maintenance, upsert
+from test.helpers import fact_rows
+
+
+def append_sessions(catalog, tmp_path, sessions):
+    fact = upsert.load_fact_table(catalog, 'db', 'fact_telemetry', f'file://{tmp_path}')
+    for session_id in sessions:
+        rows = fact_rows(session_id)
+        rows = rows.add_column(0, 'pk_id', pa.array([f'{session_id}{i}' for i in range(rows.num_rows)]))
+        fact.append(rows.cast(fact.schema().as_arrow()))
+    return fact.refresh()
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    for name, value in {
+        'small_file_bytes': 1024 * 1024, 'compaction_min_files': 3, 'snapshot_max_age_seconds': 0,
+        'snapshots_retain_last': 1, 'orphan_min_age_seconds': 0, 'staging_max_age_seconds': 0
+    }.items():
+        monkeypatch.setattr(config, name, value)
+
+
+def test_plan_compaction_picks_partitions_with_small_files(catalog, tmp_path):
+    fact = append_sessions(catalog, tmp_path, ['FP1', 'FP2', 'Q'])
+    plan = maintenance.plan_compaction(fact, small_file_bytes=1024 * 1024, min_files=3)
+    assert [(partition['event_id'], partition['files'], partition['files_after']) for partition in plan] == [('23001A', 3, 1)]
+    assert maintenance.plan_compaction(fact, small_file_bytes=1024 * 1024, min_files=4) == []
+
+
+def test_maintain_table_compacts_and_expires(catalog, tmp_path, settings):
+    fact = append_sessions(catalog, tmp_path, ['FP1', 'FP2', 'Q'])
+    appended = [path.removeprefix('file://') for path in fact.inspect.files().column('file_path').to_pylist()]
+    stray = os.path.join(fact.location().removeprefix('file://'), 'data', 'stray.parquet')
+    with open(stray, 'wb') as f:
+        f.write(b'x' * 10)
+
+    dry_run = maintenance.maintain_table(catalog, 'db', 'fact_telemetry', dry_run=True, write_mode='direct')
+    assert dry_run['compaction']['partitions'] == ['23001A']
+    assert dry_run['expired_snapshots']['snapshots'] == 2
+    assert dry_run['orphans'] == {'files': 1, 'bytes': 10}
+    assert len(catalog.load_table(('db', 'fact_telemetry')).metadata.snapshots) == 3
+    assert os.path.exists(stray)
+
+    report = maintenance.maintain_table(catalog, 'db', 'fact_telemetry', write_mode='direct')
+    fact = catalog.load_table(('db', 'fact_telemetry'))
+    assert len(fact.inspect.files()) == 1
+    assert fact.scan().to_arrow().num_rows == 36
+    # compaction replaced the three appended files, which are freed with the snapshots before it
+    assert report['expired_snapshots']['snapshots'] == 4
+    assert not any(os.path.exists(path) for path in appended)
+    assert not os.path.exists(stray)
+
+
+def test_run_maintenance_sweeps_stale_staging_tables(catalog, tmp_path, settings):
+    append_sessions(catalog, tmp_path, ['R'])
+    catalog.create_table(('db', 'stg_23001A_R'), schema=config.schema, location=f'file://{tmp_path}/stg_23001A_R')
+    report = maintenance.run_maintenance(catalog, 'db', ['fact_telemetry'], dry_run=True)
+    assert list(report['staging_tables']) == ['stg_23001A_R']
+    assert catalog.table_exists(('db', 'stg_23001A_R'))
+
+    report = maintenance.run_maintenance(catalog, 'db', ['fact_telemetry', 'missing'])
+    assert not catalog.table_exists(('db', 'stg_23001A_R'))
+    assert 'error' in report['tables']['missing']
+
+
+def test_run_maintenance_compacts_the_unpartitioned_ledger(catalog, tmp_path, settings):
+    writer = ledger.IcebergLedger(catalog, 'db', config.ledger_table, f'file://{tmp_path}')
+    identities = [{'bucket': 'telem-data', 'key': f'in/23001A_{session}.csv', 'etag': 'abc', 'size': 10} for session in ['FP1', 'FP2', 'Q']]
+    for identity in identities:
+        writer.record(ledger.ledger_entry(identity, 'succeeded', time.time()))
+
+    plan = maintenance.plan_compaction(writer.table, small_file_bytes=1024 * 1024, min_files=3)
+    assert [(partition['event_id'], partition['files'], partition['files_after']) for partition in plan] == [(None, 3, 1)]
+    report = maintenance.run_maintenance(catalog, 'db', write_mode='athena')
+    assert report['tables'][config.ledger_table]['compaction']['files'] == 3
+    assert len(catalog.load_table(('db', config.ledger_table)).inspect.files()) == 1
+    reader = ledger.IcebergLedger(catalog, 'db', config.ledger_table, f'file://{tmp_path}')
+    assert [entry['status'] for entry in reader.lookup_many(identities)] == ['succeeded'] * 3
@@ -0,0 +1,61 @@
+import json
+from unittest.mock import patch
+import main
+from src import metrics
+
+
+def test_stage_records_into_current_invocation():
+    invocation = metrics.start(request_id='r1')
+    try:
+        for rows in (10, 20):
+            with metrics.stage('parse') as stage:
+                stage["rows_out"] = rows
+        metrics.record('athena', data_scanned_bytes=1024, engine_time_ms=None)
+    finally:
+        metrics.finish()
+    assert invocation.stages['parse']['rows_out'] == [10, 20]
+    assert len(invocation.stages['parse']['wall_ms']) == 2
+    assert invocation.stages['athena'] == {'data_scanned_bytes': [1024]}
+    assert metrics.current() is None
+
+
+def test_emf_record():
+    invocation = metrics.Metrics(namespace='Test', dimensions={'service': 'etl'})
+    invocation.record('download', wall_ms=5.0, bytes_read=100)
+    invocation.merge({'download': {'wall_ms': [7.0]}, 'parse': {'rows_out': [3]}})
+    record = invocation.to_emf()
+    directive = record['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == 'Test'
+    assert directive['Dimensions'] == [['service']]
+    assert {'Name': 'download.wall_ms', 'Unit': 'Milliseconds'} in directive['Metrics']
+    assert {'Name': 'download.bytes_read', 'Unit': 'Bytes'} in directive['Metrics']
+    assert record['service'] == 'etl'
+    assert record['download.wall_ms'] == [5.0, 7.0]
+    assert record['parse.rows_out'] == [3]
+
+
+def test_call_with_metrics_collects_separately():
+    def work(rows):
+        with metrics.stage('validate') as stage:
+            stage["rows_in"] = rows
+        return rows * 2
+
+    output, stages = metrics.call_with_metrics(work, 4)
+    assert output == 8
+    assert stages['validate']['rows_in'] == [4]
+    assert metrics.current() is None
+
+
+def test_lambda_handler_emits_one_record(capsys):
+    event = {'Records': [{'eventSource': 'aws:s3', 's3': {'bucket': {'name': 'b'}, 'object': {'key': f'in/23001A_Q{i}.csv'}}} for i in range(2)]}
+
+    def fake_main(bucket, key, pool=None):
+        with metrics.stage('download') as stage:
+            stage["bytes_read"] = 10
+
+    with patch.object(main, 'main', side_effect=fake_main), patch.object(main, 'get_process_pool', return_value=None):
+        main.lambda_handler(event, None)
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+    assert len(records) == 1
+    assert records[0]['download.bytes_read'] == [10, 10]
+    assert records[0]['invocation.files'] == [2]
@@ -0,0 +1,72 @@
+import datetime
+import pytest
+import pyarrow as pa
+from pyiceberg.expressions import AlwaysTrue, And, EqualTo, In
+from src import query, upsert
+from test.helpers import fact_rows
+
+
+def test_build_filter():
+    assert query.build_filter() == AlwaysTrue()
+    assert query.build_filter(event_id='23001A') == EqualTo('event_id', '23001A')
+    assert query.build_filter(event_id='23001A', drivernumber=[1, 44]) == And(
+        EqualTo('event_id', '23001A'), In('drivernumber', {1, 44})
+    )
+
+
+@pytest.fixture
+def fact(catalog, tmp_path):
+    table = upsert.load_fact_table(catalog, 'db', 'fact_telemetry', f'file://{tmp_path}')
+    for session_id in ['Q', 'R']:
+        for driver in [1, 44]:
+            rows = fact_rows(session_id, drivers=(driver,))
+            rows = rows.add_column(0, 'pk_id', pa.array([f'{session_id}{driver}{i}' for i in range(rows.num_rows)]))
+            table.append(rows.cast(table.schema().as_arrow()))
+    return catalog, table
+
+
+def test_query_prunes_files_and_streams_matching_rows(fact):
+    catalog, _ = fact
+    telemetry = query.TelemetryQuery(catalog, 'db', 'fact_telemetry')
+    reader = telemetry.batches(
+        event_id='23001A', session_id='R', drivernumber=44,
+        ts_from=datetime.datetime(2023, 1, 1, 12, 0, 0, 250000), ts_to='2023-01-01T12:00:01',
+        columns=['drivernumber', 'ts', 'speed']
+    )
+    assert isinstance(reader, pa.RecordBatchReader)
+    rows = reader.read_all()
+    assert rows.column_names == ['ts', 'drivernumber', 'speed']
+    assert rows.column('speed').to_pylist() == [101, 102, 103]
+    # min/max stats leave only the file of driver 44 in session R
+    _, tasks = telemetry.plan(query.build_filter(session_id='R', drivernumber=44))
+    assert len(tasks) == 1
+
+
+def test_query_reuses_metadata_and_manifests_until_invalidated(fact):
+    catalog, table = fact
+    telemetry = query.TelemetryQuery(catalog, 'db', 'fact_telemetry', metadata_ttl=3600)
+    assert telemetry.to_arrow(session_id='Q').num_rows == 12
+    misses = telemetry.stats()["manifest_misses"]
+    assert telemetry.to_arrow(session_id='Q', drivernumber=1).num_rows == 6
+    stats = telemetry.stats()
+    assert stats["manifest_misses"] == misses and stats["manifest_hits"] > 0
+    assert stats["plans"] == 2
+
+    rows = fact_rows('FP1')
+    table.append(rows.add_column(0, 'pk_id', pa.array([f'FP1{i}' for i in range(rows.num_rows)])).cast(table.schema().as_arrow()))
+    # cached metadata does not see the append until it expires or is invalidated
+    assert telemetry.to_arrow().num_rows == 24
+    telemetry.invalidate()
+    assert telemetry.to_arrow().num_rows == 36
+
+
+def test_manifests_outlive_metadata_reloads(fact):
+    catalog, _ = fact
+    telemetry = query.TelemetryQuery(catalog, 'db', 'fact_telemetry', metadata_ttl=0)
+    assert telemetry.to_arrow(session_id='Q').num_rows == 12
+    misses = telemetry.stats()["manifest_misses"]
+    manifest_io = telemetry.manifest_io
+    # every query reloads the table and gets a new FileIO, the manifests are still read from memory
+    assert telemetry.to_arrow(session_id='R', drivernumber=44).num_rows == 6
+    assert telemetry.manifest_io is manifest_io
+    assert telemetry.stats()["manifest_misses"] == misses
@@ -0,0 +1,98 @@
+import io
+import gzip
+import re
+import threading
+import pytest
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+from src import etl, ranged
+
+
+class RangedS3:
+    """
+    S3 stand-in that serves byte ranges of one object and counts the GETs.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = '"v1"'
+        self.calls = 0
+        self.conditional = 0
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        with self.lock:
+            self.calls += 1
+            self.conditional += IfMatch is not None
+        if IfMatch is not None and IfMatch != self.etag:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+        if Range is None:
+            return {'Body': io.BytesIO(self.body), 'ContentLength': len(self.body), 'ETag': self.etag}
+        start, end = map(int, re.match(r"bytes=(\d+)-(\d+)", Range).groups())
+        part = self.body[start:end + 1]
+        return {
+            'Body': io.BytesIO(part), 'ETag': self.etag,
+            'ContentRange': f"bytes {start}-{start + len(part) - 1}/{len(self.body)}"
+        }
+
+
+BODY = b"timeUtc,driverNumber,rpm,speed,gear,throttle,brake,drs\n" + b"".join(
+    f"2023-01-01T12:00:{i % 60:02d}Z,44,{12000 + i},300,5,80,0,1\n".encode() for i in range(200)
+)
+
+
+def test_download_small_object_takes_one_get():
+    s3 = RangedS3(BODY)
+    assert ranged.download(s3, 'bucket', 'key', part_size=len(BODY) + 1) == BODY
+    assert s3.calls == 1
+
+
+@pytest.mark.parametrize('part_size', [7, 100, 1000])
+def test_download_in_parts(part_size):
+    s3 = RangedS3(BODY)
+    assert ranged.download(s3, 'bucket', 'key', part_size=part_size, concurrency=3) == BODY
+    assert s3.calls == -(-len(BODY) // part_size)
+
+
+def test_later_ranges_require_the_first_etag():
+    s3 = RangedS3(BODY)
+    parts = ranged.iter_parts(s3, 'bucket', 'key', part_size=1000, concurrency=1)
+    first = next(parts)
+    assert s3.conditional == 0
+    # the object is replaced while it downloads, the rest must not come from the new version
+    s3.body, s3.etag = first + b"x" * len(BODY), '"v2"'
+    with pytest.raises(ClientError, match='PreconditionFailed'):
+        list(parts)
+    assert s3.conditional == 1
+
+
+def test_download_fills_one_buffer_of_the_object_size():
+    body = gzip.compress(BODY)
+    data = ranged.download(RangedS3(body), 'bucket', 'key', part_size=100, concurrency=3)
+    assert isinstance(data, bytearray) and data == body
+    assert etl.parse_file_arrow(data, '23001A_Q1.csv.gz').num_rows == 200
+
+
+def test_iter_lines_realigns_on_newlines():
+    parts = [b"a,b\n1,", b"2\n3,4", b"\n5,6"]
+    chunks = list(ranged.iter_lines(parts))
+    assert b"".join(chunks) == b"a,b\n1,2\n3,4\n5,6"
+    assert all(chunk.endswith(b"\n") for chunk in chunks[:-1])
+
+
+def test_arrow_chunks_from_ranges_match_single_read():
+    _, expected = etl.validate_arrow_data(etl.parse_csv_arrow(BODY))
+    with patch.object(etl.config, 'range_part_size', 500):
+        chunks = list(etl.read_file_arrow_in_chunks('bucket', '23001A_Q1.csv', RangedS3(BODY)))
+    assert len(chunks) > 1
+    rows = [row for chunk in chunks for row in etl.validate_arrow_data(chunk)[1].to_pylist()]
+    assert rows == expected.to_pylist()
+
+
+def test_empty_object():
+    class EmptyS3:
+        def get_object(self, **kwargs):
+            from botocore.exceptions import ClientError
+            raise ClientError({'Error': {'Code': 'InvalidRange'}}, 'GetObject')
+
+    assert ranged.download(EmptyS3(), 'bucket', 'key') == b""
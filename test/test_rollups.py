@@ -0,0 +1,45 @@
+import pyarrow as pa
+from src import rollups, upsert
+from test.helpers import fact_rows
+
+
+def test_driver_session_stats():
+    stats = rollups.driver_session_stats(fact_rows()).to_pylist()
+    assert [row['drivernumber'] for row in stats] == [1, 44]
+    first = stats[0]
+    assert first['samples'] == 6
+    assert first['max_speed'] == 105
+    assert first['avg_throttle'] == 65.0
+    # each sample lasts until the next one, the last sample of a driver counts for nothing
+    assert first['throttle_0_25_s'] == 0.25
+    assert first['throttle_75_100_s'] == 0.5
+    assert first['brake_s'] == 0.75
+    assert first['drs_open_s'] == 0.75
+
+
+def test_downsample_1hz():
+    rows = rollups.downsample_1hz(fact_rows(drivers=(1,))).to_pylist()
+    assert [(row['ts'].second, row['samples']) for row in rows] == [(0, 4), (1, 2)]
+    assert rows[0]['max_speed'] == 103
+    assert rows[1]['avg_throttle'] == 100.0
+
+
+def test_refresh_rollups_replaces_one_session(catalog, tmp_path):
+    fact = upsert.load_fact_table(catalog, 'db', 'fact_telemetry', f'file://{tmp_path}')
+    for session_id in ['Q1', 'R']:
+        rows = fact_rows(session_id)
+        rows = rows.add_column(0, 'pk_id', pa.array([f'{session_id}{i}' for i in range(rows.num_rows)]))
+        fact.append(rows.cast(fact.schema().as_arrow()))
+    rollups.refresh_rollups(catalog, 'db', 'fact_telemetry', f'file://{tmp_path}', '23001A', 'Q1')
+    written = rollups.refresh_rollups(catalog, 'db', 'fact_telemetry', f'file://{tmp_path}', '23001A', 'R')
+    assert written == {'driver_session_stats': 2, 'fact_telemetry_1hz': 4}
+    # refreshing again replaces the session's rows instead of adding to them
+    rollups.refresh_rollups(catalog, 'db', 'fact_telemetry', f'file://{tmp_path}', '23001A', 'R')
+    stats = catalog.load_table(('db', 'driver_session_stats')).scan().to_arrow()
+    assert sorted(stats.column('session_id').to_pylist()) == ['Q1', 'Q1', 'R', 'R']
+    assert catalog.load_table(('db', 'fact_telemetry_1hz')).scan().to_arrow().num_rows == 8
+
+
+def test_sessions_from_keys():
+    keys = ['in/23001A_R.csv', 'in/23001A_Q1.csv.gz', 'other/23001A_R.parquet']
+    assert rollups.sessions(keys) == [('23001A', 'R'), ('23001A', 'Q1')]
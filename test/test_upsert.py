@@ -0,0 +1,41 @@
+import hashlib
+import pyarrow as pa
+from src import upsert
+from test.helpers import staged
+
+
+def test_primary_keys_match_merge_sql():
+    expected = hashlib.md5(b'23001AQ1442023-01-01 12:00:00.000000').hexdigest()
+    assert upsert.primary_keys(staged([12000])).to_pylist() == [expected]
+    # chunked and sliced columns and zoned timestamps hash the same way, one key per row
+    rows = staged(list(range(6)), start=30)
+    rows = pa.concat_tables([rows.slice(0, 2), rows.slice(2)]).slice(1)
+    rows = rows.set_column(5, 'timeUtc', rows.column('timeUtc').cast(pa.timestamp('us', tz='UTC')))
+    assert upsert.primary_keys(rows).to_pylist() == [
+        hashlib.md5(f'23001AQ1442023-01-01 12:00:{second}.000000'.encode()).hexdigest() for second in range(31, 36)
+    ]
+
+
+def test_to_fact_rows_casts_and_renames():
+    rows = upsert.to_fact_rows(staged([12000]))
+    assert rows.column_names == upsert.config.fact_cols
+    assert rows.schema.field('breaks').type == pa.bool_()
+    assert rows.schema.field('drivernumber').type == pa.int32()
+    assert rows.column('breaks').to_pylist() == [True]
+
+
+def test_upsert_replaces_matched_rows_only(catalog, tmp_path):
+    first = upsert.upsert_to_fact_table(staged([1000, 1001]), catalog, 'db', 'fact_telemetry', f'file://{tmp_path}')
+    second = upsert.upsert_to_fact_table(staged([2001, 2002], start=1), catalog, 'db', 'fact_telemetry', f'file://{tmp_path}')
+    assert first == {'inserted': 2, 'updated': 0}
+    assert second == {'inserted': 1, 'updated': 1}
+    rows = catalog.load_table(('db', 'fact_telemetry')).scan().to_arrow().sort_by('ts')
+    assert rows.column('rpm').to_pylist() == [1000, 2001, 2002]
+
+
+def test_to_fact_rows_from_compact_rows():
+    data = staged([12000, 12100])
+    compact = data.set_column(0, 'event_id', data.column('event_id').dictionary_encode())
+    compact = compact.set_column(6, 'driverNumber', compact.column('driverNumber').cast(pa.int8()))
+    compact = compact.set_column(11, 'brake', compact.column('brake').cast(pa.bool_()))
+    assert upsert.to_fact_rows(compact).equals(upsert.to_fact_rows(data))